@@ -38,12 +38,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'catalog.apps.CatalogConfig',
     'users.apps.UsersConfig'
 ]
 
 MIDDLEWARE = [
+    'catalog.middleware.MetricsMiddleware',
+    'catalog.middleware.ServerTimingMiddleware',
+    'catalog.middleware.QueryInspectorMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +88,10 @@ DATABASES = {
         'USER': 'postgres',
         'PASSWORD': os.getenv('password'),
         'PORT': 5432,
+        'OPTIONS': {
+            # Порог схожести для нечеткого поиска товаров по триграммам (catalog.search)
+            'options': '-c pg_trgm.word_similarity_threshold=0.4',
+        },
     }
 }
 
@@ -141,16 +149,79 @@ EMAIL_PORT = 465
 EMAIL_USE_TLS = False
 EMAIL_USE_SSL = True
 
+# Журнал обратной связи от пользователей (JSON Lines)
+FEEDBACK_JOURNAL_PATH = BASE_DIR / 'catalog' / 'data_from_users.jsonl'
+
 AUTH_USER_MODEL = 'users.User'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 LOGIN_URL = '/users/'
 
 CACHE_ENABLED = os.getenv('CACHE_ENABLED') == '1'
-CACHE = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': os.getenv('LOCATION')
+if CACHE_ENABLED:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('LOCATION'),
+            'KEY_PREFIX': 'board_service',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}
 
+# Без общего кэша просмотры публикаций копятся в памяти процесса и переносятся в базу данных им самим не чаще, чем
+# раз в указанное количество секунд; с общим кэшем их переносит команда flush_blog_views
+BLOG_VIEWS_FLUSH_INTERVAL = 30
+
+# Поиск повторяющихся запросов к базе данных (N+1) в рабочем трафике, например на тестовом стенде: группы
+# повторов пишутся в журнал catalog.queries, а при QUERY_INSPECTOR_HEADER=1 сводка добавляется в заголовок ответа
+QUERY_INSPECTOR_ENABLED = os.getenv('QUERY_INSPECTOR_ENABLED') == '1'
+QUERY_INSPECTOR_HEADER = os.getenv('QUERY_INSPECTOR_HEADER') == '1'
+# Минимальное количество запросов с одинаковым отпечатком, при котором они считаются повторяющимися
+QUERY_INSPECTOR_THRESHOLD = int(os.getenv('QUERY_INSPECTOR_THRESHOLD', 2))
+
+# Заголовок Server-Timing для персонала и для запросов с токеном из команды server_timing_token. По умолчанию
+# выключен: профилирование запросов стоит времени, а заголовок раскрывает детали работы приложения
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED') == '1'
+# Срок действия токена Server-Timing в секундах
+SERVER_TIMING_TOKEN_MAX_AGE = 60 * 60 * 24
+
+# Метрики запросов по адресам для Prometheus (страница /metrics). По умолчанию выключены. Для суммирования метрик
+# нескольких рабочих процессов задайте общий каталог METRICS_DIR или адрес Redis METRICS_REDIS_URL. Страница доступна
+# только с токеном METRICS_TOKEN в заголовке Authorization: Bearer; без токена она закрыта
+METRICS_ENABLED = os.getenv('METRICS_ENABLED') == '1'
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_REDIS_URL = os.getenv('METRICS_REDIS_URL')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Интервал сохранения метрик процесса в общее хранилище в секундах
+METRICS_FLUSH_INTERVAL = 5
+# Время в секундах, после которого снимок метрик, не обновлявшийся процессом другого сервера (в METRICS_DIR) или
+# любым процессом (в METRICS_REDIS_URL), переносится в архивный снимок. Должно превышать самый долгий простой процесса без запросов
+METRICS_WORKER_TIMEOUT = 60 * 60
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'catalog.logs.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'json_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'catalog.queries': {
+            'handlers': ['json_console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
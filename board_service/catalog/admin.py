@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Product, Category, Feedback, Blog, Version
+from .models import Product, Category, Feedback, Blog, Version, OutgoingEmail, RenditionJob
+from .moderation import set_published
 
 
 # Register your models here.
@@ -8,8 +9,22 @@ from .models import Product, Category, Feedback, Blog, Version
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'price', 'category', 'published', 'changed', 'is_published')
     list_display_links = ('name', 'category', 'price', 'published',)
-    list_filter = ('category',)
+    list_filter = ('category', 'is_published', 'published')
     search_fields = ('name', 'description',)
+    actions = ('publish_products', 'unpublish_products')
+
+    @admin.action(description='Опубликовать выбранные продукты', permissions=('set_published',))
+    def publish_products(self, request, queryset):
+        updated = set_published(queryset, True)
+        self.message_user(request, f'Опубликовано продуктов: {updated}')
+
+    @admin.action(description='Снять с публикации выбранные продукты', permissions=('set_published',))
+    def unpublish_products(self, request, queryset):
+        updated = set_published(queryset, False)
+        self.message_user(request, f'Снято с публикации продуктов: {updated}')
+
+    def has_set_published_permission(self, request):
+        return request.user.has_perm('catalog.set_published')
 
 
 @admin.register(Category)
@@ -37,3 +52,21 @@ class VersionAdmin(admin.ModelAdmin):
     list_display = ('pk', 'title', 'number', 'is_active')
     list_display_links = ('title', 'number',)
     search_fields = ('title', 'is_active')
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'subject', 'recipients', 'status', 'attempts', 'next_attempt', 'sent',)
+    list_display_links = ('subject',)
+    list_filter = ('status',)
+    search_fields = ('subject', 'recipients')
+    # Текст письма может содержать ссылки для входа и сброса пароля, поэтому в админке не показывается
+    exclude = ('message',)
+
+
+@admin.register(RenditionJob)
+class RenditionJobAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'source', 'status', 'attempts', 'next_attempt', 'created', 'processed',)
+    list_display_links = ('source',)
+    list_filter = ('status',)
+    search_fields = ('source',)
@@ -0,0 +1,268 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.generic import View
+
+from catalog.cache_tags import get_tag_versions, product_tag, CATALOG_TAG, PRODUCTS_TAG
+from catalog.models import Product, Category, Version, Blog
+from catalog.paginators import KeysetPaginator, InvalidCursor
+
+# Размер страницы списков по умолчанию и максимальный размер, который можно запросить параметром limit
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+
+class ApiError(Exception):
+    """Исключение возникает при некорректных параметрах запроса к API и превращается в ответ с кодом status."""
+    status = 400
+
+
+class ApiNotFound(ApiError):
+    """Исключение возникает, если объект не найден."""
+    status = 404
+
+
+def media_url(name):
+    return f'{settings.MEDIA_URL}{name}' if name else None
+
+
+class ApiView(View):
+    """Базовый контроллер API только для чтения. Данные выбираются через .values() только по запрошенным полям
+    (параметр fields=name,price), поэтому объекты моделей не создаются, а ответ сериализуется сразу в JSON.
+    Ответ содержит ETag, который вычисляется дешевым запросом до выборки данных (дата последнего изменения и
+    количество объектов выборки, параметры запроса): если он совпадает с If-None-Match, возвращается 304 без выборки
+    данных и сериализации."""
+
+    model = None
+    # Поле с датой изменения для ETag или None, если ETag вычисляется методом get_validator_parts подкласса
+    changed_field = 'changed'
+    # Поля, доступные в API, и поля, которые возвращаются без параметра fields. Поле id соответствует pk
+    fields = ()
+    default_fields = ()
+    # Функции преобразования значений полей (например, путь к файлу — в адрес)
+    transforms = {}
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def get_fields(self):
+        """Метод возвращает список полей из параметра fields или поля по умолчанию."""
+
+        raw = self.request.GET.get('fields')
+        if not raw:
+            return list(self.default_fields)
+
+        fields = [field.strip() for field in raw.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown:
+            raise ApiError(f'Неизвестные поля: {", ".join(unknown)}. Доступные поля: {", ".join(self.fields)}')
+        return fields
+
+    def get_values(self, queryset, fields, extra=()):
+        """Метод возвращает выборку .values() по запрошенным полям. Поле id выбирается как pk, а поля из extra
+        нужны для пагинации и в ответ не попадают, если не запрошены."""
+
+        columns = {'pk', *extra, *(field for field in fields if field != 'id')}
+        return queryset.values(*columns)
+
+    def serialize(self, row, fields):
+        item = {}
+        for field in fields:
+            value = row['pk'] if field == 'id' else row[field]
+            transform = self.transforms.get(field)
+            item[field] = transform(value) if transform else value
+        return item
+
+    def render(self, payload, status=200):
+        """Метод сериализует ответ в JSON."""
+
+        body = json.dumps(payload, ensure_ascii=False, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+        return HttpResponse(body, status=status, content_type='application/json')
+
+    def get_validator_aggregates(self):
+        return {'changed': Max(self.changed_field), 'count': Count('pk')}
+
+    def get_validator_queryset(self, *args, **kwargs):
+        return self.get_queryset()
+
+    def get_validator_state(self, *args, **kwargs):
+        """Метод выбирает одним запросом агрегации по выборке ответа значения, от которых зависит ответ: дату
+        последнего изменения и количество объектов."""
+        return self.get_validator_queryset(*args, **kwargs).aggregate(**self.get_validator_aggregates())
+
+    def get_validator_parts(self, *args, **kwargs):
+        """Метод возвращает список значений для ETag или None, если ETag не нужен."""
+
+        if self.changed_field is None:
+            return None
+        state = self.get_validator_state(*args, **kwargs)
+        return [state[name] for name in sorted(state)]
+
+    def make_etag(self, parts):
+        if parts is None:
+            return None
+
+        raw = '|'.join(map(str, [self.request.get_full_path(), *parts]))
+        return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        try:
+            etag = self.make_etag(self.get_validator_parts(*args, **kwargs))
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = self.render(self.get_payload(*args, **kwargs))
+        except ApiError as error:
+            return self.render({'error': str(error)}, status=error.status)
+
+        if etag is not None:
+            response['ETag'] = etag
+        return response
+
+    def get_payload(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+class ApiListView(ApiView):
+    """Список объектов. Если задано поле cursor_field, список отсортирован по его убыванию и разбит на страницы по
+    курсору (параметры cursor и limit), иначе возвращается целиком."""
+
+    cursor_field = 'published'
+
+    def get_payload(self, *args, **kwargs):
+        fields = self.get_fields()
+
+        if self.cursor_field is None:
+            rows = self.get_values(self.get_queryset(), fields)
+            return {'results': [self.serialize(row, fields) for row in rows]}
+
+        try:
+            limit = min(int(self.request.GET.get('limit', API_PAGE_SIZE)), API_MAX_PAGE_SIZE)
+        except ValueError:
+            raise ApiError('Параметр limit должен быть числом')
+        if limit < 1:
+            raise ApiError('Параметр limit должен быть больше нуля')
+
+        queryset = self.get_values(self.get_queryset(), fields, extra=(self.cursor_field,))
+        try:
+            page = KeysetPaginator(queryset, limit, self.cursor_field).page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise ApiError('Неверный курсор')
+
+        return {
+            'results': [self.serialize(row, fields) for row in page],
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        }
+
+
+class ApiDetailView(ApiView):
+    """Один объект по pk."""
+
+    def get_validator_queryset(self, pk, *args, **kwargs):
+        return self.get_queryset().filter(pk=pk)
+
+    def get_validator_state(self, pk, *args, **kwargs):
+        state = super().get_validator_state(pk, *args, **kwargs)
+        if not state['count']:
+            raise ApiNotFound(f'Объект {pk} не найден')
+        return state
+
+    def get_payload(self, pk, *args, **kwargs):
+        fields = self.get_fields()
+        row = self.get_values(self.get_queryset().filter(pk=pk), fields).first()
+        if row is None:
+            raise ApiNotFound(f'Объект {pk} не найден')
+        return self.serialize(row, fields)
+
+
+class ProductApiMixin:
+    model = Product
+    fields = ('id', 'name', 'description', 'price', 'category_id', 'image', 'published', 'changed')
+    default_fields = ('id', 'name', 'price', 'category_id', 'published')
+    transforms = {'image': media_url}
+
+    def get_queryset(self):
+        return Product.objects.filter(is_published=True)
+
+
+class ProductApiListView(ProductApiMixin, ApiListView):
+    """Список опубликованных товаров. Дополнительный параметр category фильтрует товары по категории."""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        category = self.request.GET.get('category')
+        if category:
+            if not category.isdigit():
+                raise ApiError('Параметр category должен быть числом')
+            queryset = queryset.filter(category_id=category)
+        return queryset
+
+
+class ProductApiDetailView(ProductApiMixin, ApiDetailView):
+    pass
+
+
+class CategoryApiListView(ApiListView):
+    """Список категорий без пагинации: категорий немного. У категорий нет даты изменения, поэтому ETag вычисляется по
+    версиям тегов кэша, которые сбрасываются при изменении категорий и массовых операциях."""
+
+    model = Category
+    fields = ('id', 'category', 'description')
+    default_fields = fields
+    cursor_field = None
+    changed_field = None
+
+    def get_queryset(self):
+        return Category.objects.order_by('category')
+
+    def get_validator_parts(self, *args, **kwargs):
+        return sorted(get_tag_versions([PRODUCTS_TAG, CATALOG_TAG]).items())
+
+
+class VersionApiListView(ApiListView):
+    """Список версий опубликованного товара без пагинации. Для неизвестного или неопубликованного товара
+    возвращается 404. У версий нет даты изменения, поэтому ETag вычисляется по дате изменения товара и версиям тегов
+    кэша, которые сбрасываются при изменении версий товара."""
+
+    model = Version
+    fields = ('id', 'title', 'number', 'is_active')
+    default_fields = fields
+    cursor_field = None
+    changed_field = None
+
+    def get_queryset(self):
+        return Version.objects.filter(product_id=self.kwargs['pk']).order_by('-number')
+
+    def get_validator_parts(self, pk, *args, **kwargs):
+        changed = Product.objects.filter(pk=pk, is_published=True).values_list('changed', flat=True).first()
+        if changed is None:
+            raise ApiNotFound(f'Товар {pk} не найден')
+        return [changed, *sorted(get_tag_versions([product_tag(pk), CATALOG_TAG]).items())]
+
+
+class BlogApiMixin:
+    model = Blog
+    fields = ('id', 'title', 'slug', 'content', 'image', 'view_count', 'published', 'changed')
+    default_fields = ('id', 'title', 'slug', 'published')
+    transforms = {'image': media_url}
+
+    def get_queryset(self):
+        return Blog.objects.filter(is_active=True)
+
+    def get_validator_aggregates(self):
+        # Количество просмотров изменяется без изменения даты публикации
+        return {**super().get_validator_aggregates(), 'views': Sum('view_count')}
+
+
+class BlogApiListView(BlogApiMixin, ApiListView):
+    pass
+
+
+class BlogApiDetailView(BlogApiMixin, ApiDetailView):
+    pass
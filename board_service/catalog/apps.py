@@ -5,3 +5,13 @@ class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'catalog'
     verbose_name = 'Каталог'
+
+    def ready(self):
+        import catalog.signals  # noqa
+        from catalog import profiling
+
+        # Перехват запросов подключается до открытия соединений с базой данных во всех потоках и только если
+        # включен промежуточный слой, который профилирует запросы; без активного профиля он только передает вызов
+        # дальше
+        if profiling.is_enabled():
+            profiling.install()
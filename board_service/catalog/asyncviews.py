@@ -0,0 +1,103 @@
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.http import Http404
+from django.utils.functional import empty
+from django.views.generic import ListView, DetailView
+from django.views.generic.base import ContextMixin
+
+from catalog.profiling import async_call_site
+
+
+@async_call_site
+async def aget_user(request):
+    """Функция возвращает пользователя текущего запроса в асинхронном контроллере. Объект request.user загружается
+    лениво (сессия и пользователь читаются из базы данных синхронно), поэтому при первом обращении он загружается в
+    потоке через sync_to_async, а дальше используется уже загруженный объект."""
+
+    user = request.user
+    if getattr(user, '_wrapped', None) is empty:
+        await sync_to_async(user._setup)()
+    return user
+
+
+class AsyncListView(ListView):
+    """ListView с асинхронным обработчиком GET. Страница выборки загружается асинхронным ORM (acount и async for) до
+    вызова get_context_data, поэтому ни get_context_data, ни шаблон не выполняют запросов к базе данных из асинхронного
+    кода. Данные, которые нужно загрузить для контекста асинхронно, контроллеры добавляют в aget_context_data.
+    get_queryset может вернуть и уже загруженный список: он разбивается на страницы без запросов."""
+
+    @async_call_site
+    async def get(self, request, *args, **kwargs):
+        self.object_list = self.get_queryset()
+
+        page_size = self.get_paginate_by(self.object_list)
+        if page_size:
+            self._page = await self.apaginate_queryset(self.object_list, page_size)
+        elif isinstance(self.object_list, list):
+            self._page = (None, None, self.object_list, False)
+        else:
+            self._page = (None, None, [row async for row in self.object_list], False)
+
+        context = await self.aget_context_data()
+        return self.render_to_response(context)
+
+    async def apaginate_queryset(self, queryset, page_size):
+        """Асинхронный вариант paginate_queryset для пагинации по номерам страниц: количество объектов считается через
+        acount, а объекты страницы загружаются через async for. Возвращает кортеж (paginator, page, object_list,
+        is_paginated)."""
+
+        paginator = self.get_paginator(
+            queryset, page_size, orphans=self.get_paginate_orphans(), allow_empty_first_page=self.get_allow_empty()
+        )
+        # Paginator.count — это cached_property, поэтому значение, посчитанное асинхронно, подставляется заранее
+        paginator.count = len(queryset) if isinstance(queryset, list) else await queryset.acount()
+
+        page = self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or 1
+        try:
+            page_number = paginator.num_pages if page == 'last' else int(page)
+            page = paginator.page(page_number)
+        except (ValueError, InvalidPage):
+            raise Http404('Неверный номер страницы')
+
+        if not isinstance(page.object_list, list):
+            page.object_list = [row async for row in page.object_list]
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    async def aget_context_data(self, **kwargs):
+        return self.get_context_data(**kwargs)
+
+    def get_context_data(self, **kwargs):
+        """Метод собирает контекст из страницы, загруженной в get. MultipleObjectMixin.get_context_data не вызывается,
+        так как он заново выполняет пагинацию синхронно."""
+
+        paginator, page, object_list, is_paginated = self._page
+        context = {'paginator': paginator, 'page_obj': page, 'is_paginated': is_paginated, 'object_list': object_list}
+
+        context_object_name = self.get_context_object_name(self.object_list)
+        if context_object_name is not None:
+            context[context_object_name] = object_list
+
+        context.update(kwargs)
+        return ContextMixin.get_context_data(self, **context)
+
+
+class AsyncDetailView(DetailView):
+    """DetailView с асинхронным обработчиком GET: объект загружается по pk асинхронным ORM (aget)."""
+
+    @async_call_site
+    async def get(self, request, *args, **kwargs):
+        self.object = await self.aget_object()
+        context = await self.aget_context_data(object=self.object)
+        return self.render_to_response(context)
+
+    async def aget_object(self, queryset=None):
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        try:
+            return await queryset.aget(pk=self.kwargs.get(self.pk_url_kwarg))
+        except queryset.model.DoesNotExist:
+            raise Http404('Объект не найден')
+
+    async def aget_context_data(self, **kwargs):
+        return self.get_context_data(**kwargs)
@@ -0,0 +1,152 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from catalog.asyncviews import aget_user
+from catalog.profiling import async_call_site
+from catalog.services import LOCAL_CACHE_TIMEOUT
+
+# Префиксы ключей кэша для версий тегов и закэшированных страниц
+TAG_PREFIX = 'tag'
+PAGE_PREFIX = 'tagged_page'
+
+
+def product_tag(pk):
+    return f'product:{pk}'
+
+
+def category_tag(pk):
+    return f'category:{pk}'
+
+
+# Общий тег для страниц, которые зависят от всего списка товаров (например, результаты поиска)
+PRODUCTS_TAG = 'products'
+
+# Тег всех страниц каталога. Сбрасывается массовыми операциями, которые обходят сигналы моделей
+CATALOG_TAG = 'catalog'
+
+
+def _tag_key(tag):
+    return f'{TAG_PREFIX}:{tag}'
+
+
+def _merge_versions(keys, found):
+    """Функция возвращает версии тегов, найденные в кэше, и новые версии для тегов, которых в кэше нет (их нужно
+    записать в кэш)."""
+
+    versions = {keys[key]: version for key, version in found.items()}
+    missing = {key: time.time_ns() for key, tag in keys.items() if tag not in versions}
+    versions.update({keys[key]: version for key, version in missing.items()})
+    return versions, missing
+
+
+def get_tag_versions(tags):
+    """Функция возвращает словарь {тег: версия} для переданных тегов. Теги, для которых версии еще нет в кэше,
+    получают новую версию."""
+
+    keys = {_tag_key(tag): tag for tag in tags}
+    versions, missing = _merge_versions(keys, cache.get_many(keys))
+    if missing:
+        cache.set_many(missing, None)
+
+    return versions
+
+
+async def aget_tag_versions(tags):
+    """Асинхронный вариант get_tag_versions."""
+
+    keys = {_tag_key(tag): tag for tag in tags}
+    versions, missing = _merge_versions(keys, await cache.aget_many(keys))
+    if missing:
+        await cache.aset_many(missing, None)
+
+    return versions
+
+
+def invalidate_tags(*tags):
+    """Функция сбрасывает все записи кэша, помеченные хотя бы одним из переданных тегов. Записи не удаляются,
+    а становятся недействительными, так как у тегов меняется версия."""
+
+    if tags:
+        version = time.time_ns()
+        cache.set_many({_tag_key(tag): version for tag in tags}, None)
+
+
+class TaggedCachePageMixin:
+    """Миксин для контроллеров, который кэширует ответы на GET-запросы и помечает их тегами объектов, от которых
+    зависит страница. При изменении объекта достаточно сбросить его тег функцией invalidate_tags, поэтому страницы
+    можно кэшировать надолго. Ключ кэша учитывает пользователя, так как страницы содержат данные о нем.
+
+    Без общего кэша (CACHE_ENABLED) версии тегов и страницы хранятся в памяти каждого процесса, и изменение,
+    обработанное одним процессом, не сбрасывает страницы других процессов. Поэтому в этом случае страницы хранятся
+    не дольше LOCAL_CACHE_TIMEOUT секунд."""
+
+    cache_timeout = 60 * 60 * 6
+
+    def get_cache_timeout(self):
+        if settings.CACHE_ENABLED:
+            return self.cache_timeout
+        return min(self.cache_timeout, LOCAL_CACHE_TIMEOUT)
+
+    def get_cache_tags(self):
+        """Метод возвращает список тегов для текущего ответа. Вызывается после обработки запроса, поэтому может
+        использовать self.object."""
+        return []
+
+    def get_page_cache_key(self, request, user=None):
+        user = user or request.user
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        return f'{PAGE_PREFIX}:{path}:{user.pk if user.is_authenticated else 0}'
+
+    def store_response(self, key, tags, response):
+        """Метод сохраняет ответ в кэш после рендеринга шаблона. Рендеринг выполняется синхронно (в том числе для
+        асинхронных контроллеров), поэтому запись в кэш тоже синхронная."""
+
+        def store(rendered):
+            cache.set(key, (tags, rendered), self.get_cache_timeout())
+
+        if hasattr(response, 'render') and callable(response.render):
+            response.add_post_render_callback(store)
+        else:
+            store(response)
+
+    def dispatch(self, request, *args, **kwargs):
+        """Метод отдает ответ из кэша, если все его теги не изменились с момента сохранения, иначе обрабатывает
+        запрос и сохраняет ответ в кэш вместе с текущими версиями тегов."""
+
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self._adispatch_cached(request, *args, **kwargs)
+
+        key = self.get_page_cache_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            tags, response = entry
+            if get_tag_versions(tags) == tags:
+                return response
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            self.store_response(key, get_tag_versions(self.get_cache_tags()), response)
+
+        return response
+
+    @async_call_site
+    async def _adispatch_cached(self, request, *args, **kwargs):
+        """Вариант dispatch для асинхронных контроллеров: кэш и версии тегов читаются через асинхронный API кэша."""
+
+        key = self.get_page_cache_key(request, await aget_user(request))
+        entry = await cache.aget(key)
+        if entry is not None:
+            tags, response = entry
+            if await aget_tag_versions(tags) == tags:
+                return response
+
+        response = await super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            self.store_response(key, await aget_tag_versions(self.get_cache_tags()), response)
+
+        return response
@@ -0,0 +1,101 @@
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from catalog.asyncviews import aget_user
+from catalog.profiling import async_call_site
+
+
+class ConditionalGetMixin:
+    """Миксин для контроллеров, который поддерживает условные GET-запросы (If-None-Match, If-Modified-Since). ETag и
+    Last-Modified вычисляются дешевыми запросами до обработки запроса, поэтому при совпадении клиент или прокси-сервер
+    получает ответ 304 без выборки данных и рендеринга шаблона. ETag учитывает адрес страницы и пользователя, так как
+    страницы содержат данные о нем. Асинхронные контроллеры переопределяют асинхронные варианты методов
+    (aget_last_modified, aget_etag_parts)."""
+
+    def get_last_modified(self):
+        """Метод возвращает дату последнего изменения данных страницы или None."""
+        return None
+
+    def get_etag_parts(self):
+        """Метод возвращает список значений, от которых зависит содержимое страницы, или None, если ETag не нужен."""
+        return None
+
+    def get_response_etag_parts(self):
+        """Метод возвращает список значений для ETag ответа 200 или None, если подходит ETag, вычисленный до обработки
+        запроса. Переопределяется контроллерами, страница которых изменяется при обработке самого запроса (например,
+        счетчик просмотров), чтобы ETag соответствовал отданному содержимому. Вызывается после обработки запроса и
+        не должен выполнять запросов к базе данных."""
+        return None
+
+    async def aget_last_modified(self):
+        return await sync_to_async(self.get_last_modified)()
+
+    async def aget_etag_parts(self):
+        return await sync_to_async(self.get_etag_parts)()
+
+    def make_etag(self, request, user, parts):
+        if parts is None:
+            return None
+
+        raw = '|'.join(map(str, [request.get_full_path(), user.pk if user.is_authenticated else 0, *parts]))
+        return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+    def get_etag(self, request):
+        return self.make_etag(request, request.user, self.get_etag_parts())
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self._adispatch_conditional(request, *args, **kwargs)
+
+        last_modified = self.get_last_modified()
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        etag = self.get_etag(request)
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            etag = self.make_etag(request, request.user, self.get_response_etag_parts()) or etag
+
+        return self.finalize_response(request, request.user, response, etag, timestamp)
+
+    @async_call_site
+    async def _adispatch_conditional(self, request, *args, **kwargs):
+        """Вариант dispatch для асинхронных контроллеров."""
+
+        user = await aget_user(request)
+        last_modified = await self.aget_last_modified()
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        etag = self.make_etag(request, user, await self.aget_etag_parts())
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = await super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            etag = self.make_etag(request, user, self.get_response_etag_parts()) or etag
+
+        return self.finalize_response(request, user, response, etag, timestamp)
+
+    def finalize_response(self, request, user, response, etag, timestamp):
+        """Метод добавляет к ответу заголовки ETag, Last-Modified, Cache-Control и Vary."""
+
+        if etag is not None:
+            response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+
+        # Кэш браузера и прокси-сервера должен проверять актуальность страницы при каждом запросе. Страницы
+        # авторизованных пользователей не должны храниться в общем кэше прокси-сервера
+        if user.is_authenticated:
+            patch_cache_control(response, no_cache=True, private=True)
+        else:
+            patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+        return response
@@ -0,0 +1,253 @@
+import atexit
+import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Case, F, Value, When
+
+from catalog.models import Blog
+from catalog.outbox import enqueue_mail
+
+# Количество просмотров, при котором автору публикации отправляется поздравление
+VIEW_MILESTONE = 100
+
+# Время в секундах, через которое блокировка переноса счетчиков в Redis снимается, если процесс, выполнявший
+# перенос, завершился аварийно
+FLUSH_LOCK_TIMEOUT = 60
+
+
+class LocalViewCounter:
+    """Счетчики просмотров в памяти процесса {pk публикации: просмотры, еще не записанные в базу данных}. Используется
+    без общего кэша: другие процессы не видят эти счетчики, поэтому процесс сам переносит их в базу данных, когда
+    самому старому незаписанному просмотру исполнится BLOG_VIEWS_FLUSH_INTERVAL секунд (и при завершении)."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Время самого старого незаписанного просмотра
+        self._since = None
+
+    def incr(self, pk):
+        with self._lock:
+            if self._since is None:
+                self._since = time.monotonic()
+            self._counts[pk] = self._counts.get(pk, 0) + 1
+            return self._counts[pk]
+
+    async def aincr(self, pk):
+        return self.incr(pk)
+
+    def get(self, pk):
+        with self._lock:
+            return self._counts.get(pk, 0)
+
+    async def aget(self, pk):
+        return self.get(pk)
+
+    def pending(self):
+        """Метод возвращает копию счетчиков публикаций, у которых есть незаписанные просмотры."""
+
+        with self._lock:
+            return dict(self._counts)
+
+    def subtract(self, counts):
+        """Метод уменьшает счетчики на перенесенные в базу данных значения и удаляет обнуленные."""
+
+        with self._lock:
+            for pk, count in counts.items():
+                left = self._counts.get(pk, 0) - count
+                if left > 0:
+                    self._counts[pk] = left
+                else:
+                    self._counts.pop(pk, None)
+            if not self._counts:
+                self._since = None
+
+    def flush_due(self):
+        """Метод возвращает True, если самый старый незаписанный просмотр пришел не менее BLOG_VIEWS_FLUSH_INTERVAL
+        секунд назад, и отсчитывает интервал заново, чтобы параллельные запросы не переносили счетчики одновременно."""
+
+        with self._lock:
+            now = time.monotonic()
+            if self._since is None or now - self._since < settings.BLOG_VIEWS_FLUSH_INTERVAL:
+                return False
+            self._since = now
+            return True
+
+    def lock(self):
+        """Метод возвращает блокировку переноса счетчиков в базу данных."""
+        return self._flush_lock
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._since = None
+
+
+class RedisViewCounter:
+    """Счетчики просмотров в хеше Redis {pk публикации: просмотры}. Поля хеша — это публикации с незаписанными
+    просмотрами, поэтому перенос в базу данных не перебирает все публикации. Счетчики переносит команда
+    flush_blog_views."""
+
+    key = 'board_service:blog_views'
+
+    # Уменьшение счетчиков на перенесенные значения и удаление обнуленных полей выполняются атомарно, чтобы не
+    # потерять просмотр, пришедший между уменьшением и удалением
+    SUBTRACT_SCRIPT = """
+        for index = 1, #ARGV, 2 do
+            if redis.call('HINCRBY', KEYS[1], ARGV[index], -tonumber(ARGV[index + 1])) <= 0 then
+                redis.call('HDEL', KEYS[1], ARGV[index])
+            end
+        end
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self._subtract = self.client.register_script(self.SUBTRACT_SCRIPT)
+
+    def incr(self, pk):
+        return self.client.hincrby(self.key, pk, 1)
+
+    async def aincr(self, pk):
+        return await sync_to_async(self.incr)(pk)
+
+    def get(self, pk):
+        return int(self.client.hget(self.key, pk) or 0)
+
+    async def aget(self, pk):
+        return await sync_to_async(self.get)(pk)
+
+    def pending(self):
+        return {int(pk): int(count) for pk, count in self.client.hgetall(self.key).items() if int(count) > 0}
+
+    def subtract(self, counts):
+        if counts:
+            self._subtract(keys=[self.key], args=[value for item in counts.items() for value in item])
+
+    def flush_due(self):
+        return False
+
+    def lock(self):
+        """Метод возвращает блокировку переноса счетчиков, общую для всех процессов: без нее два переноса прочитали
+        бы одни и те же счетчики и записали бы просмотры в базу данных дважды."""
+        return self.client.lock(f'{self.key}:flush', timeout=FLUSH_LOCK_TIMEOUT)
+
+
+local_view_counter = LocalViewCounter()
+_redis_view_counter = None
+
+
+def get_view_counter():
+    """Функция возвращает хранилище счетчиков просмотров: хеш в Redis при включенном общем кэше, иначе счетчики в
+    памяти процесса."""
+
+    global _redis_view_counter
+    if not settings.CACHE_ENABLED:
+        return local_view_counter
+    if _redis_view_counter is None:
+        _redis_view_counter = RedisViewCounter(settings.CACHES['default']['LOCATION'])
+    return _redis_view_counter
+
+
+def record_view(pk):
+    """Функция учитывает один просмотр публикации и возвращает количество просмотров, которые еще не записаны в
+    базу данных. Просмотр не пишется в базу данных: счетчики переносит функция flush_view_counts."""
+
+    counter = get_view_counter()
+    count = counter.incr(pk)
+    if counter.flush_due():
+        flush_view_counts()
+    return count
+
+
+async def arecord_view(pk):
+    """Асинхронный вариант record_view."""
+
+    counter = get_view_counter()
+    count = await counter.aincr(pk)
+    if counter.flush_due():
+        await sync_to_async(flush_view_counts)()
+    return count
+
+
+def pending_views(pk):
+    """Функция возвращает количество просмотров публикации, которые еще не записаны в базу данных."""
+    return get_view_counter().get(pk)
+
+
+async def apending_views(pk):
+    """Асинхронный вариант pending_views."""
+    return await get_view_counter().aget(pk)
+
+
+def flush_view_counts():
+    """Функция переносит накопленные просмотры в базу данных одним UPDATE с F()-выражением и возвращает количество
+    обновленных публикаций. Перенос выполняется под блокировкой счетчика в собственной транзакции, а счетчики
+    уменьшаются ровно на перенесенное значение сразу после ее фиксации. Поэтому параллельный перенос не запишет те же
+    просмотры второй раз, а ни просмотры, пришедшие во время переноса, ни просмотры из отмененной транзакции не
+    теряются. Если счетчики уже переносит другой процесс, функция ничего не делает и возвращает 0."""
+
+    counter = get_view_counter()
+    lock = counter.lock()
+    if not lock.acquire(blocking=False):
+        return 0
+
+    try:
+        pending = counter.pending()
+        if not pending:
+            return 0
+
+        with transaction.atomic(durable=True):
+            Blog.objects.filter(pk__in=pending).update(
+                view_count=F('view_count') + Case(*[When(pk=pk, then=Value(count)) for pk, count in pending.items()])
+            )
+        counter.subtract(pending)
+    finally:
+        lock.release()
+
+    return len(pending)
+
+
+def _flush_at_exit():
+    if local_view_counter.pending():
+        try:
+            flush_view_counts()
+        except DatabaseError:
+            # При завершении процесса база данных может быть уже недоступна; теряются только просмотры
+            pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def notify_view_milestones():
+    """Функция ставит в очередь исходящих писем поздравление авторам публикаций, набравших VIEW_MILESTONE
+    просмотров. Публикация отмечается полем milestone_notified в той же транзакции, в которой письмо попадает в
+    очередь, поэтому поздравление отправляется ровно один раз даже при параллельном запуске. Возвращает количество
+    писем, поставленных в очередь."""
+
+    sent = 0
+    candidates = Blog.objects.filter(view_count__gte=VIEW_MILESTONE, milestone_notified=False).values_list(
+        'pk', flat=True)
+    for pk in candidates:
+        with transaction.atomic():
+            blog = Blog.objects.select_for_update(skip_locked=True).filter(pk=pk, milestone_notified=False).first()
+            if blog is None:
+                continue
+            blog.milestone_notified = True
+            blog.save(update_fields=['milestone_notified'])
+
+            # Создание заголовка и тела сообщения для отправки на электронный адрес
+            message = f'Поздравляем!\nВаша публикация "{blog.title}" на сайте Catalogue набрала ' \
+                      f'{VIEW_MILESTONE} просмотров!\n\n С уважением, Администрация сайта!'
+            subject = 'Поздравление от сайта Catalogue'
+            enqueue_mail(subject, message, os.getenv('yandex_login'), (blog.email,))
+            sent += 1
+
+    return sent
@@ -1,8 +1,11 @@
 import re
 
+from django import forms
+from django.db import IntegrityError, transaction
 from django.forms import models, ValidationError, BaseInlineFormSet
 
-from catalog.models import Product, Category, Blog, Version
+from catalog.cache_tags import invalidate_tags, product_tag, PRODUCTS_TAG
+from catalog.models import Product, Category, Blog, Version, Feedback
 
 
 class StyleFormMixin:
@@ -61,20 +64,152 @@ class VersionForm(models.ModelForm):
 
     def clean_number(self):
         cleaned_data = self.cleaned_data['number']
-        if cleaned_data < 1.00:
+        # Если номер не указан, он будет выдан автоматически при сохранении версии
+        if cleaned_data is not None and cleaned_data < 1.00:
             raise ValidationError('Номер версии не может быть меньше 1.00')
         return cleaned_data
 
 
 class VersionBaseInlineFormSet(BaseInlineFormSet):
-    def clean(self):
-        super().clean()
-        active_list = [form.cleaned_data['is_active'] for form in self.forms if 'is_active' in form.cleaned_data]
-        if active_list.count(True) > 1:
-            raise ValidationError('Возможна лишь одна активная версия. Пожалуйста, активируйте только 1 версию.')
+    """Набор форм версий товара. Правило «только одна активная версия» проверяет частичный уникальный индекс в базе
+    данных, поэтому оно соблюдается и при одновременном редактировании товара."""
+
+    one_active_error = 'Возможна лишь одна активная версия. Пожалуйста, активируйте только 1 версию.'
+
+    def save(self, commit=True):
+        """Метод сохраняет версии пачками: удаленные версии удаляются одним DELETE, измененные обновляются одним
+        bulk_update, новые создаются одним bulk_create, а номера всем версиям без номера выдаются сразу. Сигналы
+        post_save версий при этом не отправляются, поэтому кэш страниц товара сбрасывается один раз после фиксации
+        транзакции. Если индекс не позволил сохранить вторую активную версию, изменения версий отменяются, а ошибка
+        добавляется в non_form_errors."""
+
+        if not commit:
+            return super().save(commit)
+
+        self.deleted_objects = []
+        self.changed_objects = []
+        self.new_objects = []
+        for form in self.initial_forms:
+            if form.instance.pk is None:
+                continue
+            if form in self.deleted_forms:
+                self.deleted_objects.append(form.instance)
+            elif form.has_changed():
+                self.changed_objects.append((form.instance, form.changed_data))
+        for form in self.extra_forms:
+            if form.has_changed() and not (self.can_delete and self._should_delete_form(form)):
+                setattr(form.instance, self.fk.name, self.instance)
+                self.new_objects.append(form.instance)
+
+        changed = [version for version, fields in self.changed_objects]
+        fields = {field for version, fields in self.changed_objects for field in fields
+                  if field in self.form._meta.fields}
+        # Сначала снимается активность с отключаемых версий, иначе при переключении активной версии индекс
+        # сработает на промежуточном состоянии
+        released = [version.pk for version, fields in self.changed_objects
+                    if 'is_active' in fields and not version.is_active]
+        unnumbered = [version for version in changed + self.new_objects if version.number is None]
+
+        try:
+            with transaction.atomic():
+                if self.deleted_objects:
+                    Version.objects.filter(pk__in=[version.pk for version in self.deleted_objects]).delete()
+                if released:
+                    Version.objects.filter(pk__in=released, is_active=True).update(is_active=False)
+                if unnumbered:
+                    Version.allocate_numbers(self.instance.pk, unnumbered)
+                    if any(version.pk for version in unnumbered):
+                        fields.add('number')
+                if changed and fields:
+                    Version.objects.bulk_update(changed, sorted(fields))
+                if self.new_objects:
+                    Version.objects.bulk_create(self.new_objects)
+                if changed or self.new_objects:
+                    transaction.on_commit(lambda: invalidate_tags(product_tag(self.instance.pk), PRODUCTS_TAG))
+        except IntegrityError as error:
+            if 'version_one_active_per_product' not in str(error):
+                raise
+            self._non_form_errors.append(self.one_active_error)
+            return []
+
+        return changed + self.new_objects
 
 
 class PublishProductForm(models.ModelForm):
     class Meta:
         model = Product
         fields = ('is_published',)
+
+    def save(self, commit=True):
+        """Метод снимает закрепление товара за модератором: проверка товара завершена."""
+
+        self.instance.claimed_by = None
+        self.instance.claim_expires = None
+        return super().save(commit)
+
+
+class FeedbackExportForm(forms.Form):
+    """Форма параметров выгрузки обратной связи: формат файла, диапазон дат и страна."""
+
+    FORMAT_CSV = 'csv'
+    FORMAT_JSONL = 'jsonl'
+
+    format = forms.ChoiceField(choices=((FORMAT_CSV, 'CSV'), (FORMAT_JSONL, 'JSON Lines')), required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    country = forms.ChoiceField(choices=Feedback.Kinds.choices, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from, date_to = cleaned_data.get('date_from'), cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise ValidationError('Начальная дата не может быть позже конечной')
+        return cleaned_data
+
+
+class PkListField(forms.TypedMultipleChoiceField):
+    """Поле со списком целочисленных pk. Значения не сверяются со списком вариантов, поэтому форма не выполняет
+    запрос к базе данных: несуществующие pk просто не попадут в выборку."""
+
+    def __init__(self, **kwargs):
+        super().__init__(coerce=int, **kwargs)
+
+    def valid_value(self, value):
+        return True
+
+
+class BulkModerationForm(forms.Form):
+    """Форма массовой модерации товаров. Товары выбираются списком pk или фильтром (категория и дата добавления
+    не позже published_before) с флагом apply_to_filter. Фильтр без условий не принимается, чтобы действие не
+    применилось ко всему каталогу."""
+
+    ACTION_PUBLISH = 'publish'
+    ACTION_UNPUBLISH = 'unpublish'
+
+    action = forms.ChoiceField(choices=((ACTION_PUBLISH, 'Опубликовать'), (ACTION_UNPUBLISH, 'Снять с публикации')))
+    products = PkListField(required=False)
+    apply_to_filter = forms.BooleanField(required=False)
+    category = forms.ModelChoiceField(queryset=Category.objects.all(), required=False)
+    published_before = forms.DateTimeField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('products') and not cleaned_data.get('apply_to_filter'):
+            raise ValidationError('Выберите товары или примените действие ко всем товарам по фильтру')
+        if cleaned_data.get('apply_to_filter') and not cleaned_data.get('category') \
+                and not cleaned_data.get('published_before'):
+            raise ValidationError('Укажите категорию или дату добавления товаров для действия по фильтру')
+        return cleaned_data
+
+    def get_queryset(self):
+        """Метод возвращает выборку товаров, к которой применяется действие."""
+
+        queryset = Product.objects.all()
+        if not self.cleaned_data['apply_to_filter']:
+            return queryset.filter(pk__in=self.cleaned_data['products'])
+
+        if self.cleaned_data['category']:
+            queryset = queryset.filter(category=self.cleaned_data['category'])
+        if self.cleaned_data['published_before']:
+            queryset = queryset.filter(published__lte=self.cleaned_data['published_before'])
+        return queryset
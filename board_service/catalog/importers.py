@@ -0,0 +1,358 @@
+import csv
+import hashlib
+import io
+import itertools
+import json
+import time
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from catalog.cache_tags import invalidate_tags, CATALOG_TAG, PRODUCTS_TAG
+from catalog.models import Product
+from catalog.signals import bulk_changes
+from catalog.services import invalidate_category_cache, refresh_homepage_snapshot
+
+# Поля модели Product, которые можно загрузить из файла
+PRODUCT_FIELDS = ('name', 'description', 'price', 'category_id', 'is_published')
+
+# Служебные поля для синхронизации: ключ товара во внешнем каталоге и хэш загруженных данных
+SYNC_FIELDS = ('external_id', 'content_hash')
+
+# Количество строк, которые записываются в базу данных за один раз
+BATCH_SIZE = 5000
+
+# Размер блока (в символах), которым читается файл в формате JSON
+READ_CHUNK_SIZE = 64 * 1024
+
+# Временная таблица с ключами товаров файла, которую заполняет синхронизация
+SYNC_KEYS_TABLE = 'catalog_sync_keys'
+
+
+class ImportFormatError(Exception):
+    """Исключение возникает, если файл не удалось разобрать в указанном формате."""
+    pass
+
+
+def iter_json_array(file, chunk_size=READ_CHUNK_SIZE):
+    """Функция построчно (по объектам) разбирает JSON-массив из файла, не загружая файл в память целиком. В памяти
+    хранится только блок файла и текущий разбираемый объект."""
+
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        # Пропуск пробелов и разделителей между элементами массива
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ImportFormatError('Файл должен содержать JSON-массив')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Объект не поместился в прочитанный блок: читается следующий блок
+                if eof:
+                    raise ImportFormatError('Некорректный JSON')
+            else:
+                if not isinstance(item, dict):
+                    raise ImportFormatError('Элементы JSON-массива должны быть объектами')
+                yield item
+                continue
+        elif eof:
+            raise ImportFormatError('Неожиданный конец файла')
+
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_jsonl(file):
+    """Функция читает объекты из файла в формате JSON Lines, по одному объекту в строке."""
+
+    for number, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise ImportFormatError(f'Некорректный JSON в строке {number}')
+
+
+def iter_csv(file):
+    """Функция читает строки из CSV-файла с заголовком."""
+    yield from csv.DictReader(file)
+
+
+READERS = {
+    'json': iter_json_array,
+    'jsonl': iter_jsonl,
+    'csv': iter_csv,
+}
+
+
+def detect_format(path):
+    """Функция определяет формат файла по расширению."""
+
+    extension = str(path).rsplit('.', 1)[-1].lower()
+    if extension == 'ndjson':
+        return 'jsonl'
+    if extension not in READERS:
+        raise ImportFormatError(f'Неизвестный формат файла: {path}')
+    return extension
+
+
+def batched(iterable, size):
+    """Функция разбивает итерируемый объект на списки длиной не больше size."""
+
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def content_hash(row):
+    """Функция вычисляет хэш данных товара. По нему синхронизация определяет, изменился ли товар."""
+
+    raw = json.dumps([row[field] for field in PRODUCT_FIELDS], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def natural_key(row):
+    """Функция возвращает ключ товара без external_id по полям, которые его определяют: категории и названию. Ключ не
+    зависит от остальных полей, поэтому при изменении цены или описания запись сопоставляется с тем же товаром, и он
+    обновляется, а не создается заново."""
+    return f'name:{row["category_id"]}:{row["name"]}'
+
+
+def normalize(record):
+    """Функция оставляет в записи только поля модели Product, приводит значения к типам полей (в CSV все значения —
+    строки) и добавляет служебные поля. Ключом товара служит external_id, а если его нет — категория и название (см.
+    natural_key)."""
+
+    row = {field: record.get(field) for field in PRODUCT_FIELDS}
+    row['is_published'] = row['is_published'] in (True, 'true', 'True', '1', 1)
+    for field in ('description', 'category_id'):
+        if row[field] == '':
+            row[field] = None
+    try:
+        row['price'] = float(row['price'])
+        row['category_id'] = int(row['category_id']) if row['category_id'] is not None else None
+    except (TypeError, ValueError):
+        raise ImportFormatError(f'Некорректная цена или категория у товара: {record}')
+
+    if not row['name']:
+        raise ImportFormatError(f'Не указано название товара: {record}')
+    row['external_id'] = str(record.get('external_id') or natural_key(row))
+    row['content_hash'] = content_hash(row)
+    return row
+
+
+def check_unique(rows):
+    """Функция проверяет, что ключи external_id в пачке строк не повторяются. Повтор ключа (одинаковый external_id
+    или одинаковые категория и название у записей без него) — ошибка в файле: без проверки одна из записей молча
+    потерялась бы. Повторы между пачками находит уникальный индекс (см. duplicate_key_error), поэтому в памяти
+    хранятся только ключи одной пачки."""
+
+    seen = set()
+    for row in rows:
+        if row['external_id'] in seen:
+            raise ImportFormatError(f'Повторяющийся external_id в файле: {row["external_id"]} (товар «{row["name"]}»)')
+        seen.add(row['external_id'])
+
+
+def duplicate_key_error(error):
+    return ImportFormatError(f'Повторяющийся external_id в файле: {error}')
+
+
+def create_sync_keys_table():
+    """Функция создает временную таблицу для ключей товаров файла. Первичный ключ таблицы находит повторы ключей, а
+    товары, которых нет в файле, выбираются запросом к ней (см. missing_products), поэтому ключи не хранятся в
+    памяти. Таблица создается в транзакции синхронизации и удаляется в ней же (или при ее отмене)."""
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMPORARY TABLE {SYNC_KEYS_TABLE} (external_id varchar(255) PRIMARY KEY)')
+
+
+def drop_sync_keys_table():
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE {SYNC_KEYS_TABLE}')
+
+
+def stage_keys(rows):
+    """Функция записывает ключи пачки строк во временную таблицу одним запросом INSERT."""
+
+    values = ', '.join(['(%s)'] * len(rows))
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {SYNC_KEYS_TABLE} (external_id) VALUES {values}',
+                           [row['external_id'] for row in rows])
+    except IntegrityError as error:
+        raise duplicate_key_error(error)
+
+
+def missing_products():
+    """Функция возвращает выборку товаров с external_id, ключей которых нет во временной таблице: разность
+    вычисляется базой данных."""
+
+    return Product.objects.filter(external_id__isnull=False).exclude(
+        external_id__in=RawSQL(f'SELECT external_id FROM {SYNC_KEYS_TABLE}', ())
+    )
+
+
+def supports_copy():
+    """Функция проверяет, можно ли загрузить данные командой COPY (PostgreSQL с драйвером psycopg2)."""
+
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        return hasattr(cursor.cursor, 'copy_expert')
+
+
+def copy_rows(rows):
+    """Функция загружает пачку строк в таблицу товаров командой COPY FROM STDIN."""
+
+    now = timezone.now().isoformat()
+    columns = PRODUCT_FIELDS + SYNC_FIELDS + ('published', 'changed')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[field] for field in PRODUCT_FIELDS + SYNC_FIELDS] + [now, now])
+    buffer.seek(0)
+
+    sql = f'COPY {Product._meta.db_table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)'
+    # Ошибки драйвера при вызове copy_expert преобразуются в исключения Django, как при обычных запросах
+    with connection.cursor() as cursor, connection.wrap_database_errors:
+        cursor.cursor.copy_expert(sql, buffer)
+
+
+def create_rows(rows):
+    """Функция загружает пачку строк в таблицу товаров через bulk_create."""
+    Product.objects.bulk_create([Product(**row) for row in rows], batch_size=len(rows))
+
+
+def delete_products(queryset):
+    """Функция удаляет товары выборки queryset через QuerySet.delete(), поэтому связанные объекты обрабатываются по
+    on_delete их внешних ключей. Обработчики сигналов, которые сбрасывают кэш, внутри блока bulk_changes ничего не
+    делают (иначе каждая удаленная строка сбрасывала бы кэш и перестраивала снимок главной страницы), поэтому кэш
+    сбрасывает вызывающий код. Возвращает количество удаленных товаров."""
+
+    with bulk_changes():
+        _, deleted = queryset.delete()
+    return deleted.get(Product._meta.label, 0)
+
+
+def truncate_products():
+    """Функция удаляет все товары (вместе со связанными версиями) и сбрасывает последовательность первичных ключей,
+    если это поддерживает база данных."""
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE TABLE {Product._meta.db_table} RESTART IDENTITY CASCADE')
+    else:
+        delete_products(Product.objects.all())
+
+
+def import_products(file, file_format, batch_size=BATCH_SIZE, use_copy=True, truncate=True, progress=None):
+    """Функция потоково загружает товары из файла пачками по batch_size строк и возвращает количество загруженных
+    строк. На PostgreSQL используется COPY FROM STDIN, на остальных базах данных — bulk_create. После каждой пачки
+    вызывается функция progress(загружено строк, строк в секунду). Загрузка выполняется в одной транзакции, после
+    которой сбрасывается кэш категорий и страниц товаров (сигналы моделей при массовой загрузке не отправляются).
+    Повторяющиеся ключи находит уникальный индекс external_id."""
+
+    write = copy_rows if use_copy and supports_copy() else create_rows
+    records = (normalize(record) for record in READERS[file_format](file))
+
+    total = 0
+    started = time.monotonic()
+    with transaction.atomic():
+        if truncate:
+            truncate_products()
+        for batch in batched(records, batch_size):
+            check_unique(batch)
+            try:
+                write(batch)
+            except IntegrityError as error:
+                raise duplicate_key_error(error)
+            total += len(batch)
+            if progress is not None:
+                progress(total, total / max(time.monotonic() - started, 1e-6))
+
+    invalidate_category_cache()
+    invalidate_tags(CATALOG_TAG, PRODUCTS_TAG)
+    refresh_homepage_snapshot()
+
+    return total
+
+
+def sync_products(file, file_format, batch_size=BATCH_SIZE, delete_missing=True, progress=None):
+    """Функция синхронизирует товары с файлом без полной перезагрузки таблицы. Записи сопоставляются с товарами по
+    external_id: новые товары добавляются, а существующие перезаписываются, только если изменился хэш их данных.
+    Товары с external_id, которых нет в файле, удаляются (если delete_missing=True). Товары, добавленные на сайте
+    (без external_id), не затрагиваются. Если ключ повторяется в файле, синхронизация отменяется с ошибкой
+    ImportFormatError. Ключи файла записываются во временную таблицу, поэтому повторы и отсутствующие в файле товары
+    находит база данных, а расход памяти не зависит от размера файла. Функция возвращает словарь с количеством
+    добавленных, измененных, неизменных и удаленных товаров."""
+
+    records = (normalize(record) for record in READERS[file_format](file))
+    stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+
+    started = time.monotonic()
+    with transaction.atomic():
+        create_sync_keys_table()
+        for batch in batched(records, batch_size):
+            check_unique(batch)
+            stage_keys(batch)
+
+            # Для пачки выполняется один запрос к существующим товарам по уникальному индексу external_id
+            rows = {row['external_id']: row for row in batch}
+            existing = dict(
+                Product.objects.filter(external_id__in=rows).values_list('external_id', 'content_hash')
+            )
+
+            to_write = []
+            for external_id, row in rows.items():
+                if external_id not in existing:
+                    stats['created'] += 1
+                elif existing[external_id] != row['content_hash']:
+                    stats['updated'] += 1
+                else:
+                    stats['unchanged'] += 1
+                    continue
+                to_write.append(Product(**row))
+
+            if to_write:
+                Product.objects.bulk_create(
+                    to_write, batch_size=batch_size, update_conflicts=True, unique_fields=['external_id'],
+                    update_fields=PRODUCT_FIELDS + ('content_hash', 'changed'),
+                )
+            if progress is not None:
+                processed = stats['created'] + stats['updated'] + stats['unchanged']
+                progress(processed, processed / max(time.monotonic() - started, 1e-6))
+
+        if delete_missing:
+            missing = missing_products().order_by('pk').values_list('pk', flat=True)
+            while pks := list(missing[:batch_size]):
+                stats['deleted'] += delete_products(Product.objects.filter(pk__in=pks))
+
+        drop_sync_keys_table()
+
+    # Товары записываются через bulk_create, который не отправляет сигналы моделей, и удаляются функцией
+    # delete_products, при которой сигналы не сбрасывают кэш, поэтому кэш сбрасывается здесь один раз. Список
+    # затронутых товаров не хранится, поэтому сбрасываются все страницы каталога
+    if stats['created'] or stats['updated'] or stats['deleted']:
+        invalidate_category_cache()
+        invalidate_tags(CATALOG_TAG, PRODUCTS_TAG)
+        refresh_homepage_snapshot()
+
+    return stats
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import fcntl
+except ImportError:
+    # В Windows нет fcntl: журнал работает, но без блокировки между процессами
+    fcntl = None
+
+# Размер файла журнала (в байтах), после которого файл ротируется, и количество хранимых старых файлов
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+# Данные журнала сбрасываются на диск (fsync) не после каждой записи, а группой: после FSYNC_EVERY записей или
+# по истечении FSYNC_INTERVAL секунд с последнего сброса
+FSYNC_EVERY = 20
+FSYNC_INTERVAL = 1.0
+
+
+class Journal:
+    """Журнал с записями в формате JSON Lines, в который можно только дописывать. Запись занимает постоянное время
+    и не зависит от размера журнала. Несколько процессов могут писать в журнал одновременно: запись и ротация
+    выполняются под блокировкой отдельного lock-файла."""
+
+    def __init__(self, path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, fsync_every=FSYNC_EVERY,
+                 fsync_interval=FSYNC_INTERVAL):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """Контекстный менеджер блокирует журнал для текущего потока и процесса."""
+
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(f'{self.path}.lock', 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _backup_path(self, number):
+        return f'{self.path}.{number}'
+
+    def _rotate(self):
+        """Метод переименовывает текущий файл журнала в path.1, сдвигая старые файлы, и удаляет самый старый."""
+
+        for number in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(self._backup_path(number)):
+                os.replace(self._backup_path(number), self._backup_path(number + 1))
+        if self.backup_count:
+            os.replace(self.path, self._backup_path(1))
+        else:
+            os.remove(self.path)
+
+    def append(self, record):
+        """Метод дописывает запись в конец журнала."""
+
+        line = json.dumps(record, ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
+        with self._locked():
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(line)
+                file.flush()
+
+                self._unsynced += 1
+                now = time.monotonic()
+                if self._unsynced >= self.fsync_every or now - self._last_sync >= self.fsync_interval:
+                    os.fsync(file.fileno())
+                    self._unsynced = 0
+                    self._last_sync = now
+
+    def paths(self):
+        """Метод возвращает пути к файлам журнала от самого старого к самому новому."""
+
+        backups = [self._backup_path(number) for number in range(self.backup_count, 0, -1)]
+        return [path for path in backups + [self.path] if os.path.exists(path)]
+
+    def read(self):
+        """Метод построчно читает все записи журнала от самой старой к самой новой, не загружая файлы в память
+        целиком. Недописанная последняя строка (например, при аварийном завершении процесса) пропускается."""
+
+        for path in self.paths():
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+
+feedback_journal = Journal(settings.FEEDBACK_JOURNAL_PATH)
@@ -0,0 +1,19 @@
+import json
+import logging
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматтер журнала, который выводит каждую запись одной строкой JSON: время, уровень, имя журнала, сообщение и
+    поля, переданные в extra={'fields': {...}}. Такие записи можно собирать и группировать в системе сбора журналов."""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
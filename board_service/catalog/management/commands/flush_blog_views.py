@@ -0,0 +1,24 @@
+import time
+
+from django.core.management import BaseCommand
+
+from catalog.counters import flush_view_counts, notify_view_milestones
+
+
+class Command(BaseCommand):
+    help = 'Переносит накопленные просмотры публикаций в базу данных и отправляет поздравления авторам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Интервал повторного запуска в секундах. По умолчанию команда выполняется один раз.')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            flushed = flush_view_counts()
+            sent = notify_view_milestones()
+            self.stdout.write(f'Обновлено публикаций: {flushed}, отправлено поздравлений: {sent}')
+
+            if not interval:
+                break
+            time.sleep(interval)
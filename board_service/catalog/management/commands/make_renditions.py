@@ -0,0 +1,41 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+
+from catalog.models import Product, Blog
+from catalog.renditions import process_pending_renditions, enqueue_renditions, BATCH_SIZE, MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные копии (миниатюры и WebP) изображений из очереди обработки.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Количество изображений, обрабатываемых за один проход.')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                            help='Количество попыток обработки изображения.')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Интервал опроса очереди в секундах. По умолчанию очередь разбирается один раз.')
+        parser.add_argument('--backfill', action='store_true',
+                            help='Поставить в очередь все уже загруженные изображения товаров, блогов и аватары.')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            for queryset in (Product.objects.exclude(image='').values_list('image', flat=True),
+                             Blog.objects.exclude(image='').values_list('image', flat=True),
+                             get_user_model().objects.exclude(avatar='').values_list('avatar', flat=True)):
+                for name in queryset.iterator():
+                    enqueue_renditions(name)
+
+        while True:
+            while True:
+                done, failed = process_pending_renditions(options['batch_size'], options['max_attempts'])
+                if done or failed:
+                    self.stdout.write(f'Обработано изображений: {done}, ошибок: {failed}')
+                if done + failed < options['batch_size']:
+                    break
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -1,19 +1,33 @@
-from django.core.management import BaseCommand
-from django.db import connection
-from catalog.models import Product
-import json
+from django.core.management import BaseCommand, CommandError
+
+from catalog.importers import import_products, detect_format, ImportFormatError, BATCH_SIZE, READERS
 
 
 class Command(BaseCommand):
+    help = 'Загружает товары из файла (JSON-массив, JSON Lines или CSV) потоково, пачками по batch-size строк.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='catalog_data.json', help='Путь к файлу с товарами.')
+        parser.add_argument('--format', choices=tuple(READERS),
+                            help='Формат файла. По умолчанию определяется по расширению.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Количество строк, записываемых в базу данных за один раз.')
+        parser.add_argument('--no-truncate', action='store_true',
+                            help='Не удалять существующие товары перед загрузкой.')
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Не использовать COPY FROM STDIN, загружать через bulk_create.')
+
     def handle(self, *args, **options):
-        cur = connection.cursor()
-        cur.execute("TRUNCATE TABLE catalog_product RESTART IDENTITY")
-        cur.close()
+        def progress(total, rate):
+            self.stdout.write(f'Загружено строк: {total} ({rate:.0f} строк/с)')
 
-        with open('catalog_data.json', 'r', encoding='utf-8') as file:
-            db = []
-            data = json.load(file)
-            for elem in data:
-                db.append(Product(**elem))
+        try:
+            file_format = options['format'] or detect_format(options['path'])
+            with open(options['path'], 'r', encoding='utf-8', newline='') as file:
+                total = import_products(file, file_format, batch_size=options['batch_size'],
+                                        use_copy=not options['no_copy'], truncate=not options['no_truncate'],
+                                        progress=progress)
+        except (OSError, ImportFormatError) as error:
+            raise CommandError(error)
 
-            Product.objects.bulk_create(db)
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f'Загрузка завершена, всего строк: {total}'))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management import BaseCommand
+
+from catalog.outbox import send_pending_mail, BATCH_SIZE, MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из очереди исходящих писем пачками через одно соединение с почтовым сервером.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Количество писем, отправляемых через одно соединение.')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                            help='Количество попыток отправки письма.')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Интервал опроса очереди в секундах. По умолчанию очередь разбирается один раз.')
+
+    def handle(self, *args, **options):
+        while True:
+            # Очередь разбирается пачками, пока в ней есть письма, готовые к отправке
+            while True:
+                sent, failed = send_pending_mail(options['batch_size'], options['max_attempts'])
+                if sent or failed:
+                    self.stdout.write(f'Отправлено писем: {sent}, ошибок: {failed}')
+                if sent + failed < options['batch_size']:
+                    break
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from catalog.middleware import SERVER_TIMING_TOKEN_HEADER, make_server_timing_token
+
+
+class Command(BaseCommand):
+    help = 'Выводит подписанный токен, который включает заголовок Server-Timing в ответах на запросы с этим токеном.'
+
+    def handle(self, *args, **options):
+        hours = settings.SERVER_TIMING_TOKEN_MAX_AGE // 3600
+        self.stdout.write(f'{SERVER_TIMING_TOKEN_HEADER}: {make_server_timing_token()}')
+        self.stdout.write(f'Токен действителен {hours} ч.')
+        if not settings.SERVER_TIMING_ENABLED:
+            self.stderr.write('Заголовок Server-Timing выключен: задайте SERVER_TIMING_ENABLED=1.')
@@ -0,0 +1,35 @@
+from django.core.management import BaseCommand, CommandError
+
+from catalog.importers import sync_products, detect_format, ImportFormatError, BATCH_SIZE, READERS
+
+
+class Command(BaseCommand):
+    help = ('Синхронизирует товары с файлом (JSON-массив, JSON Lines или CSV): добавляет новые, обновляет только '
+            'изменившиеся и удаляет отсутствующие в файле товары. Товары сопоставляются по external_id (или по '
+            'категории и названию, если external_id в файле нет).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='catalog_data.json', help='Путь к файлу с товарами.')
+        parser.add_argument('--format', choices=tuple(READERS),
+                            help='Формат файла. По умолчанию определяется по расширению.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Количество строк, сверяемых с базой данных за один раз.')
+        parser.add_argument('--keep-missing', action='store_true',
+                            help='Не удалять товары, которых нет в файле.')
+
+    def handle(self, *args, **options):
+        def progress(total, rate):
+            self.stdout.write(f'Обработано строк: {total} ({rate:.0f} строк/с)')
+
+        try:
+            file_format = options['format'] or detect_format(options['path'])
+            with open(options['path'], 'r', encoding='utf-8', newline='') as file:
+                stats = sync_products(file, file_format, batch_size=options['batch_size'],
+                                      delete_missing=not options['keep_missing'], progress=progress)
+        except (OSError, ImportFormatError) as error:
+            raise CommandError(error)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Синхронизация завершена. Добавлено: {stats["created"]}, изменено: {stats["updated"]}, '
+            f'без изменений: {stats["unchanged"]}, удалено: {stats["deleted"]}'
+        ))
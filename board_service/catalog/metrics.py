@@ -0,0 +1,432 @@
+import atexit
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Границы интервалов гистограмм
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+RATIO_BUCKETS = (0, 0.25, 0.5, 0.75, 0.9, 1)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Формат текстового представления метрик Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Имя снимка, в который складываются значения метрик завершившихся процессов
+ARCHIVE = 'archive'
+
+# Время в секундах, через которое блокировка архивирования снимков в Redis снимается, если процесс, выполнявший
+# архивирование, завершился аварийно
+ARCHIVE_LOCK_TIMEOUT = 60
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}' if labels else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Процесс существует, но принадлежит другому пользователю
+        return True
+    return True
+
+
+def merge_snapshots(snapshots):
+    """Функция суммирует снимки метрик {имя: [[метки, значение]]} в один снимок того же вида: значения счетчиков
+    складываются, у гистограмм складываются количества в интервалах и суммы наблюдений."""
+
+    merged = {}
+    for snapshot in snapshots:
+        for name, values in snapshot.items():
+            target = merged.setdefault(name, {})
+            for labels, value in values:
+                key = tuple(map(tuple, labels))
+                current = target.get(key)
+                if current is None:
+                    target[key] = value
+                elif isinstance(value, dict):
+                    target[key] = {
+                        'buckets': [total + count for total, count in zip(current['buckets'], value['buckets'])],
+                        'sum': current['sum'] + value['sum'],
+                    }
+                else:
+                    target[key] = current + value
+    return {name: [[list(map(list, key)), value] for key, value in values.items()] for name, values in merged.items()}
+
+
+class Metric:
+    """Базовый класс метрики с метками. Значения хранятся в памяти процесса в словаре {метки: значение}, где метки —
+    кортеж пар (имя, значение) в порядке labelnames."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def snapshot(self):
+        """Метод возвращает значения метрики в виде, пригодном для JSON: список пар [метки, значение]."""
+
+        with self._lock:
+            return [[list(map(list, key)), self._copy(value)] for key, value in self._values.items()]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _copy(self, value):
+        return value
+
+    def merge(self, values, other):
+        raise NotImplementedError
+
+    def samples(self, values):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, values, other):
+        for key, value in other.items():
+            values[key] = values.get(key, 0) + value
+
+    def samples(self, values):
+        for key, value in values.items():
+            yield self.name, key, value
+
+
+class Histogram(Metric):
+    """Гистограмма: количество наблюдений в каждом интервале buckets (последний интервал — +Inf), сумма и
+    количество наблюдений."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0}
+            state['buckets'][index] += 1
+            state['sum'] += value
+
+    def _copy(self, value):
+        return {'buckets': list(value['buckets']), 'sum': value['sum']}
+
+    def merge(self, values, other):
+        for key, value in other.items():
+            state = values.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0})
+            state['buckets'] = [total + count for total, count in zip(state['buckets'], value['buckets'])]
+            state['sum'] += value['sum']
+
+    def samples(self, values):
+        for key, value in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, value['buckets']):
+                cumulative += count
+                yield f'{self.name}_bucket', key + (('le', _format_value(bound)),), cumulative
+            yield f'{self.name}_sum', key, value['sum']
+            yield f'{self.name}_count', key, cumulative
+
+
+class DirectoryStore:
+    """Хранилище снимков метрик рабочих процессов в общем каталоге: у каждого процесса свой JSON-файл, который
+    перезаписывается атомарно. Снимки завершившихся процессов при чтении складываются в архивный снимок
+    archive.json, а их файлы удаляются, поэтому суммы счетчиков и гистограмм не уменьшаются после перезапуска
+    процессов. Процессы этого сервера проверяются по pid, а файлы, которые не обновлялись дольше max_age секунд
+    (например, процессов другого сервера или контейнера), считаются файлами завершившихся процессов."""
+
+    def __init__(self, path, max_age=None):
+        self.path = Path(path)
+        self.max_age = max_age
+
+    @property
+    def archive(self):
+        return self.path / f'{ARCHIVE}.json'
+
+    def is_dead(self, path):
+        if path == self.archive:
+            return False
+        hostname, _, pid = path.stem.rpartition('-')
+        if hostname == socket.gethostname() and pid.isdigit():
+            return not _pid_exists(int(pid))
+        return self.max_age is not None and time.time() - path.stat().st_mtime > self.max_age
+
+    def _read(self, path):
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            # Файл процесса, который завершился во время записи, пропускается
+            return None
+
+    def prune(self):
+        """Метод складывает снимки завершившихся процессов в архивный снимок и удаляет их файлы. Архивирование
+        выполняется под блокировкой файла каталога, чтобы параллельное чтение метрик не добавило один и тот же снимок
+        в архив дважды."""
+
+        if not self.path.is_dir():
+            return
+        with open(self.path / '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dead = []
+            for path in self.path.glob('*.json'):
+                try:
+                    if self.is_dead(path):
+                        dead.append(path)
+                except FileNotFoundError:
+                    continue
+            if not dead:
+                return
+
+            snapshots = [self._read(path) for path in [self.archive, *dead] if path.exists()]
+            self.save(ARCHIVE, merge_snapshots(snapshot for snapshot in snapshots if snapshot is not None))
+            for path in dead:
+                path.unlink(missing_ok=True)
+
+    def save(self, worker, snapshot):
+        self.path.mkdir(parents=True, exist_ok=True)
+        target = self.path / f'{worker}.json'
+        temporary = target.with_suffix('.tmp')
+        temporary.write_text(json.dumps(snapshot))
+        os.replace(temporary, target)
+
+    def load_all(self):
+        self.prune()
+        snapshots = (self._read(path) for path in self.path.glob('*.json'))
+        return [snapshot for snapshot in snapshots if snapshot is not None]
+
+
+class RedisStore:
+    """Хранилище снимков метрик рабочих процессов в хеше Redis {процесс: JSON}; подходит для процессов на разных
+    серверах. Время последнего сохранения каждого процесса хранится в отдельном хеше: снимки процессов, которые не
+    сохранялись дольше max_age секунд, при чтении складываются в архивное поле хеша и удаляются, поэтому хеш не
+    растет с каждым перезапуском процессов, а суммы счетчиков и гистограмм не уменьшаются."""
+
+    key = 'board_service:metrics'
+    heartbeats_key = 'board_service:metrics:heartbeats'
+
+    def __init__(self, url, max_age=None):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.max_age = max_age
+
+    def save(self, worker, snapshot):
+        with self.client.pipeline() as pipeline:
+            pipeline.hset(self.key, worker, json.dumps(snapshot))
+            pipeline.hset(self.heartbeats_key, worker, time.time())
+            pipeline.execute()
+
+    def prune(self):
+        """Метод складывает снимки завершившихся процессов в архивное поле и удаляет их. Архивирование выполняется под
+        блокировкой Redis; если архивированием уже занят другой процесс, метод ничего не делает."""
+
+        if self.max_age is None:
+            return
+        lock = self.client.lock(f'{self.key}:archive', timeout=ARCHIVE_LOCK_TIMEOUT)
+        if not lock.acquire(blocking=False):
+            return
+
+        try:
+            deadline = time.time() - self.max_age
+            dead = [worker for worker, heartbeat in self.client.hgetall(self.heartbeats_key).items()
+                    if float(heartbeat) < deadline]
+            if not dead:
+                return
+
+            values = self.client.hmget(self.key, [ARCHIVE, *dead])
+            archive = merge_snapshots(json.loads(value) for value in values if value is not None)
+            with self.client.pipeline() as pipeline:
+                pipeline.hset(self.key, ARCHIVE, json.dumps(archive))
+                pipeline.hdel(self.key, *dead)
+                pipeline.hdel(self.heartbeats_key, *dead)
+                pipeline.execute()
+        finally:
+            lock.release()
+
+    def load_all(self):
+        self.prune()
+        return [json.loads(value) for value in self.client.hgetall(self.key).values()]
+
+
+class Registry:
+    """Набор метрик процесса. Если задан METRICS_REDIS_URL или METRICS_DIR, то снимок метрик процесса не реже
+    METRICS_FLUSH_INTERVAL секунд (и при завершении процесса) сохраняется в общее хранилище, а страница /metrics
+    суммирует снимки всех рабочих процессов. Без общего хранилища показываются метрики только текущего процесса."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._store = None
+        self._store_ready = False
+        self._last_flush = 0
+        self._flush_lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+    def reset_store(self):
+        self._store = None
+        self._store_ready = False
+
+    def get_store(self):
+        if not self._store_ready:
+            if settings.METRICS_REDIS_URL:
+                self._store = RedisStore(settings.METRICS_REDIS_URL, settings.METRICS_WORKER_TIMEOUT)
+            elif settings.METRICS_DIR:
+                self._store = DirectoryStore(settings.METRICS_DIR, settings.METRICS_WORKER_TIMEOUT)
+            self._store_ready = True
+        return self._store
+
+    @property
+    def worker(self):
+        # Идентификатор вычисляется при каждом сохранении: рабочие процессы, созданные через fork, получают свой
+        return f'{socket.gethostname()}-{os.getpid()}'
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def flush(self):
+        """Метод сохраняет снимок метрик процесса в общее хранилище."""
+
+        store = self.get_store()
+        if store is not None:
+            with self._flush_lock:
+                store.save(self.worker, self.snapshot())
+                self._last_flush = time.monotonic()
+
+    def flush_due(self):
+        return time.monotonic() - self._last_flush >= settings.METRICS_FLUSH_INTERVAL
+
+    def maybe_flush(self):
+        if self.flush_due():
+            self.flush()
+
+    async def amaybe_flush(self):
+        """Асинхронный вариант maybe_flush: снимок сохраняется в отдельном потоке, чтобы запись в файл или Redis не
+        блокировала цикл событий. Время сохранения отмечается заранее, чтобы одновременные запросы не запускали
+        сохранение повторно."""
+
+        if self.flush_due():
+            self._last_flush = time.monotonic()
+            await sync_to_async(self.flush, thread_sensitive=False)()
+
+    def collect(self):
+        """Метод возвращает значения метрик, просуммированные по всем рабочим процессам: {имя: {метки: значение}}."""
+
+        store = self.get_store()
+        if store is None:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = store.load_all()
+
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is not None:
+                    metric.merge(merged[name], {tuple(map(tuple, key)): value for key, value in values})
+        return merged
+
+    def render(self):
+        """Метод возвращает метрики в текстовом формате Prometheus."""
+
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {_escape(metric.documentation)}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for sample, labels, value in metric.samples(dict(sorted(values.items()))):
+                lines.append(f'{sample}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+REQUEST_LATENCY = registry.register(Histogram(
+    'http_request_duration_seconds', 'Время обработки запроса в секундах.', ('view', 'method'), LATENCY_BUCKETS,
+))
+REQUEST_QUERIES = registry.register(Histogram(
+    'http_request_db_queries', 'Количество запросов к базе данных при обработке запроса.', ('view',), QUERY_BUCKETS,
+))
+REQUEST_CACHE_HIT_RATIO = registry.register(Histogram(
+    'http_request_cache_hit_ratio', 'Доля попаданий при чтении из кэша (для запросов, которые читают кэш).',
+    ('view',), RATIO_BUCKETS,
+))
+CACHE_READS = registry.register(Counter(
+    'http_cache_reads_total', 'Чтения ключей из кэша по результату (hit или miss).', ('view', 'result'),
+))
+RESPONSE_SIZE = registry.register(Histogram(
+    'http_response_size_bytes', 'Размер тела ответа в байтах (кроме потоковых ответов).', ('view',), SIZE_BUCKETS,
+))
+RESPONSES = registry.register(Counter(
+    'http_responses_total', 'Количество ответов по коду состояния.', ('view', 'method', 'status'),
+))
+
+
+@receiver(setting_changed)
+def _reset_store(setting, **kwargs):
+    if setting in ('METRICS_DIR', 'METRICS_REDIS_URL', 'METRICS_WORKER_TIMEOUT'):
+        registry.reset_store()
+
+
+def observe_request(view, method, status, elapsed, queries, cache_hits, cache_misses, size):
+    """Функция записывает метрики одного запроса. view — имя адреса ('catalog:product_list'), size — размер тела
+    ответа или None для потоковых ответов."""
+
+    REQUEST_LATENCY.observe(elapsed, view=view, method=method)
+    REQUEST_QUERIES.observe(queries, view=view)
+    if cache_hits or cache_misses:
+        REQUEST_CACHE_HIT_RATIO.observe(cache_hits / (cache_hits + cache_misses), view=view)
+        CACHE_READS.inc(cache_hits, view=view, result='hit')
+        CACHE_READS.inc(cache_misses, view=view, result='miss')
+    if size is not None:
+        RESPONSE_SIZE.observe(size, view=view)
+    RESPONSES.inc(view=view, method=method, status=status)
@@ -0,0 +1,260 @@
+import logging
+import time
+from collections import Counter, OrderedDict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.functional import empty
+
+from catalog import metrics
+from catalog.profiling import CACHE_READ_METHODS, Profile, fingerprint, normalize_sql, profile_template_response
+
+logger = logging.getLogger('catalog.queries')
+
+# Заголовок ответа со сводкой по запросам к базе данных (см. QUERY_INSPECTOR_HEADER)
+QUERY_INSPECTOR_HEADER = 'X-Query-Inspector'
+
+# Методы HTTP, которые попадают в метки метрик как есть; остальные объединяются в метку 'other', чтобы произвольные
+# методы в запросах клиентов не создавали новые временные ряды
+METRICS_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+
+# Заголовок запроса с подписанным токеном, который включает Server-Timing для пользователей без прав персонала
+SERVER_TIMING_TOKEN_HEADER = 'X-Server-Timing-Token'
+SERVER_TIMING_SALT = 'catalog.server_timing'
+
+
+def find_repeated_queries(queries, threshold):
+    """Функция группирует запросы по отпечатку нормализованного текста и возвращает группы, в которых не меньше
+    threshold запросов, в порядке убывания их количества. Для каждой группы возвращается словарь: отпечаток, вид
+    повтора ('duplicate' — одинаковые запросы с одинаковыми параметрами, 'n+1' — запросы, которые отличаются только
+    параметрами), количество, суммарное время, места вызова с количеством запросов и нормализованный текст."""
+
+    groups = OrderedDict()
+    for query in queries:
+        groups.setdefault(fingerprint(query.sql), []).append(query)
+
+    repeated = []
+    for key, group in groups.items():
+        if len(group) < threshold:
+            continue
+        distinct = {(query.sql, repr(query.params)) for query in group}
+        repeated.append({
+            'fingerprint': key,
+            'kind': 'duplicate' if len(distinct) == 1 else 'n+1',
+            'count': len(group),
+            'duration_ms': round(sum(query.duration for query in group) * 1000, 2),
+            'sites': dict(Counter(query.site for query in group)),
+            'sql': normalize_sql(group[0].sql),
+        })
+
+    repeated.sort(key=lambda item: item['count'], reverse=True)
+    return repeated
+
+
+def make_server_timing_token():
+    """Функция возвращает подписанный токен для заголовка X-Server-Timing-Token. Токен действителен
+    SERVER_TIMING_TOKEN_MAX_AGE секунд."""
+    return signing.TimestampSigner(salt=SERVER_TIMING_SALT).sign('server-timing')
+
+
+def is_valid_server_timing_token(token):
+    try:
+        signing.TimestampSigner(salt=SERVER_TIMING_SALT).unsign(token, max_age=settings.SERVER_TIMING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class ProfilingMiddleware:
+    """Базовый класс промежуточного слоя, который профилирует обработку запроса (см. catalog.profiling.Profile) в
+    синхронном и асинхронном режимах. Подкласс задает should_profile, record_sites и метод process, который получает
+    профиль и общее время обработки запроса в секундах. Время рендеринга шаблона учитывается для ответов
+    TemplateResponse (см. process_template_response)."""
+
+    sync_capable = True
+    async_capable = True
+    record_sites = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Асинхронный обработчик вызывает синхронный метод через sync_to_async, поэтому подставляется асинхронный
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with Profile(record_sites=self.record_sites) as profile:
+            response = self.get_response(request)
+        self.process(request, response, profile, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not self.should_profile(request):
+            return await self.get_response(request)
+
+        start = time.perf_counter()
+        with Profile(record_sites=self.record_sites) as profile:
+            response = await self.get_response(request)
+        await self.aprocess(request, response, profile, time.perf_counter() - start)
+        return response
+
+    def process_template_response(self, request, response):
+        return profile_template_response(response)
+
+    async def aprocess_template_response(self, request, response):
+        return profile_template_response(response)
+
+    def should_profile(self, request):
+        return True
+
+    def process(self, request, response, profile, elapsed):
+        raise NotImplementedError
+
+    async def aprocess(self, request, response, profile, elapsed):
+        """Асинхронный вариант process. Подкласс переопределяет его, если process выполняет блокирующий ввод-вывод."""
+        self.process(request, response, profile, elapsed)
+
+
+class QueryInspectorMiddleware(ProfilingMiddleware):
+    """Промежуточный слой, который записывает все запросы к базе данных, выполненные при обработке запроса, и находит
+    повторяющиеся: одинаковые запросы и N+1 (одинаковый запрос в цикле, например ленивая загрузка связанного объекта
+    в шаблоне). Каждая группа повторов записывается в журнал catalog.queries отдельной записью с контроллером, местом
+    вызова (строка модуля или шаблона) и нормализованным текстом запроса. При включенном QUERY_INSPECTOR_HEADER
+    сводка добавляется в заголовок ответа X-Query-Inspector.
+
+    Включается настройкой QUERY_INSPECTOR_ENABLED (например, на тестовом стенде); без нее промежуточный слой
+    исключается из обработки запросов. Поддерживает синхронные и асинхронные контроллеры."""
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSPECTOR_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.threshold = settings.QUERY_INSPECTOR_THRESHOLD
+        self.add_header = settings.QUERY_INSPECTOR_HEADER
+
+    def process(self, request, response, profile, elapsed):
+        """Метод записывает в журнал повторяющиеся запросы и добавляет заголовок со сводкой."""
+
+        repeated = find_repeated_queries(profile.queries, self.threshold)
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+
+        for group in repeated:
+            logger.warning(
+                'Повторяющиеся запросы (%s): %s × %s в %s', group['kind'], group['count'], group['fingerprint'], view,
+                extra={'fields': {
+                    'view': view,
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'queries': len(profile.queries),
+                    **group,
+                }},
+            )
+
+        if self.add_header:
+            summary = [f'queries={len(profile.queries)}', f'repeated={sum(group["count"] for group in repeated)}']
+            summary += [f'{group["fingerprint"]}={group["count"]} {", ".join(group["sites"])}' for group in repeated]
+            response.headers[QUERY_INSPECTOR_HEADER] = '; '.join(summary)
+
+
+class ServerTimingMiddleware(ProfilingMiddleware):
+    """Промежуточный слой добавляет в ответ заголовок Server-Timing, который показывается в инструментах
+    разработчика браузера: время запросов к базе данных и их количество, время чтения (с попаданиями и промахами) и
+    записи кэша, время рендеринга шаблонов (без запросов, выполненных при рендеринге), время остальной логики
+    контроллера и общее время обработки запроса.
+
+    Заголовок добавляется для персонала, если пользователь был загружен при обработке запроса (загрузка только ради
+    проверки прав стоила бы лишних запросов), и для запросов с действительным токеном в заголовке
+    X-Server-Timing-Token (см. команду server_timing_token). Запросы без cookie сессии и без токена не профилируются.
+    Включается настройкой SERVER_TIMING_ENABLED; без нее промежуточный слой исключается из обработки запросов."""
+
+    record_sites = False
+
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def should_profile(self, request):
+        return SERVER_TIMING_TOKEN_HEADER in request.headers or settings.SESSION_COOKIE_NAME in request.COOKIES
+
+    def is_allowed(self, request):
+        token = request.headers.get(SERVER_TIMING_TOKEN_HEADER)
+        if token and is_valid_server_timing_token(token):
+            return True
+
+        user = getattr(request, 'user', None)
+        user = getattr(user, '_wrapped', user)
+        return user is not None and user is not empty and user.is_staff
+
+    def process(self, request, response, profile, elapsed):
+        if self.is_allowed(request):
+            response.headers['Server-Timing'] = self.server_timing(profile, elapsed)
+
+    @staticmethod
+    def server_timing(profile, elapsed):
+        """Метод возвращает значение заголовка Server-Timing для профиля запроса."""
+
+        db = profile.query_time()
+        cache_read, cache_write = profile.cache_time(read=True), profile.cache_time(read=False)
+        template = profile.template_time()
+        view = max(elapsed - db - cache_read - cache_write - template, 0)
+        hits, misses = profile.cache_hits()
+        reads = len([call for call in profile.cache_calls if call.method in CACHE_READ_METHODS])
+
+        metrics = [
+            ('db', db, f'{len(profile.queries)} queries'),
+            ('cache-get', cache_read, f'calls={reads} hits={hits} misses={misses}'),
+            ('cache-set', cache_write, f'{len(profile.cache_calls) - reads} calls'),
+            ('template', template, f'{len(profile.templates)} renders'),
+            ('view', view, None),
+            ('total', elapsed, None),
+        ]
+        return ', '.join(
+            f'{name};dur={duration * 1000:.2f}' + (f';desc="{description}"' if description else '')
+            for name, duration, description in metrics
+        )
+
+
+class MetricsMiddleware(ProfilingMiddleware):
+    """Промежуточный слой записывает метрики каждого запроса по имени адреса (см. catalog.metrics): время обработки,
+    количество запросов к базе данных, долю попаданий в кэш, размер ответа и код состояния. Запросы к
+    неизвестным адресам объединяются под именем '<unresolved>'. Включается настройкой METRICS_ENABLED."""
+
+    record_sites = False
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def observe(self, request, response, profile, elapsed):
+        match = request.resolver_match
+        hits, misses = profile.cache_hits()
+        metrics.observe_request(
+            view=match.view_name if match else '<unresolved>',
+            method=request.method if request.method in METRICS_METHODS else 'other',
+            status=response.status_code,
+            elapsed=elapsed,
+            queries=len(profile.queries),
+            cache_hits=hits,
+            cache_misses=misses,
+            size=None if response.streaming else len(response.content),
+        )
+
+    def process(self, request, response, profile, elapsed):
+        self.observe(request, response, profile, elapsed)
+        metrics.registry.maybe_flush()
+
+    async def aprocess(self, request, response, profile, elapsed):
+        self.observe(request, response, profile, elapsed)
+        await metrics.registry.amaybe_flush()
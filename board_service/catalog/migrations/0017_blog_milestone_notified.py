@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+def mark_notified_blogs(apps, schema_editor):
+    """Публикации, которые уже набрали 100 просмотров, получили поздравление при старой логике счетчика."""
+    Blog = apps.get_model('catalog', 'Blog')
+    Blog.objects.filter(view_count__gte=100).update(milestone_notified=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0016_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='milestone_notified',
+            field=models.BooleanField(default=False, verbose_name='Поздравление отправлено'),
+        ),
+        migrations.RunPython(mark_notified_blogs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+def keep_one_active_version(apps, schema_editor):
+    """У товаров с несколькими активными версиями активной остается только версия с наибольшим номером."""
+
+    Version = apps.get_model('catalog', 'Version')
+    seen = set()
+    extra = []
+    for pk, product_id in Version.objects.filter(is_active=True).order_by('product_id', '-number').values_list(
+            'pk', 'product_id'):
+        if product_id in seen:
+            extra.append(pk)
+        seen.add(product_id)
+    Version.objects.filter(pk__in=extra).update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0020_product_external_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='version',
+            name='number',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=6, verbose_name='Номер версии'),
+        ),
+        migrations.AddConstraint(
+            model_name='version',
+            constraint=models.UniqueConstraint(fields=('product', 'number'), name='version_product_number_uniq'),
+        ),
+        migrations.RunPython(keep_one_active_version, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='version',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('product',), name='version_one_active_per_product'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:47
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_published(apps, schema_editor):
+    """Для существующих публикаций датой изменения считается дата создания."""
+
+    Blog = apps.get_model('catalog', 'Blog')
+    Blog.objects.update(changed=F('published'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0022_renditionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='changed',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(copy_published, migrations.RunPython.noop),
+    ]
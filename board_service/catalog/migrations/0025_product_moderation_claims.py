@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0024_product_published_live_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='claim_expires',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Закреплен до'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='claimed_products', to=settings.AUTH_USER_MODEL, verbose_name='Модератор'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', False)), fields=['published', 'id'], name='product_moderation_queue_idx'),
+        ),
+    ]
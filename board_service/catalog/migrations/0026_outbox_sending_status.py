@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:25
+
+from django.db import migrations, models
+
+
+def clear_sent_messages(apps, schema_editor):
+    """Тексты уже отправленных писем (в том числе с паролями) удаляются из очереди."""
+
+    OutgoingEmail = apps.get_model('catalog', 'OutgoingEmail')
+    OutgoingEmail.objects.filter(status='sent').update(message='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0025_product_moderation_claims'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outgoingemail',
+            name='outbox_pending_idx',
+        ),
+        migrations.AlterField(
+            model_name='outgoingemail',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает отправки'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус'),
+        ),
+        migrations.AddIndex(
+            model_name='outgoingemail',
+            index=models.Index(condition=models.Q(('status__in', ('pending', 'sending'))), fields=['next_attempt'], name='outbox_pending_idx'),
+        ),
+        migrations.RunPython(clear_sent_messages, migrations.RunPython.noop),
+    ]
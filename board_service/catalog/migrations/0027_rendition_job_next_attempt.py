@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:28
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0026_outbox_sending_status'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='renditionjob',
+            name='rendition_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='renditionjob',
+            name='next_attempt',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка'),
+        ),
+        migrations.AlterField(
+            model_name='renditionjob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает обработки'), ('processing', 'Обрабатывается'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус'),
+        ),
+        migrations.AddIndex(
+            model_name='renditionjob',
+            index=models.Index(condition=models.Q(('status__in', ('pending', 'processing'))), fields=['next_attempt'], name='rendition_pending_idx'),
+        ),
+    ]
@@ -1,7 +1,10 @@
 from decimal import Decimal
 
 from django.conf import settings
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.utils import timezone
 
 NULLABLE = {'blank': True, 'null': True}
 
@@ -12,7 +15,10 @@ class Product(models.Model):
     Модель Product для сохранения определенного товара в базе данных. Поля:
     1) name — название товара, 2) description — описание товара, 3) image — иконка товара, 4) published — дата
     публикации, 5) changed — дата изменения, 6) price — цена, 7) category — категория, ссылающаяся на поле модели
-    Category.
+    Category, 8) search_vector — поисковый вектор по названию и описанию, который заполняется триггером в базе данных,
+    9) external_id — ключ товара во внешнем каталоге, по которому выполняется синхронизация, 10) content_hash — хэш
+    данных товара при последней синхронизации, 11) claimed_by — модератор, который взял товар на проверку,
+    12) claim_expires — время, до которого товар закреплен за модератором.
     """
     name = models.CharField(max_length=50, verbose_name='Наименование')
     description = models.TextField(**NULLABLE, verbose_name='Описание')
@@ -25,6 +31,13 @@ class Product(models.Model):
     user_product = models.ForeignKey('users.User', on_delete=models.SET_NULL, verbose_name='пользователь',
                                      **NULLABLE)
     is_published = models.BooleanField(default=False, verbose_name='Опубликовано')
+    search_vector = SearchVectorField(**NULLABLE, editable=False, verbose_name='Поисковый вектор')
+    external_id = models.CharField(max_length=255, unique=True, **NULLABLE, editable=False,
+                                   verbose_name='Внешний ключ')
+    content_hash = models.CharField(max_length=40, blank=True, editable=False, verbose_name='Хэш данных')
+    claimed_by = models.ForeignKey('users.User', on_delete=models.SET_NULL, related_name='claimed_products',
+                                   editable=False, verbose_name='Модератор', **NULLABLE)
+    claim_expires = models.DateTimeField(editable=False, verbose_name='Закреплен до', **NULLABLE)
 
     def __str__(self):
         return f'{self.name} ({self.category})'
@@ -33,6 +46,19 @@ class Product(models.Model):
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
         ordering = ('-published',)
+        indexes = [
+            # Индекс для пагинации по курсору (published, pk)
+            models.Index(fields=('-published', '-id'), name='product_published_id_idx'),
+            # Частичный индекс для выборки последних опубликованных товаров на главной странице
+            models.Index(fields=('-published',), condition=models.Q(is_published=True),
+                         name='product_published_live_idx'),
+            # Частичный индекс очереди модерации (неопубликованные товары в порядке добавления)
+            models.Index(fields=('published', 'id'), condition=models.Q(is_published=False),
+                         name='product_moderation_queue_idx'),
+            # Индексы для полнотекстового и нечеткого (триграммного) поиска
+            GinIndex(fields=('search_vector',), name='product_search_vector_idx'),
+            GinIndex(fields=('name',), opclasses=('gin_trgm_ops',), name='product_name_trgm_idx'),
+        ]
         permissions = [
             (
                 'set_published',
@@ -92,15 +118,21 @@ class Feedback(models.Model):
         verbose_name = 'Обратная связь'
         verbose_name_plural = 'Обратные связи'
         ordering = ('-publish',)
+        indexes = [
+            # Индекс для пагинации по курсору (publish, pk)
+            models.Index(fields=('-publish', '-id'), name='feedback_publish_id_idx'),
+        ]
 
 
 class Blog(models.Model):
     title = models.CharField(max_length=50, verbose_name='Заголовок')
     slug = models.CharField(max_length=50, **NULLABLE, verbose_name='slug')
     view_count = models.IntegerField(default=0, verbose_name='Просмотры')
+    milestone_notified = models.BooleanField(default=False, verbose_name='Поздравление отправлено')
     content = models.TextField(**NULLABLE, verbose_name='Содержимое')
     image = models.ImageField(upload_to='blogs/', **NULLABLE, verbose_name='Превью')
     published = models.DateTimeField(db_index=True, auto_now_add=True, verbose_name='Дата создания')
+    changed = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
     is_active = models.BooleanField(default=True, verbose_name='Разрешение на публикацию')
     email = models.EmailField(max_length=100, verbose_name='Электронная почта')
     user_blog = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, **NULLABLE,
@@ -113,9 +145,14 @@ class Blog(models.Model):
         verbose_name = 'Блог'
         verbose_name_plural = 'Блоги'
         ordering = ('-published',)
+        indexes = [
+            # Индекс для пагинации по курсору (published, pk)
+            models.Index(fields=('-published', '-id'), name='blog_published_id_idx'),
+        ]
 
 
 def increment_version_number():
+    # Функция используется только в старых миграциях. Номер новой версии выдает метод Version.allocate_number
     max_number = Version.objects.all().order_by('number').last()
     if not max_number:
         return 1.00
@@ -123,21 +160,137 @@ def increment_version_number():
 
 
 class Version(models.Model):
+    """
+    Модель Version для сохранения версий товара в базе данных. Поля: 1) title — название версии, 2) number — номер
+    версии, уникальный в пределах товара, 3) is_active — активность версии (у товара может быть только одна активная
+    версия), 4) product — товар, к которому относится версия.
+    """
+
     class VersionName(models.TextChoices):
         NAME_DEVELOP = 'В разработке', 'В разработке'
         NAME_RELEASE = 'Выпуск в производстве', 'Выпуск в производстве'
 
     title = models.CharField(max_length=150, choices=VersionName.choices, default=VersionName.NAME_DEVELOP,
                              verbose_name='Название')
-    number = models.DecimalField(max_digits=3, decimal_places=2, verbose_name='Номер версии',
-                                 default=increment_version_number, unique=True)
+    number = models.DecimalField(max_digits=6, decimal_places=2, blank=True, verbose_name='Номер версии')
     is_active = models.BooleanField(default=False, verbose_name='Активность')
     product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='versions', verbose_name='Продукт')
 
     def __str__(self):
         return f'{self.title}'
 
+    def allocate_number(self):
+        """Метод выдает версии следующий номер в пределах товара."""
+        Version.allocate_numbers(self.product_id, [self])
+
+    @staticmethod
+    def allocate_numbers(product_id, versions):
+        """Метод выдает версиям versions товара product_id следующие по порядку номера. Строка товара блокируется до
+        конца транзакции, поэтому одновременно создаваемые версии одного товара получают разные номера. Наибольший
+        номер ищется по уникальному индексу (product, number), а не перебором всей таблицы. Для любого количества
+        версий выполняется два запроса."""
+
+        Product.objects.select_for_update().filter(pk=product_id).values_list('pk', flat=True).get()
+        number = Version.objects.filter(product_id=product_id).aggregate(models.Max('number'))['number__max']
+        for version in versions:
+            number = Decimal('1.00') if number is None else number + Decimal('0.1')
+            version.number = number
+
+    def save(self, *args, **kwargs):
+        """Метод сохраняет версию. Если номер не указан, он выдается методом allocate_number в той же транзакции."""
+
+        if self.number is not None:
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            self.allocate_number()
+            super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Версия'
         verbose_name_plural = 'Версии'
         ordering = ('-number',)
+        constraints = [
+            models.UniqueConstraint(fields=('product', 'number'), name='version_product_number_uniq'),
+            # Частичный уникальный индекс: у товара может быть только одна активная версия
+            models.UniqueConstraint(fields=('product',), condition=models.Q(is_active=True),
+                                    name='version_one_active_per_product'),
+        ]
+
+
+class OutgoingEmail(models.Model):
+    """
+    Модель OutgoingEmail — очередь исходящих писем. Письма добавляются в очередь в той же транзакции, что и изменение
+    данных, и отправляются командой send_outbox_emails. Поля: 1) subject — тема, 2) message — текст (очищается после
+    отправки), 3) from_email — отправитель, 4) recipients — список получателей, 5) status — статус отправки,
+    6) attempts — количество попыток, 7) next_attempt — время следующей попытки (для отправляемого письма — время, после
+    которого его может забрать другой обработчик), 8) last_error — текст последней ошибки, 9) created — дата создания,
+    10) sent — дата отправки.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Ожидает отправки'
+        SENDING = 'sending', 'Отправляется'
+        SENT = 'sent', 'Отправлено'
+        FAILED = 'failed', 'Ошибка'
+
+    subject = models.CharField(max_length=255, verbose_name='Тема')
+    message = models.TextField(verbose_name='Сообщение')
+    from_email = models.CharField(max_length=255, **NULLABLE, verbose_name='Отправитель')
+    recipients = models.JSONField(default=list, verbose_name='Получатели')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING, verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попытки')
+    next_attempt = models.DateTimeField(default=timezone.now, verbose_name='Следующая попытка')
+    last_error = models.TextField(**NULLABLE, verbose_name='Последняя ошибка')
+    created = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    sent = models.DateTimeField(**NULLABLE, verbose_name='Дата отправки')
+
+    def __str__(self):
+        return f'{self.subject} ({self.get_status_display()})'
+
+    class Meta:
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+        ordering = ('-created',)
+        indexes = [
+            # Индекс для выборки писем, ожидающих отправки, и писем, срок отправки которых истек
+            models.Index(fields=('next_attempt',), condition=models.Q(status__in=('pending', 'sending')),
+                         name='outbox_pending_idx'),
+        ]
+
+
+class RenditionJob(models.Model):
+    """
+    Модель RenditionJob — очередь задач на создание уменьшенных копий (миниатюр и WebP) загруженных изображений.
+    Задачи обрабатываются командой make_renditions. Поля: 1) source — путь к исходному файлу в хранилище, 2) status —
+    статус обработки, 3) attempts — количество попыток, 4) next_attempt — время следующей попытки (для
+    обрабатываемой задачи — время, после которого ее может забрать другой обработчик), 5) last_error — текст
+    последней ошибки, 6) created — дата создания, 7) processed — дата обработки.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Ожидает обработки'
+        PROCESSING = 'processing', 'Обрабатывается'
+        DONE = 'done', 'Готово'
+        FAILED = 'failed', 'Ошибка'
+
+    source = models.CharField(max_length=255, unique=True, verbose_name='Исходный файл')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING, verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попытки')
+    next_attempt = models.DateTimeField(default=timezone.now, verbose_name='Следующая попытка')
+    last_error = models.TextField(**NULLABLE, verbose_name='Последняя ошибка')
+    created = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    processed = models.DateTimeField(**NULLABLE, verbose_name='Дата обработки')
+
+    def __str__(self):
+        return f'{self.source} ({self.get_status_display()})'
+
+    class Meta:
+        verbose_name = 'Обработка изображения'
+        verbose_name_plural = 'Обработка изображений'
+        ordering = ('-created',)
+        indexes = [
+            # Индекс для выборки задач, ожидающих обработки, и задач, срок обработки которых истек
+            models.Index(fields=('next_attempt',), condition=models.Q(status__in=('pending', 'processing')),
+                         name='rendition_pending_idx'),
+        ]
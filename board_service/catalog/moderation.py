@@ -0,0 +1,89 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from catalog.cache_tags import invalidate_tags, product_tag, PRODUCTS_TAG
+from catalog.models import Product
+from catalog.services import invalidate_category_cache, refresh_homepage_snapshot, with_active_versions
+
+# Количество товаров, которые публикуются или снимаются с публикации одним запросом UPDATE
+BATCH_SIZE = 1000
+
+# Количество товаров, которые модератор берет на проверку, и время, на которое они за ним закрепляются. По истечении
+# этого времени непроверенные товары возвращаются в очередь
+CLAIM_BATCH_SIZE = 5
+CLAIM_LEASE = datetime.timedelta(minutes=15)
+
+
+def _invalidate(pks):
+    """Функция сбрасывает кэш для пачки товаров: один вызов на пачку вместо сигнала на каждый товар."""
+
+    invalidate_category_cache()
+    invalidate_tags(PRODUCTS_TAG, *(product_tag(pk) for pk in pks))
+    refresh_homepage_snapshot()
+
+
+def set_published(queryset, is_published, batch_size=BATCH_SIZE):
+    """Функция публикует (is_published=True) или снимает с публикации товары из выборки queryset и возвращает
+    количество измененных товаров. Товары обрабатываются пачками по batch_size: для каждой пачки выполняется один
+    запрос UPDATE в отдельной транзакции, а кэш сбрасывается один раз после ее фиксации. Проверка измененных товаров
+    завершена, поэтому их закрепление за модератором снимается. Сигналы моделей не отправляются."""
+
+    pending = queryset.filter(is_published=not is_published).order_by('pk').values_list('pk', flat=True)
+
+    total = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            pks = list(pending.filter(pk__gt=last_pk)[:batch_size])
+            if not pks:
+                break
+            updated = Product.objects.filter(pk__in=pks, is_published=not is_published).update(
+                is_published=is_published, changed=timezone.now(), claimed_by=None, claim_expires=None
+            )
+            transaction.on_commit(lambda pks=pks: _invalidate(pks))
+
+        total += updated
+        last_pk = pks[-1]
+
+    return total
+
+
+def claimed_products(user):
+    """Функция возвращает неопубликованные товары, закрепленные за модератором и срок закрепления которых не истек, с
+    предзагруженными активными версиями. Товары не закрепляются и срок не продлевается."""
+
+    queue = Product.objects.filter(is_published=False)
+    return with_active_versions(
+        queue.filter(claimed_by=user, claim_expires__gt=timezone.now()).order_by('published', 'pk')
+    )
+
+
+def claim_products(user, batch_size=CLAIM_BATCH_SIZE, lease=CLAIM_LEASE):
+    """Функция закрепляет за модератором до batch_size неопубликованных товаров и возвращает количество закрепленных
+    за ним товаров. Товары, уже закрепленные за модератором, остаются за ним, а срок закрепления продлевается;
+    недостающие берутся из очереди (свободные товары и товары с истекшим сроком закрепления) с блокировкой SKIP
+    LOCKED, поэтому модераторы, которые берут товары одновременно, получают разные товары и не ждут друг друга."""
+
+    now = timezone.now()
+    queue = Product.objects.filter(is_published=False)
+
+    with transaction.atomic():
+        missing = batch_size - queue.filter(claimed_by=user, claim_expires__gt=now).count()
+        pks = []
+        if missing > 0:
+            pks = list(queue.select_for_update(skip_locked=True).filter(
+                Q(claim_expires__isnull=True) | Q(claim_expires__lte=now)
+            ).order_by('published', 'pk').values_list('pk', flat=True)[:missing])
+
+        return queue.filter(Q(pk__in=pks) | Q(claimed_by=user, claim_expires__gt=now)).update(
+            claimed_by=user, claim_expires=now + lease
+        )
+
+
+def release_products(user):
+    """Функция возвращает в очередь все товары, закрепленные за модератором."""
+
+    return Product.objects.filter(is_published=False, claimed_by=user).update(claimed_by=None, claim_expires=None)
@@ -0,0 +1,103 @@
+import datetime
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from catalog.models import OutgoingEmail
+
+# Количество писем, которые отправляются через одно SMTP-соединение
+BATCH_SIZE = 50
+
+# Максимальное количество попыток отправки письма, после которого письмо получает статус «Ошибка»
+MAX_ATTEMPTS = 5
+
+# Базовая и максимальная задержка (в секундах) перед повторной попыткой отправки
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 60 * 60
+
+# Время (в секундах), на которое письмо закрепляется за обработчиком. Если обработчик завершился, не обновив статус
+# письма, то по истечении этого времени письмо отправит другой обработчик
+SEND_TIMEOUT = 10 * 60
+
+
+def enqueue_mail(subject, message, from_email, recipient_list):
+    """Функция добавляет письмо в очередь исходящих писем вместо немедленной отправки. Для того чтобы письмо попало
+    в очередь только вместе с изменением данных, функцию нужно вызывать внутри той же транзакции."""
+
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        message=message,
+        from_email=from_email,
+        recipients=list(recipient_list),
+    )
+
+
+def retry_delay(attempts):
+    """Функция возвращает задержку перед следующей попыткой отправки: она удваивается с каждой неудачной попыткой."""
+    return datetime.timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY))
+
+
+def claim_pending_mail(batch_size=BATCH_SIZE):
+    """Функция забирает пачку писем, готовых к отправке, в короткой транзакции: письма получают статус «Отправляется»
+    и срок SEND_TIMEOUT, после которого их может забрать другой обработчик (если этот завершился во время отправки).
+    Письма выбираются с SKIP LOCKED, поэтому несколько обработчиков не заберут одно письмо."""
+
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(OutgoingEmail.objects.select_for_update(skip_locked=True).filter(
+            status__in=(OutgoingEmail.Status.PENDING, OutgoingEmail.Status.SENDING), next_attempt__lte=now
+        ).order_by('next_attempt')[:batch_size])
+        for email in emails:
+            email.status = OutgoingEmail.Status.SENDING
+            email.next_attempt = now + datetime.timedelta(seconds=SEND_TIMEOUT)
+        OutgoingEmail.objects.bulk_update(emails, ['status', 'next_attempt'])
+
+    return emails
+
+
+def send_pending_mail(batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS):
+    """Функция отправляет одну пачку писем из очереди через одно соединение с почтовым сервером и возвращает кортеж
+    (количество отправленных, количество неудачных). Письма забираются функцией claim_pending_mail, а отправляются
+    вне транзакции, поэтому блокировки строк не удерживаются на время работы с почтовым сервером. Текст
+    отправленного письма удаляется из очереди."""
+
+    sent = failed = 0
+    emails = claim_pending_mail(batch_size)
+    if not emails:
+        return sent, failed
+
+    connection = get_connection()
+    try:
+        connection.open()
+        for email in emails:
+            email.attempts += 1
+            try:
+                EmailMessage(email.subject, email.message, email.from_email, email.recipients,
+                             connection=connection).send()
+            except Exception as error:
+                email.last_error = f'{type(error).__name__}: {error}'
+                if email.attempts >= max_attempts:
+                    email.status = OutgoingEmail.Status.FAILED
+                else:
+                    email.status = OutgoingEmail.Status.PENDING
+                    email.next_attempt = timezone.now() + retry_delay(email.attempts)
+                failed += 1
+            else:
+                email.status = OutgoingEmail.Status.SENT
+                email.sent = timezone.now()
+                email.message = ''
+                sent += 1
+    except Exception as error:
+        # Соединение с почтовым сервером не удалось установить: вся пачка откладывается
+        for email in emails:
+            if email.status == OutgoingEmail.Status.SENDING:
+                email.status = OutgoingEmail.Status.PENDING
+                email.last_error = f'{type(error).__name__}: {error}'
+                email.next_attempt = timezone.now() + retry_delay(max(email.attempts, 1))
+    finally:
+        connection.close()
+
+    OutgoingEmail.objects.bulk_update(emails, ['status', 'message', 'attempts', 'next_attempt', 'last_error', 'sent'])
+
+    return sent, failed
@@ -0,0 +1,174 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(Exception):
+    """Исключение возникает, если курсор, полученный от пользователя, не удалось декодировать."""
+    pass
+
+
+def encode_cursor(value, pk, direction):
+    """Функция кодирует позицию в выборке (дата, pk и направление) в непрозрачную строку."""
+
+    raw = json.dumps([value.isoformat(), pk, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Функция декодирует курсор, созданный функцией encode_cursor, и возвращает кортеж (value, pk, direction)."""
+
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        value, pk, direction = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        value = parse_datetime(value)
+        pk = int(pk)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if value is None or direction not in ('next', 'prev'):
+        raise InvalidCursor(cursor)
+
+    return value, pk, direction
+
+
+def _value(row, name):
+    """Функция возвращает поле строки выборки: строка может быть объектом модели или словарем из .values()."""
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+class KeysetPage:
+    """Страница выборки, полученная через KeysetPaginator. Повторяет интерфейс django.core.paginator.Page, который
+    используется в шаблонах, но вместо номеров страниц хранит курсоры на соседние страницы."""
+
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<KeysetPage next={self.next_cursor} prev={self.previous_cursor}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Пагинатор по ключу (field, pk) для выборок, отсортированных по убыванию поля даты field (по умолчанию
+    'published'). В отличие от django.core.paginator.Paginator не выполняет COUNT(*) и OFFSET: каждая страница — это
+    одна выборка по индексу с условием «строго после» или «строго до» позиции из курсора."""
+
+    def __init__(self, queryset, per_page, field='published'):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.field = field
+
+    def page(self, cursor=None):
+        """Метод возвращает страницу, которая начинается после позиции из курсора (или первую страницу, если курсор
+        не передан)."""
+
+        queryset, forward, has_previous, following = self._page_queryset(cursor)
+        has_next = True if following is None else following.exists()
+        return self._finish(list(queryset), forward, has_previous, has_next)
+
+    async def apage(self, cursor=None):
+        """Асинхронный вариант page: строки страницы загружаются через async for."""
+
+        queryset, forward, has_previous, following = self._page_queryset(cursor)
+        has_next = True if following is None else await following.aexists()
+        return self._finish([row async for row in queryset], forward, has_previous, has_next)
+
+    def _page_queryset(self, cursor):
+        """Метод возвращает кортеж (выборка строк страницы, направление вперед, есть ли предыдущая страница, выборка
+        строк после страницы). Выборка на одну строку больше размера страницы позволяет узнать, есть ли следующая
+        страница, без COUNT. Для перехода назад выборка идет в обратном порядке, а затем разворачивается в _finish;
+        наличие следующей страницы в этом случае проверяется отдельным запросом EXISTS по строкам начиная с позиции
+        курсора (строка, с которой начиналась текущая страница, могла быть удалена)."""
+
+        if not cursor:
+            return self.queryset.order_by(f'-{self.field}', '-pk')[:self.per_page + 1], True, False, None
+
+        value, pk, direction = decode_cursor(cursor)
+        if direction == 'next':
+            queryset = self.queryset.filter(Q(**{f'{self.field}__lt': value}) | Q(**{self.field: value, 'pk__lt': pk}))
+            return queryset.order_by(f'-{self.field}', '-pk')[:self.per_page + 1], True, True, None
+
+        queryset = self.queryset.filter(Q(**{f'{self.field}__gt': value}) | Q(**{self.field: value, 'pk__gt': pk}))
+        following = self.queryset.filter(Q(**{f'{self.field}__lt': value}) | Q(**{self.field: value, 'pk__lte': pk}))
+        return queryset.order_by(self.field, 'pk')[:self.per_page + 1], False, None, following
+
+    def _finish(self, rows, forward, has_previous, has_next):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if forward:
+            return self._make_page(rows, has_more, has_previous)
+        return self._make_page(rows[::-1], has_next, has_more)
+
+    def _make_page(self, rows, has_next, has_previous):
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(_value(rows[-1], self.field), _value(rows[-1], 'pk'), 'next')
+        if rows and has_previous:
+            previous_cursor = encode_cursor(_value(rows[0], self.field), _value(rows[0], 'pk'), 'prev')
+
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
+
+
+class KeysetPaginationMixin:
+    """Миксин для ListView, который заменяет постраничную пагинацию на пагинацию по курсору. Режим задается
+    атрибутом pagination_mode: 'keyset' — пагинация по курсору, 'pages' — стандартная пагинация Django по номерам
+    страниц (подходит для небольших таблиц). Поле даты, по которому идет пагинация, задается атрибутом keyset_field."""
+
+    pagination_mode = 'keyset'
+    keyset_field = 'published'
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        """Метод возвращает кортеж (paginator, page, object_list, is_paginated), как и базовый ListView."""
+
+        if self.pagination_mode != 'keyset':
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_field)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Неверный курсор пагинации')
+
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    async def apaginate_queryset(self, queryset, page_size):
+        """Асинхронный вариант paginate_queryset для AsyncListView."""
+
+        if self.pagination_mode != 'keyset':
+            return await super().apaginate_queryset(queryset, page_size)
+
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_field)
+        try:
+            page = await paginator.apage(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Неверный курсор пагинации')
+
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,388 @@
+import asyncio
+import functools
+import hashlib
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.response import SimpleTemplateResponse
+
+# Методы бэкенда кэша Django, вызовы которых учитываются. Асинхронные методы (aget, aset и т. д.) вызывают
+# синхронные методы того же объекта кэша, поэтому учитываются тоже
+CACHE_METHODS = ('get', 'set', 'add', 'get_many', 'set_many', 'delete', 'delete_many', 'incr', 'decr', 'touch',
+                 'has_key', 'clear')
+
+# Методы кэша, которые читают данные; остальные методы считаются записью
+CACHE_READ_METHODS = frozenset(('get', 'get_many', 'has_key'))
+
+# Активные профили текущего запроса (или теста). ContextVar передается в потоки sync_to_async, поэтому запросы
+# асинхронных контроллеров учитываются тоже
+_profiles = ContextVar('profiles', default=())
+
+# Признак того, что выполняется вызов кэша: вложенные вызовы (например, get внутри get_many) не учитываются
+_in_cache_call = ContextVar('in_cache_call', default=False)
+
+# Признак того, что выполняется рендеринг шаблона: вложенный рендеринг (render_to_string внутри шаблонного тега)
+# не учитывается отдельно
+_in_template = ContextVar('in_template', default=False)
+
+# Задача asyncio, из асинхронного кода которой вызван sync_to_async (см. async_call_site). Кадры сопрограмм не видны
+# из потока, в котором выполняется синхронная функция, поэтому место вызова ищется по цепочке ожидания задачи
+_async_task = ContextVar('async_task', default=None)
+
+_install_lock = threading.Lock()
+_installed = False
+
+_THIS_FILE = Path(__file__).resolve()
+
+# Модули тестов, тестовой обвязки и промежуточного слоя, который профилирует запросы, не считаются местом вызова:
+# запрос из промежуточного слоя Django относится к запросу страницы, а не к коду, который ее запросил
+_IGNORED_MODULES = ('tests', 'query_budget', 'middleware')
+
+
+# Правила нормализации текста запроса для отпечатка: списки параметров IN, параметры и литералы заменяются на
+# общие обозначения, пробельные символы схлопываются
+_FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\bIN \((?:\?, )*\?\)', re.IGNORECASE), 'IN (...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def normalize_sql(sql):
+    """Функция возвращает текст запроса без значений параметров: запросы, которые отличаются только параметрами
+    (например, ленивая загрузка связанного объекта в цикле шаблона), нормализуются в один и тот же текст."""
+
+    for pattern, replacement in _FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(sql):
+    """Функция возвращает короткий отпечаток нормализованного текста запроса (см. normalize_sql)."""
+    return hashlib.sha1(normalize_sql(sql).encode()).hexdigest()[:10]
+
+
+@dataclass
+class QueryRecord:
+    alias: str
+    sql: str
+    params: object
+    duration: float
+    site: str
+
+
+@dataclass
+class CacheRecord:
+    method: str
+    hits: int
+    misses: int
+    duration: float
+    site: str
+
+
+@dataclass
+class TemplateRecord:
+    name: str
+    duration: float
+    # Время рендеринга без запросов к базе данных и вызовов кэша, выполненных при рендеринге
+    self_duration: float
+
+
+def _is_project_file(filename):
+    path = Path(filename).resolve()
+    if path == _THIS_FILE or 'site-packages' in path.parts or path.stem in _IGNORED_MODULES:
+        return False
+    return not path.stem.startswith('test_') and Path(settings.BASE_DIR) in path.parents
+
+
+def _library_site(frame):
+    """Функция возвращает место вызова в сторонней библиотеке ('django/contrib/auth/__init__.py:207 in get_user')
+    или None для кадров самих бэкендов базы данных и кэша, которые выполняют запрос."""
+
+    parts = Path(frame.f_code.co_filename).parts
+    if 'site-packages' not in parts:
+        return None
+    parts = parts[parts.index('site-packages') + 1:]
+    if parts[:2] == ('django', 'db') or parts[:3] == ('django', 'core', 'cache') or parts[:1] == ('asgiref',):
+        return None
+    return f'{"/".join(parts)}:{frame.f_lineno} in {frame.f_code.co_name}'
+
+
+def _is_sync_to_async_boundary(code):
+    return code.co_name == 'thread_handler' and 'asgiref' in Path(code.co_filename).parts
+
+
+def _project_site(frame):
+    filename = Path(frame.f_code.co_filename).resolve().relative_to(settings.BASE_DIR)
+    return f'{filename}:{frame.f_lineno} in {frame.f_code.co_name}'
+
+
+def _async_site(task):
+    """Функция возвращает место в коде проекта, на котором приостановлена задача task: последнюю сопрограмму проекта
+    в цепочке ожидания (cr_await) или None."""
+
+    site = None
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, 'cr_frame', None)
+        if frame is None:
+            break
+        if _is_project_file(frame.f_code.co_filename):
+            site = _project_site(frame)
+        awaitable = awaitable.cr_await
+    return site
+
+
+def async_call_site(func):
+    """Декоратор для асинхронных контроллеров и их вспомогательных функций: запросы, которые выполняются во время
+    вызова func в потоках sync_to_async (в том числе асинхронными методами ORM), относятся к месту в асинхронном
+    коде, на котором задача ожидает результат."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _async_task.set(asyncio.current_task())
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _async_task.reset(token)
+
+    return wrapper
+
+
+def call_site():
+    """Функция возвращает место в коде проекта, из которого выполняется текущий запрос к базе данных или кэшу:
+    строку шаблона ('catalog/product_list.html:42'), если запрос выполняется при рендеринге шаблона (ленивая загрузка
+    связанных объектов), или строку модуля проекта ('catalog/views.py:120 in get_queryset'). Кадры Django и
+    сторонних библиотек пропускаются; если в стеке нет кода проекта (например, запрос сессии из промежуточного
+    слоя), то возвращается ближайшее место вызова в сторонней библиотеке. Для вызовов через sync_to_async из функций
+    с декоратором async_call_site возвращается место в асинхронном коде, из которого выполнен вызов."""
+
+    fallback = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                return f'{origin.template_name}:{token.lineno}'
+        elif _is_project_file(code.co_filename):
+            return _project_site(frame)
+        elif _is_sync_to_async_boundary(code):
+            task = _async_task.get()
+            return (task and _async_site(task)) or fallback or '<unknown>'
+        elif fallback is None:
+            fallback = _library_site(frame)
+        frame = frame.f_back
+
+    return fallback or '<unknown>'
+
+
+def _site(profiles):
+    """Функция возвращает место вызова, если его записывает хотя бы один из активных профилей: поиск по стеку
+    вызовов заметно дороже самого учета запроса."""
+    return call_site() if any(profile.record_sites for profile in profiles) else None
+
+
+def _query_hook(execute, sql, params, many, context):
+    profiles = _profiles.get()
+    if not profiles:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record = QueryRecord(context['connection'].alias, sql, params, time.perf_counter() - start, _site(profiles))
+        for profile in profiles:
+            profile.queries.append(record)
+
+
+def _add_query_hook(connection, **kwargs):
+    if _query_hook not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_query_hook)
+
+
+def _count_hits(method, args, kwargs, result):
+    """Функция возвращает количество попаданий и промахов для вызова чтения из кэша."""
+
+    if method == 'get':
+        return (0, 1) if result is None else (1, 0)
+    if method == 'get_many':
+        keys = list(args[0] if args else kwargs.get('keys', ()))
+        return len(result), len(keys) - len(result)
+    return 0, 0
+
+
+def _wrap_cache_method(method, name):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        profiles = _profiles.get()
+        if not profiles or _in_cache_call.get():
+            return method(*args, **kwargs)
+
+        token = _in_cache_call.set(True)
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            _in_cache_call.reset(token)
+            duration = time.perf_counter() - start
+
+        hits, misses = _count_hits(name, args, kwargs, result)
+        record = CacheRecord(name, hits, misses, duration, _site(profiles))
+        for profile in profiles:
+            profile.cache_calls.append(record)
+        return result
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def _wrap_caches():
+    """Функция подключает перехват вызовов к объектам кэша из settings.CACHES, которые использует текущий поток
+    (или асинхронная задача): методы заменяются у самих объектов, а не у классов бэкендов."""
+
+    for alias in settings.CACHES:
+        backend = caches[alias]
+        for name in CACHE_METHODS:
+            method = getattr(backend, name, None)
+            if method is not None and not getattr(method, 'profiled', False):
+                setattr(backend, name, _wrap_cache_method(method, name))
+
+
+class ProfiledTemplate:
+    """Обертка шаблона ответа TemplateResponse, которая записывает время рендеринга в активные профили."""
+
+    def __init__(self, template):
+        self.template = template
+        origin = getattr(template, 'origin', None)
+        self.name = getattr(origin, 'template_name', None) or '<unknown>'
+
+    def render(self, context=None, request=None):
+        profiles = _profiles.get()
+        if not profiles or _in_template.get():
+            return self.template.render(context, request)
+
+        marks = [(len(profile.queries), len(profile.cache_calls)) for profile in profiles]
+        token = _in_template.set(True)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            _in_template.reset(token)
+            duration = time.perf_counter() - start
+            for profile, (queries, cache_calls) in zip(profiles, marks):
+                nested = sum(query.duration for query in profile.queries[queries:])
+                nested += sum(call.duration for call in profile.cache_calls[cache_calls:])
+                profile.templates.append(TemplateRecord(self.name, duration, duration - nested))
+
+
+def profile_template_response(response):
+    """Функция подключает учет рендеринга шаблона ответа TemplateResponse, если есть активный профиль. Шаблоны,
+    которые рендерятся вне TemplateResponse (например, render_to_string в контроллере), учитываются во времени
+    контроллера."""
+
+    if _profiles.get() and isinstance(response, SimpleTemplateResponse) and not response.is_rendered \
+            and not isinstance(response.template_name, ProfiledTemplate):
+        response.template_name = ProfiledTemplate(response.resolve_template(response.template_name))
+    return response
+
+
+def is_enabled():
+    """Функция возвращает True, если включен хотя бы один промежуточный слой, который профилирует запросы."""
+    return settings.QUERY_INSPECTOR_ENABLED or settings.SERVER_TIMING_ENABLED or settings.METRICS_ENABLED
+
+
+def install():
+    """Функция один раз подключает перехват запросов к базе данных: execute_wrapper для всех соединений, в том числе
+    открытых позже. Пока нет активного профиля, перехват только передает вызов дальше."""
+
+    global _installed
+    with _install_lock:
+        if not _installed:
+            connection_created.connect(_add_query_hook, dispatch_uid='catalog_profiling')
+            for connection in connections.all(initialized_only=True):
+                _add_query_hook(connection)
+            _installed = True
+
+
+class Profile:
+    """Профиль запросов к базе данных, вызовов кэша и рендеринга шаблонов ответов (см. profile_template_response),
+    выполненных внутри блока with. Каждая запись содержит время выполнения и, если record_sites есть True, место
+    вызова (см. call_site)."""
+
+    def __init__(self, record_sites=True):
+        self.record_sites = record_sites
+        self.queries = []
+        self.cache_calls = []
+        self.templates = []
+        self._token = None
+
+    def __enter__(self):
+        install()
+        _wrap_caches()
+        self._token = _profiles.set(_profiles.get() + (self,))
+        return self
+
+    def __exit__(self, *exc_info):
+        _profiles.reset(self._token)
+
+    def query_time(self):
+        return sum(query.duration for query in self.queries)
+
+    def cache_time(self, read):
+        """Метод возвращает суммарное время чтений (read=True) или записей кэша."""
+        return sum(call.duration for call in self.cache_calls if (call.method in CACHE_READ_METHODS) == read)
+
+    def cache_hits(self):
+        """Метод возвращает количество попаданий и промахов при чтении из кэша."""
+        return sum(call.hits for call in self.cache_calls), sum(call.misses for call in self.cache_calls)
+
+    def template_time(self):
+        """Метод возвращает время рендеринга шаблонов без запросов и вызовов кэша, выполненных при рендеринге."""
+        return sum(template.self_duration for template in self.templates)
+
+    def queries_by_site(self):
+        """Метод возвращает словарь {место вызова: [SQL]} в порядке первого вызова."""
+
+        grouped = OrderedDict()
+        for query in self.queries:
+            grouped.setdefault(query.site, []).append(query.sql)
+        return grouped
+
+    def cache_calls_by_site(self):
+        grouped = OrderedDict()
+        for call in self.cache_calls:
+            grouped.setdefault(call.site, []).append(call.method)
+        return grouped
+
+    def report(self, max_sql_length=300):
+        """Метод возвращает текстовый отчет: запросы и вызовы кэша, сгруппированные по месту вызова."""
+
+        lines = [f'Запросы к базе данных ({len(self.queries)}):']
+        for site, queries in self.queries_by_site().items():
+            lines.append(f'  {site} — {len(queries)}')
+            for sql in OrderedDict.fromkeys(queries):
+                count = queries.count(sql)
+                text = sql if len(sql) <= max_sql_length else f'{sql[:max_sql_length]}…'
+                lines.append(f'    {count} × {text}' if count > 1 else f'    {text}')
+
+        lines.append(f'Вызовы кэша ({len(self.cache_calls)}):')
+        for site, methods in self.cache_calls_by_site().items():
+            lines.append(f'  {site} — {", ".join(methods)}')
+
+        return '\n'.join(lines)
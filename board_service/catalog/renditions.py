@@ -0,0 +1,154 @@
+import datetime
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from catalog.models import RenditionJob
+from catalog.services import LocalCache
+
+# Ширина (в пикселях) уменьшенных копий изображения. Копии не бывают больше оригинала
+RENDITION_WIDTHS = (320, 640, 1280)
+
+# Качество сжатия копий в формате WebP и в формате оригинала (для JPEG)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+# Количество изображений, которые обрабатываются за один проход, и количество попыток обработки
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 3
+
+# Базовая и максимальная задержка (в секундах) перед повторной попыткой обработки
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 60 * 60
+
+# Время (в секундах), на которое задача закрепляется за обработчиком. Если обработчик завершился, не обновив статус
+# задачи, то по истечении этого времени задачу заберет другой обработчик
+PROCESS_TIMEOUT = 10 * 60
+
+# Кэш процесса с признаком готовности копий, чтобы не обращаться к хранилищу при каждом выводе изображения.
+# Отрицательный результат кэшируется ненадолго: копии могут появиться в любой момент
+_ready_cache = LocalCache(max_size=1024, timeout=60 * 60)
+_missing_cache = LocalCache(max_size=1024, timeout=30)
+
+
+def rendition_name(name, width, extension=None):
+    """Функция возвращает путь к копии изображения шириной width. Копии хранятся рядом с оригиналом:
+    products/photo.jpg → products/photo_320w.jpg, products/photo_320w.webp."""
+
+    root, original_extension = os.path.splitext(name)
+    return f'{root}_{width}w{extension or original_extension}'
+
+
+def enqueue_renditions(name):
+    """Функция добавляет изображение в очередь на обработку. Повторная постановка того же файла игнорируется."""
+
+    if name:
+        RenditionJob.objects.bulk_create([RenditionJob(source=name)], ignore_conflicts=True)
+
+
+def _save(storage, name, image, image_format):
+    """Функция сохраняет изображение в хранилище под точным именем name, перезаписывая существующий файл."""
+
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    buffer = io.BytesIO()
+    options = {'quality': WEBP_QUALITY if image_format == 'WEBP' else JPEG_QUALITY, 'optimize': True}
+    image.save(buffer, image_format, **options)
+
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def make_renditions(name, storage=default_storage):
+    """Функция создает для изображения копии всех ширин из RENDITION_WIDTHS в формате оригинала и в WebP. Последней
+    сохраняется WebP-копия наибольшей ширины: по ее наличию шаблонный тег определяет, что копии готовы."""
+
+    with storage.open(name, 'rb') as file:
+        image = Image.open(file)
+        image_format = image.format or 'JPEG'
+        # Учитывается ориентация из EXIF, иначе фотографии с телефона окажутся повернутыми
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    if image_format not in ('JPEG', 'PNG', 'GIF', 'WEBP'):
+        image_format = 'JPEG'
+
+    for width in RENDITION_WIDTHS:
+        copy = image.copy()
+        if copy.width > width:
+            copy.thumbnail((width, copy.height), Image.LANCZOS)
+        _save(storage, rendition_name(name, width), copy, image_format)
+        _save(storage, rendition_name(name, width, '.webp'), copy, 'WEBP')
+
+
+def retry_delay(attempts):
+    """Функция возвращает задержку перед следующей попыткой обработки: она удваивается с каждой неудачной попыткой."""
+    return datetime.timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY))
+
+
+def claim_pending_renditions(batch_size=BATCH_SIZE):
+    """Функция забирает пачку задач, готовых к обработке, в короткой транзакции: задачи получают статус
+    «Обрабатывается» и срок PROCESS_TIMEOUT, после которого их может забрать другой обработчик. Задачи выбираются с
+    SKIP LOCKED, поэтому несколько обработчиков не заберут одну задачу."""
+
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(RenditionJob.objects.select_for_update(skip_locked=True).filter(
+            status__in=(RenditionJob.Status.PENDING, RenditionJob.Status.PROCESSING), next_attempt__lte=now
+        ).order_by('next_attempt')[:batch_size])
+        for job in jobs:
+            job.status = RenditionJob.Status.PROCESSING
+            job.next_attempt = now + datetime.timedelta(seconds=PROCESS_TIMEOUT)
+        RenditionJob.objects.bulk_update(jobs, ['status', 'next_attempt'])
+
+    return jobs
+
+
+def process_pending_renditions(batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS):
+    """Функция обрабатывает одну пачку изображений из очереди и возвращает кортеж (обработано, ошибок). Задачи
+    забираются функцией claim_pending_renditions, а изображения обрабатываются вне транзакции, поэтому блокировки
+    строк не удерживаются на время работы с Pillow и хранилищем. Неудачная задача повторяется с растущей задержкой."""
+
+    done = failed = 0
+    jobs = claim_pending_renditions(batch_size)
+
+    for job in jobs:
+        job.attempts += 1
+        try:
+            make_renditions(job.source)
+        except Exception as error:
+            job.last_error = f'{type(error).__name__}: {error}'
+            if job.attempts >= max_attempts:
+                job.status = RenditionJob.Status.FAILED
+            else:
+                job.status = RenditionJob.Status.PENDING
+                job.next_attempt = timezone.now() + retry_delay(job.attempts)
+            failed += 1
+        else:
+            job.status = RenditionJob.Status.DONE
+            job.processed = timezone.now()
+            done += 1
+
+    RenditionJob.objects.bulk_update(jobs, ['status', 'attempts', 'next_attempt', 'last_error', 'processed'])
+
+    return done, failed
+
+
+def renditions_ready(name, storage=default_storage):
+    """Функция проверяет, созданы ли копии изображения. Результат кэшируется в памяти процесса."""
+
+    if _ready_cache.get(name):
+        return True
+    if _missing_cache.get(name):
+        return False
+
+    ready = storage.exists(rendition_name(name, RENDITION_WIDTHS[-1], '.webp'))
+    (_ready_cache if ready else _missing_cache).set(name, True)
+    return ready
@@ -0,0 +1,61 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import F
+
+from catalog.models import Product
+
+# Конфигурация полнотекстового поиска PostgreSQL, в которой построен Product.search_vector
+SEARCH_CONFIG = 'russian'
+
+# Максимальное количество найденных товаров: результаты загружаются одним запросом и разбиваются на страницы в
+# памяти, а дальше первых страниц по релевантности результаты поиска не просматривают
+SEARCH_MAX_RESULTS = 200
+
+
+def _search_querysets(keyword):
+    """Функция возвращает выборки полнотекстового и нечеткого поиска по ключу keyword или None для пустого ключа."""
+
+    keyword = keyword.strip()
+    if not keyword:
+        return None
+
+    queryset = Product.objects.filter(is_published=True).defer('search_vector')
+
+    # Полнотекстовый поиск по GIN-индексу product_search_vector_idx
+    query = SearchQuery(keyword, config=SEARCH_CONFIG, search_type='websearch')
+    found = queryset.filter(search_vector=query).annotate(
+        rank=SearchRank(F('search_vector'), query)
+    ).order_by('-rank', '-published', '-pk')
+
+    # Нечеткий поиск по триграммному индексу product_name_trgm_idx
+    similar = queryset.filter(name__trigram_word_similar=keyword).annotate(
+        rank=TrigramWordSimilarity(keyword, 'name')
+    ).order_by('-rank', '-published', '-pk')
+
+    return found, similar
+
+
+def search_products(keyword):
+    """Функция возвращает список опубликованных товаров (не больше SEARCH_MAX_RESULTS), найденных по ключу keyword.
+    Сначала выполняется полнотекстовый поиск по полю search_vector (название и описание товара) с ранжированием по
+    релевантности. Если ничего не найдено, то выполняется нечеткий поиск по названию через триграммы, чтобы находить
+    товары с опечатками в запросе. Каждый поиск выполняется одним запросом: список не нужно отдельно проверять на
+    пустоту и считать для пагинации."""
+
+    querysets = _search_querysets(keyword)
+    if querysets is None:
+        return []
+
+    found, similar = querysets
+    return list(found[:SEARCH_MAX_RESULTS]) or list(similar[:SEARCH_MAX_RESULTS])
+
+
+async def asearch_products(keyword):
+    """Асинхронный вариант search_products."""
+
+    querysets = _search_querysets(keyword)
+    if querysets is None:
+        return []
+
+    found, similar = querysets
+    return [product async for product in found[:SEARCH_MAX_RESULTS]] or \
+        [product async for product in similar[:SEARCH_MAX_RESULTS]]
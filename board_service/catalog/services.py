@@ -1,17 +1,341 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
 from django.conf import settings
 from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, F, Prefetch, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from catalog.models import Category, Product, Version
+
+# Ключи кэша для данных о категориях
+CATEGORIES_KEY = 'categories'
+CATEGORY_SUMMARIES_KEY = 'category_summaries'
+
+# Ключ кэша и количество товаров снимка главной страницы
+HOMEPAGE_KEY = 'homepage'
+HOMEPAGE_PRODUCTS_LIMIT = 5
+
+# Версия формата данных в кэше. Увеличивается при изменении структуры кэшируемых данных, чтобы старые записи
+# в общем кэше не читались новым кодом.
+CACHE_VERSION = 1
+
+# Размер и время жизни (в секундах) локального кэша процесса. Время жизни ограничивает, насколько долго другие
+# процессы могут отдавать устаревшие данные после сброса кэша.
+LOCAL_CACHE_SIZE = 128
+LOCAL_CACHE_TIMEOUT = 5
+
+# Время жизни записей в общем кэше (Redis), в секундах
+SHARED_CACHE_TIMEOUT = 60 * 60
+
+# Количество товаров, которые выводятся для каждой категории в боковой панели product_list.html
+SIDEBAR_PRODUCTS_LIMIT = 10
+
+
+class LocalCache:
+    """Ограниченный по размеру LRU-кэш процесса с временем жизни записей. Хранит уже десериализованные данные,
+    поэтому чтение из него не требует ни сетевого запроса, ни разбора данных."""
+
+    def __init__(self, max_size=LOCAL_CACHE_SIZE, timeout=LOCAL_CACHE_TIMEOUT):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Метод возвращает значение по ключу или None, если значения нет или его время жизни истекло."""
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Метод сохраняет значение по ключу и вытесняет самые давно использованные записи при переполнении."""
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TwoTierCache:
+    """Двухуровневый кэш: локальный LRU-кэш процесса перед общим кэшем Django (Redis). В общем кэше данные хранятся
+    в виде JSON, поэтому кэшировать можно только уже вычисленные данные (списки и словари), а не QuerySet.
+    Ключи общего кэша версионируются через CACHE_VERSION. Для каждого уровня ведутся счетчики попаданий и промахов."""
+
+    def __init__(self, prefix='catalog', version=CACHE_VERSION, local=None, timeout=SHARED_CACHE_TIMEOUT):
+        self.prefix = prefix
+        self.version = version
+        self.local = local if local is not None else LocalCache()
+        self.timeout = timeout
+        self._stats = {'local_hits': 0, 'local_misses': 0, 'shared_hits': 0, 'shared_misses': 0}
+        self._stats_lock = threading.Lock()
+
+    def make_key(self, name):
+        return f'{self.prefix}:{name}'
+
+    def _count(self, counter):
+        with self._stats_lock:
+            self._stats[counter] += 1
+
+    def stats(self):
+        """Метод возвращает копию счетчиков попаданий и промахов."""
+
+        with self._stats_lock:
+            return dict(self._stats)
 
-from catalog.models import Category
+    def get_or_set(self, name, loader, shared=True):
+        """Метод возвращает данные по имени name. Данные ищутся сначала в локальном кэше, затем в общем; если их нет
+        нигде, то они вычисляются функцией loader и записываются в оба уровня. При shared=False общий кэш не
+        используется. Возвращаемые данные разделяются между запросами процесса и не должны изменяться вызывающим
+        кодом."""
+
+        key = self.make_key(name)
+
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+        self._count('local_misses')
+
+        if not shared:
+            value = loader()
+            self.local.set(key, value)
+            return value
+
+        payload = cache.get(key, version=self.version)
+        if payload is not None:
+            self._count('shared_hits')
+            value = json.loads(payload)
+        else:
+            self._count('shared_misses')
+            value = loader()
+            cache.set(key, json.dumps(value, cls=DjangoJSONEncoder), self.timeout, version=self.version)
+
+        self.local.set(key, value)
+        return value
+
+    async def aget_or_set(self, name, loader, shared=True):
+        """Асинхронный вариант get_or_set: общий кэш читается через асинхронный API кэша Django, а loader — это
+        асинхронная функция. Локальный кэш находится в памяти процесса и не требует ожидания."""
+
+        key = self.make_key(name)
+
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+        self._count('local_misses')
+
+        if not shared:
+            value = await loader()
+            self.local.set(key, value)
+            return value
+
+        payload = await cache.aget(key, version=self.version)
+        if payload is not None:
+            self._count('shared_hits')
+            value = json.loads(payload)
+        else:
+            self._count('shared_misses')
+            value = await loader()
+            await cache.aset(key, json.dumps(value, cls=DjangoJSONEncoder), self.timeout, version=self.version)
+
+        self.local.set(key, value)
+        return value
+
+    def set(self, name, value, shared=True):
+        """Метод записывает данные в оба уровня кэша (при shared=False — только в локальный), не дожидаясь промаха."""
+
+        key = self.make_key(name)
+        if shared:
+            cache.set(key, json.dumps(value, cls=DjangoJSONEncoder), self.timeout, version=self.version)
+        self.local.set(key, value)
+
+    def delete_many(self, names):
+        """Метод удаляет данные из обоих уровней кэша. Локальные кэши других процессов обновятся по истечении
+        LOCAL_CACHE_TIMEOUT."""
+
+        keys = [self.make_key(name) for name in names]
+        for key in keys:
+            self.local.delete(key)
+        cache.delete_many(keys, version=self.version)
+
+
+catalog_cache = TwoTierCache()
 
 
 def get_cached_categories():
+    """Функция возвращает список категорий (pk, название и описание). При включенном кэше список хранится в
+    двухуровневом кэше catalog_cache."""
+
+    def load():
+        return list(Category.objects.values('pk', 'category', 'description'))
+
     if settings.CACHE_ENABLED:
-        key = 'categories'
-        categories = cache.get(key)
-        if categories is None:
-            categories = Category.objects.all()
-            cache.set(key, categories)
-    else:
-        categories = Category.objects.all()
-
-    return categories
\ No newline at end of file
+        return catalog_cache.get_or_set(CATEGORIES_KEY, load)
+    return load()
+
+
+def _category_summary_querysets(limit):
+    categories = Category.objects.annotate(
+        published_count=Count('categories', filter=Q(categories__is_published=True))
+    ).order_by('category').values('pk', 'category', 'published_count')
+
+    products = Product.objects.filter(is_published=True).annotate(
+        row_number=Window(
+            RowNumber(),
+            partition_by=F('category_id'),
+            order_by=(F('published').desc(), F('pk').desc()),
+        )
+    ).filter(row_number__lte=limit).values('pk', 'name', 'category_id')
+
+    return categories, products
+
+
+def _merge_category_summaries(categories, products):
+    summaries = {category['pk']: {**category, 'products': []} for category in categories}
+    for product in products:
+        summaries[product['category_id']]['products'].append({'pk': product['pk'], 'name': product['name']})
+
+    return list(summaries.values())
+
+
+def get_category_summaries(limit=SIDEBAR_PRODUCTS_LIMIT):
+    """Функция возвращает список категорий для боковой панели: pk, название, количество опубликованных товаров и
+    до limit последних опубликованных товаров (pk и название). Независимо от количества категорий выполняется два
+    запроса: агрегация по категориям и выборка товаров с оконной функцией ROW_NUMBER() по каждой категории."""
+
+    categories, products = _category_summary_querysets(limit)
+    return _merge_category_summaries(categories, products)
+
+
+async def aget_category_summaries(limit=SIDEBAR_PRODUCTS_LIMIT):
+    """Асинхронный вариант get_category_summaries."""
+
+    categories, products = _category_summary_querysets(limit)
+    return _merge_category_summaries([row async for row in categories], [row async for row in products])
+
+
+def get_cached_category_summaries():
+    """Функция возвращает сводку по категориям из get_category_summaries. При включенном кэше сводка хранится
+    целиком под одним ключом в двухуровневом кэше catalog_cache и сбрасывается функцией invalidate_category_cache
+    при изменении товаров и категорий."""
+
+    if settings.CACHE_ENABLED:
+        return catalog_cache.get_or_set(CATEGORY_SUMMARIES_KEY, get_category_summaries)
+    return get_category_summaries()
+
+
+async def aget_cached_category_summaries():
+    """Асинхронный вариант get_cached_category_summaries."""
+
+    if settings.CACHE_ENABLED:
+        return await catalog_cache.aget_or_set(CATEGORY_SUMMARIES_KEY, aget_category_summaries)
+    return await aget_category_summaries()
+
+
+def invalidate_category_cache():
+    """Функция удаляет из кэша данные о категориях."""
+
+    if settings.CACHE_ENABLED:
+        catalog_cache.delete_many([CATEGORIES_KEY, CATEGORY_SUMMARIES_KEY])
+
+
+def _homepage_queryset(limit):
+    return Product.objects.filter(is_published=True).order_by('-published').values(
+        'pk', 'name', 'description', 'price', 'published', 'user_product_id'
+    )[:limit]
+
+
+def _make_homepage_snapshot(products):
+    raw = json.dumps(products, cls=DjangoJSONEncoder, sort_keys=True)
+
+    return {
+        'generated': timezone.now(),
+        'etag': hashlib.md5(raw.encode()).hexdigest(),
+        'products': products,
+    }
+
+
+def _parse_homepage_snapshot(snapshot):
+    """Даты, прочитанные из общего кэша в виде строк, преобразуются обратно в datetime."""
+
+    def as_datetime(value):
+        return parse_datetime(value) if isinstance(value, str) else value
+
+    return {
+        **snapshot,
+        'generated': as_datetime(snapshot['generated']),
+        'products': [{**product, 'published': as_datetime(product['published'])} for product in snapshot['products']],
+    }
+
+
+def build_homepage_snapshot(limit=HOMEPAGE_PRODUCTS_LIMIT):
+    """Функция строит снимок данных главной страницы: limit последних опубликованных товаров (выборка по частичному
+    индексу product_published_live_idx), дату построения и хэш содержимого, который используется как ETag."""
+
+    return _make_homepage_snapshot(list(_homepage_queryset(limit)))
+
+
+async def abuild_homepage_snapshot(limit=HOMEPAGE_PRODUCTS_LIMIT):
+    """Асинхронный вариант build_homepage_snapshot."""
+
+    return _make_homepage_snapshot([row async for row in _homepage_queryset(limit)])
+
+
+def get_homepage_snapshot():
+    """Функция возвращает снимок главной страницы. Снимок хранится в catalog_cache и обновляется функцией
+    refresh_homepage_snapshot при изменении товаров, поэтому главная страница не выполняет запросов к базе данных.
+    Без общего кэша (CACHE_ENABLED) снимок хранится только в локальном кэше процесса: другие процессы строят его
+    заново не чаще раза в LOCAL_CACHE_TIMEOUT секунд и столько же могут отдавать устаревший снимок."""
+
+    return _parse_homepage_snapshot(
+        catalog_cache.get_or_set(HOMEPAGE_KEY, build_homepage_snapshot, shared=settings.CACHE_ENABLED)
+    )
+
+
+async def aget_homepage_snapshot():
+    """Асинхронный вариант get_homepage_snapshot."""
+
+    return _parse_homepage_snapshot(
+        await catalog_cache.aget_or_set(HOMEPAGE_KEY, abuild_homepage_snapshot, shared=settings.CACHE_ENABLED)
+    )
+
+
+def refresh_homepage_snapshot():
+    """Функция заново строит снимок главной страницы и записывает его в кэш."""
+
+    catalog_cache.set(HOMEPAGE_KEY, build_homepage_snapshot(), shared=settings.CACHE_ENABLED)
+
+
+def with_active_versions(queryset):
+    """Функция добавляет к выборке товаров предзагрузку активных версий: у каждого товара страницы появляется
+    атрибут active_versions со списком его активных версий. Предзагрузка выполняется одним запросом по pk товаров
+    текущей страницы, поэтому ее стоимость зависит от размера страницы, а не от общего числа версий."""
+
+    return queryset.select_related('user_product').prefetch_related(
+        Prefetch('versions', queryset=Version.objects.filter(is_active=True), to_attr='active_versions')
+    )
@@ -0,0 +1,115 @@
+from contextlib import contextmanager
+from functools import partial
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from catalog.cache_tags import invalidate_tags, product_tag, category_tag, PRODUCTS_TAG
+from catalog.models import Category, Product, Version, Blog
+from catalog.renditions import enqueue_renditions
+from catalog.services import invalidate_category_cache, refresh_homepage_snapshot
+
+# Признак массовой операции, которая сама сбрасывает кэш один раз после изменения всех строк
+_bulk_changes = ContextVar('bulk_changes', default=False)
+
+
+@contextmanager
+def bulk_changes():
+    """Контекстный менеджер для массовых операций (например, удаления товаров при синхронизации): внутри блока
+    обработчики сигналов, которые сбрасывают кэш, ничего не делают, а кэш сбрасывает сама операция."""
+
+    token = _bulk_changes.set(True)
+    try:
+        yield
+    finally:
+        _bulk_changes.reset(token)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def reset_category_cache(sender, **kwargs):
+    """При изменении или удалении товара или категории сбрасывается кэш с данными о категориях. Кэш сбрасывается
+    после фиксации транзакции: иначе параллельный запрос мог бы прочитать старые данные и снова записать их в кэш."""
+    if not _bulk_changes.get():
+        transaction.on_commit(invalidate_category_cache)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def reset_product_pages(sender, instance, **kwargs):
+    """При изменении или удалении товара сбрасываются закэшированные страницы товара и результаты поиска. Теги
+    сбрасываются после фиксации транзакции: иначе параллельный запрос мог бы прочитать старые данные и сохранить
+    страницу с новыми версиями тегов."""
+    if not _bulk_changes.get():
+        transaction.on_commit(partial(invalidate_tags, product_tag(instance.pk), PRODUCTS_TAG))
+
+
+@receiver([post_save, post_delete], sender=Product)
+def rebuild_homepage_snapshot(sender, **kwargs):
+    """При изменении, публикации или удалении товара снимок главной страницы строится заново после фиксации
+    транзакции, чтобы в снимок не попали отмененные изменения."""
+    if not _bulk_changes.get():
+        transaction.on_commit(refresh_homepage_snapshot)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def reset_category_pages(sender, instance, **kwargs):
+    """При изменении или удалении категории сбрасываются закэшированные страницы товаров этой категории и страницы
+    со списками товаров (после фиксации транзакции)."""
+    if not _bulk_changes.get():
+        transaction.on_commit(partial(invalidate_tags, category_tag(instance.pk), PRODUCTS_TAG))
+
+
+@receiver([post_save, post_delete], sender=Version)
+def reset_version_pages(sender, instance, **kwargs):
+    """При изменении или удалении версии сбрасываются закэшированная страница ее товара и страницы со списками
+    товаров, на которых выводятся активные версии (после фиксации транзакции)."""
+    if not _bulk_changes.get():
+        transaction.on_commit(partial(invalidate_tags, product_tag(instance.product_id), PRODUCTS_TAG))
+
+
+def _remember_file(instance, field):
+    # Имя читается из __dict__: обращение к отложенному полю выполнило бы запрос к базе данных
+    value = instance.__dict__.get(field)
+    instance._saved_file_name = getattr(value, 'name', value) or ''
+
+
+def _file_changed(instance, field, created, update_fields):
+    """Функция возвращает True, если сохранение записало в поле field другой файл: запись создана, или поле
+    сохранялось и имя файла отличается от загруженного из базы данных. Так сохранения, которые не трогают файл
+    (например, обновление даты последнего входа), не ставят изображение в очередь повторно."""
+
+    if update_fields is not None and field not in update_fields:
+        return False
+    name = getattr(instance, field).name or ''
+    changed = created or name != getattr(instance, '_saved_file_name', None)
+    instance._saved_file_name = name
+    return changed
+
+
+@receiver(post_init, sender=Product)
+@receiver(post_init, sender=Blog)
+def remember_image(sender, instance, **kwargs):
+    _remember_file(instance, 'image')
+
+
+@receiver(post_init, sender='users.User')
+def remember_avatar(sender, instance, **kwargs):
+    _remember_file(instance, 'avatar')
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Blog)
+def queue_image_renditions(sender, instance, created, update_fields, **kwargs):
+    """После сохранения товара или публикации блога с новым изображением оно ставится в очередь на создание
+    уменьшенных копий."""
+    if _file_changed(instance, 'image', created, update_fields):
+        enqueue_renditions(instance.image.name)
+
+
+@receiver(post_save, sender='users.User')
+def queue_avatar_renditions(sender, instance, created, update_fields, **kwargs):
+    """После сохранения пользователя с новым аватаром он ставится в очередь на создание уменьшенных копий."""
+    if _file_changed(instance, 'avatar', created, update_fields):
+        enqueue_renditions(instance.avatar.name)
@@ -1,20 +1,36 @@
 from django import template
+from django.conf import settings
+from django.utils.html import format_html
 
-from catalog.models import Product
+from catalog.renditions import RENDITION_WIDTHS, rendition_name, renditions_ready
 
 register = template.Library()
 
 
-@register.filter()
-def product_by_keyword(keyword):
-    user_object = Product.objects.filter(name__icontains=keyword, is_published=True)
-    if user_object.exists():
-        return user_object
-    return False
-
-
 @register.filter()
 def media_path(product):
     if product:
         return f'/media/{product}'
     return '/static/sample.png'
+
+
+@register.simple_tag
+def responsive_image(image, css_class='card-img', sizes='100vw'):
+    """Тег выводит изображение в теге <picture> с уменьшенными копиями в формате WebP и в формате оригинала
+    (атрибут srcset), чтобы браузер загружал копию нужного размера. Пока копии не созданы командой make_renditions,
+    выводится оригинал."""
+
+    src = media_path(image)
+    if not image or not renditions_ready(image.name):
+        return format_html('<img src="{}" class="{}">', src, css_class)
+
+    def srcset(extension=None):
+        return ', '.join(
+            f'{settings.MEDIA_URL}{rendition_name(image.name, width, extension)} {width}w' for width in RENDITION_WIDTHS
+        )
+
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" class="{}" loading="lazy"></picture>',
+        srcset('.webp'), sizes, src, srcset(), sizes, css_class,
+    )
@@ -0,0 +1,134 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.cache import caches
+from django.test import Client, TestCase
+from django.urls import reverse, URLPattern
+
+from catalog.counters import local_view_counter
+from catalog.models import Blog, Category, Feedback, Product, Version
+from catalog.profiling import Profile
+from catalog.services import catalog_cache
+from users.models import User
+
+# Роли пользователей, от имени которых запрашиваются страницы
+ANONYMOUS = 'anonymous'
+REGULAR = 'regular'
+STAFF = 'staff'
+ROLES = (ANONYMOUS, REGULAR, STAFF)
+
+# Бюджет страницы: максимальное количество запросов к базе данных и вызовов кэша
+Budget = namedtuple('Budget', 'queries cache_calls')
+
+
+def budgets(anonymous, regular, staff=None):
+    """Функция возвращает бюджеты страницы для ролей. Аргументы — кортежи (запросы, вызовы кэша); бюджет персонала
+    по умолчанию совпадает с бюджетом обычного пользователя."""
+    return {ANONYMOUS: Budget(*anonymous), REGULAR: Budget(*regular), STAFF: Budget(*(staff or regular))}
+
+
+def seed_catalog(categories=5, products_per_category=12, unpublished_per_category=3, versions_per_product=3,
+                 blogs=12, feedback=30):
+    """Функция заполняет базу данных набором данных, близким к рабочему: пользователи всех ролей, категории с
+    опубликованными и неопубликованными товарами, версии товаров (одна активная), публикации блога и обратная связь.
+    Возвращает словарь с созданными объектами, которые нужны для построения адресов."""
+
+    regular = User.objects.create(email='regular@example.com')
+    staff = User.objects.create(email='staff@example.com', is_staff=True, is_superuser=True)
+    pending = User.objects.create(email='pending@example.com', is_active=False, user_identity='pendingkey')
+
+    created_categories = Category.objects.bulk_create([
+        Category(category=f'Категория {index}', description='Описание категории', user_category=staff)
+        for index in range(categories)
+    ])
+
+    products = []
+    for category in created_categories:
+        for index in range(products_per_category + unpublished_per_category):
+            products.append(Product(
+                name=f'Товар {category.pk}-{index}', description='Описание товара', price=100 + index,
+                category=category, user_product=regular if index % 2 else staff,
+                is_published=index < products_per_category,
+            ))
+    products = Product.objects.bulk_create(products)
+
+    Version.objects.bulk_create([
+        Version(product=product, number=Decimal('1.00') + Decimal('0.1') * index, is_active=index == 0)
+        for product in products for index in range(versions_per_product)
+    ])
+
+    created_blogs = Blog.objects.bulk_create([
+        Blog(title=f'Публикация {index}', slug=f'publication-{index}', content='Текст публикации',
+             email='regular@example.com', user_blog=regular)
+        for index in range(blogs)
+    ])
+
+    Feedback.objects.bulk_create([
+        Feedback(first_name='Иван', last_name='Иванов', email=f'user{index}@example.com', message='Сообщение')
+        for index in range(feedback)
+    ])
+
+    return {
+        'users': {REGULAR: regular, STAFF: staff},
+        'pending_user': pending,
+        'category': created_categories[0],
+        'product': next(product for product in products if product.is_published and product.user_product == regular),
+        'blog': created_blogs[0],
+    }
+
+
+class QueryBudgetTestCase(TestCase):
+    """Базовый класс тестов бюджета запросов. Подкласс задает urlpatterns и пространство имен namespace проверяемого
+    приложения, словарь page_budgets {имя адреса: бюджеты ролей (см. budgets)} и, для адресов с параметрами,
+    метод get_url_kwargs. Каждый адрес запрашивается методом GET от имени анонимного пользователя, обычного
+    пользователя и персонала с очищенным кэшем, поэтому бюджет соответствует самому дорогому (холодному) запросу.
+    При превышении бюджета в сообщении об ошибке выводятся запросы, сгруппированные по месту вызова."""
+
+    urlpatterns = ()
+    namespace = None
+    page_budgets = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_catalog()
+
+    def get_url_kwargs(self, name):
+        return {}
+
+    def clear_caches(self):
+        for cache in caches.all():
+            cache.clear()
+        catalog_cache.local.clear()
+        local_view_counter.clear()
+
+    def profile_get(self, role, url):
+        """Метод выполняет GET-запрос от имени роли role и возвращает ответ и профиль запроса."""
+
+        client = Client()
+        if role != ANONYMOUS:
+            client.force_login(self.data['users'][role])
+        self.clear_caches()
+
+        with Profile() as profile:
+            response = client.get(url)
+        return response, profile
+
+    def test_every_url_has_budget(self):
+        names = {pattern.name for pattern in self.urlpatterns if isinstance(pattern, URLPattern)}
+        self.assertEqual(names - set(self.page_budgets), set(), 'Для адресов не задан бюджет запросов')
+        self.assertEqual(set(self.page_budgets) - names, set(), 'Бюджет задан для несуществующих адресов')
+
+    def test_pages_within_budget(self):
+        for name, role_budgets in self.page_budgets.items():
+            url = reverse(f'{self.namespace}:{name}', kwargs=self.get_url_kwargs(name))
+            for role in ROLES:
+                with self.subTest(url=name, role=role):
+                    response, profile = self.profile_get(role, url)
+                    self.assertLess(response.status_code, 500)
+                    self.assert_within_budget(f'{self.namespace}:{name} ({role})', profile, role_budgets[role])
+
+    def assert_within_budget(self, label, profile, budget):
+        queries, cache_calls = len(profile.queries), len(profile.cache_calls)
+        if queries > budget.queries or cache_calls > budget.cache_calls:
+            self.fail(f'{label}: запросов {queries} (бюджет {budget.queries}), вызовов кэша {cache_calls} '
+                      f'(бюджет {budget.cache_calls})\n{profile.report()}')
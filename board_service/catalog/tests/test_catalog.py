@@ -0,0 +1,1514 @@
+import base64
+import csv
+import datetime
+import io
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import SyncToAsync, async_to_sync, sync_to_async
+from django.contrib.auth.models import update_last_login
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.template.backends.django import Template as DjangoTemplate
+from django.template.response import TemplateResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from catalog import metrics, renditions
+from catalog.counters import flush_view_counts, local_view_counter, record_view
+from catalog.importers import ImportFormatError, import_products, sync_products
+from catalog.journal import Journal
+from catalog.middleware import QUERY_INSPECTOR_HEADER, SERVER_TIMING_TOKEN_HEADER, QueryInspectorMiddleware, \
+    make_server_timing_token
+from catalog.models import Blog, Category, Feedback, OutgoingEmail, Product, RenditionJob, Version
+from catalog.outbox import SEND_TIMEOUT, enqueue_mail, send_pending_mail
+from catalog.paginators import InvalidCursor, KeysetPaginator, decode_cursor, encode_cursor
+from catalog.profiling import Profile, profile_template_response
+from catalog.renditions import PROCESS_TIMEOUT, process_pending_renditions, rendition_name
+from catalog.search import asearch_products, search_products
+from catalog.services import LOCAL_CACHE_TIMEOUT, LocalCache, TwoTierCache, catalog_cache, get_cached_categories, \
+    get_homepage_snapshot
+from catalog.templatetags.products_tags import responsive_image
+from catalog.tests import query_budget
+from catalog.tests.query_budget import budgets
+from catalog.urls import urlpatterns
+from catalog.views import BlogDetailView, BlogListView, FeedbackExportView, ProductDetailView, ProductListView, \
+    ProductSearchView
+from users.models import User
+
+WRITE_RE = re.compile(r'^(INSERT INTO|UPDATE|DELETE FROM) "(\w+)"')
+
+
+def writes(queries):
+    """Функция возвращает операции записи из перехваченных запросов в виде строк 'INSERT catalog_product'."""
+
+    result = []
+    for query in queries:
+        match = WRITE_RE.match(query['sql'])
+        if match:
+            result.append(f'{match.group(1).split()[0]} {match.group(2)}')
+    return result
+
+
+class WritePathTestCase(TestCase):
+    """Формы создания и изменения товаров, категорий и публикаций записывают основную строку одним запросом, а
+    версии товара — пачкой, в одной транзакции."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='owner@example.com')
+        cls.staff = User.objects.create(email='staff@example.com', is_staff=True, is_superuser=True)
+        cls.category = Category.objects.create(category='Техника', description='Описание')
+        cls.product = Product.objects.create(name='Телефон', description='Описание', price=100,
+                                             category=cls.category, user_product=cls.user)
+        cls.first = Version.objects.create(product=cls.product, title=Version.VersionName.NAME_RELEASE,
+                                           number=Decimal('1.00'), is_active=True)
+        cls.second = Version.objects.create(product=cls.product, number=Decimal('1.10'))
+
+    def capture_writes(self, url, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        return response, writes(queries)
+
+    def product_data(self, **kwargs):
+        data = {'name': 'Смартфон', 'description': 'Описание', 'price': '150', 'category': self.category.pk}
+        data.update(kwargs)
+        return data
+
+    def version_data(self, *versions, extra=None):
+        """Метод возвращает данные вложенной формы версий: versions — существующие версии с измененными полями,
+        extra — поля новой версии. Пустая дополнительная форма, как и в браузере, содержит значения по умолчанию."""
+
+        blank = {'product': self.product.pk, 'title': Version.VersionName.NAME_DEVELOP}
+        forms = list(versions) + [{**blank, **(extra or {})}]
+        data = {
+            'versions-TOTAL_FORMS': len(forms),
+            'versions-INITIAL_FORMS': len(versions),
+            'versions-MIN_NUM_FORMS': 0,
+            'versions-MAX_NUM_FORMS': 1000,
+        }
+        for index, form in enumerate(forms):
+            for field, value in form.items():
+                if value is not None and value is not False:
+                    data[f'versions-{index}-{field}'] = 'on' if value is True else value
+        return data
+
+    def existing(self, version, **kwargs):
+        form = {'id': version.pk, 'product': self.product.pk, 'title': version.title, 'number': version.number,
+                'is_active': version.is_active}
+        form.update(kwargs)
+        return form
+
+    def test_product_create_inserts_once(self):
+        self.client.force_login(self.user)
+        response, written = self.capture_writes(reverse('catalog:add_product'), self.product_data())
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(written, ['INSERT catalog_product'])
+        self.assertEqual(Product.objects.get(name='Смартфон').user_product, self.user)
+
+    def test_product_update_without_version_changes(self):
+        self.client.force_login(self.user)
+        data = {**self.product_data(), **self.version_data(self.existing(self.first), self.existing(self.second))}
+        response, written = self.capture_writes(reverse('catalog:update_product', args=[self.product.pk]), data)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(written, ['UPDATE catalog_product'])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'Смартфон')
+
+    def test_product_update_batches_version_writes(self):
+        self.client.force_login(self.user)
+        data = {**self.product_data(), **self.version_data(
+            self.existing(self.first, title=Version.VersionName.NAME_DEVELOP),
+            self.existing(self.second, title=Version.VersionName.NAME_RELEASE),
+            extra={'title': Version.VersionName.NAME_RELEASE},
+        )}
+        response, written = self.capture_writes(reverse('catalog:update_product', args=[self.product.pk]), data)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(written, ['UPDATE catalog_product', 'UPDATE catalog_version', 'INSERT catalog_version'])
+        self.assertEqual(
+            list(self.product.versions.order_by('number').values_list('title', 'number')),
+            [(Version.VersionName.NAME_DEVELOP, Decimal('1.00')), (Version.VersionName.NAME_RELEASE, Decimal('1.10')),
+             (Version.VersionName.NAME_RELEASE, Decimal('1.20'))],
+        )
+
+    def test_product_update_switches_active_version(self):
+        self.client.force_login(self.user)
+        data = {**self.product_data(), **self.version_data(
+            self.existing(self.first, is_active=False), self.existing(self.second, is_active=True),
+        )}
+        response, written = self.capture_writes(reverse('catalog:update_product', args=[self.product.pk]), data)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(written, ['UPDATE catalog_product', 'UPDATE catalog_version', 'UPDATE catalog_version'])
+        self.assertEqual(list(self.product.versions.filter(is_active=True)), [self.second])
+
+    def test_product_update_deletes_versions_in_one_query(self):
+        self.client.force_login(self.user)
+        data = {**self.product_data(), **self.version_data(
+            self.existing(self.first, DELETE=True), self.existing(self.second, DELETE=True),
+        )}
+        response, written = self.capture_writes(reverse('catalog:update_product', args=[self.product.pk]), data)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(written, ['UPDATE catalog_product', 'DELETE catalog_version'])
+        self.assertFalse(self.product.versions.exists())
+
+    def test_product_update_rolls_back_second_active_version(self):
+        self.client.force_login(self.user)
+        data = {**self.product_data(), **self.version_data(
+            self.existing(self.first), self.existing(self.second, is_active=True),
+        )}
+        response = self.client.post(reverse('catalog:update_product', args=[self.product.pk]), data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['formset'].non_form_errors())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'Телефон')
+        self.assertEqual(list(self.product.versions.filter(is_active=True)), [self.first])
+
+    def test_product_update_invalid_formset_writes_nothing(self):
+        self.client.force_login(self.user)
+        data = {**self.product_data(), **self.version_data(self.existing(self.first, number='0.5'))}
+        response, written = self.capture_writes(reverse('catalog:update_product', args=[self.product.pk]), data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(written, [])
+        self.assertTrue(response.context['formset'].errors[0])
+
+    def test_product_update_page_builds_formset_once(self):
+        self.client.force_login(self.user)
+        # Сессия, пользователь, товар вместе с автором, категории для шаблона и для поля формы, права пользователя
+        # (два запроса) и версии товара, которые выбираются один раз
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse('catalog:update_product', args=[self.product.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_category_create_and_update_write_once(self):
+        self.client.force_login(self.staff)
+        response, written = self.capture_writes(reverse('catalog:add_category'),
+                                                {'category': 'Книги', 'description': 'Описание'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(written, ['INSERT catalog_category'])
+        category = Category.objects.get(category='Книги')
+        self.assertEqual(category.user_category, self.staff)
+
+        response, written = self.capture_writes(reverse('catalog:update_category', args=[category.pk]),
+                                                {'category': 'Журналы', 'description': 'Описание'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(written, ['UPDATE catalog_category'])
+
+    def test_blog_create_and_update_write_once(self):
+        self.client.force_login(self.user)
+        data = {'title': 'Новая публикация', 'content': 'Текст', 'email': 'owner@example.com'}
+        response, written = self.capture_writes(reverse('catalog:add_blog'), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(written, ['INSERT catalog_blog'])
+        blog = Blog.objects.get(title='Новая публикация')
+        self.assertEqual((blog.slug, blog.user_blog), ('novaya-publikatsiya', self.user))
+
+        response, written = self.capture_writes(reverse('catalog:update_blog', args=[blog.pk]),
+                                                {**data, 'content': 'Другой текст'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(written, ['UPDATE catalog_blog'])
+
+
+class ModerationTest(TestCase):
+    """Массовая модерация товаров по списку и по фильтру."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.moderator = User.objects.create(email='moderator@example.com', is_staff=True, is_superuser=True)
+        cls.category = Category.objects.create(category='Техника', description='Описание')
+        cls.other = Category.objects.create(category='Книги', description='Описание')
+        cls.products = [
+            Product.objects.create(name=f'Товар {index}', price=100, category=category)
+            for index, category in enumerate((cls.category, cls.category, cls.other))
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.moderator)
+
+    def bulk(self, **data):
+        return self.client.post(reverse('catalog:bulk_moderate_products'), {'action': 'publish', **data})
+
+    def published(self):
+        return set(Product.objects.filter(is_published=True).values_list('name', flat=True))
+
+    def test_filter_without_conditions_is_rejected(self):
+        response = self.bulk(apply_to_filter='on')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.published(), set())
+
+    def test_filter_by_category(self):
+        response = self.bulk(apply_to_filter='on', category=self.category.pk)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.published(), {'Товар 0', 'Товар 1'})
+
+    def test_selected_products(self):
+        response = self.bulk(products=str(self.products[2].pk))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.published(), {'Товар 2'})
+
+    def test_page_does_not_claim_products(self):
+        response = self.client.get(reverse('catalog:moderate_products'))
+
+        self.assertEqual(list(response.context['object_list']), [])
+        self.assertFalse(Product.objects.filter(claimed_by__isnull=False).exists())
+
+    def test_claim_on_post(self):
+        self.assertEqual(self.client.get(reverse('catalog:claim_products')).status_code, 405)
+
+        response = self.client.post(reverse('catalog:claim_products'))
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(reverse('catalog:moderate_products'))
+        self.assertEqual(list(response.context['object_list']), self.products)
+
+    def test_moderation_releases_claims(self):
+        self.client.post(reverse('catalog:claim_products'))
+        self.bulk(products=str(self.products[0].pk))
+        self.client.post(reverse('catalog:publish_product', args=[self.products[1].pk]), {'is_published': 'on'})
+
+        self.assertEqual(
+            list(Product.objects.filter(claimed_by__isnull=False).values_list('name', flat=True)), ['Товар 2'],
+        )
+        self.assertFalse(Product.objects.filter(claim_expires__isnull=False, is_published=True).exists())
+
+
+class CatalogQueryBudgetTest(query_budget.QueryBudgetTestCase):
+    """Бюджеты запросов страниц каталога. Для авторизованного пользователя к бюджету добавляются сессия и
+    пользователь (два запроса), а для пользователя без прав суперпользователя — еще права из шапки страницы (два
+    запроса). Страницы, закрытые для анонимного пользователя, перенаправляют на вход без запросов."""
+
+    urlpatterns = urlpatterns
+    namespace = 'catalog'
+    page_budgets = {
+        'index': budgets((1, 0), (5, 0), (3, 0)),
+        'feedback': budgets((0, 0), (4, 0), (2, 0)),
+        'feedback_export': budgets((0, 0), (4, 0), (2, 0)),
+        'product_list': budgets((5, 4), (9, 4), (7, 4)),
+        'product_search': budgets((0, 6), (4, 6), (2, 6)),
+        'product_detail': budgets((2, 11), (6, 11), (4, 11)),
+        'about_list': budgets((1, 0), (5, 0), (3, 0)),
+        'add_product': budgets((0, 0), (6, 0), (4, 0)),
+        'update_product': budgets((0, 0), (8, 0), (6, 0)),
+        'delete_product': budgets((0, 0), (5, 0), (3, 0)),
+        'publish_product': budgets((0, 0), (4, 0), (3, 0)),
+        'moderate_products': budgets((0, 0), (4, 0), (4, 0)),
+        'bulk_moderate_products': budgets((0, 0), (4, 0), (2, 0)),
+        'claim_products': budgets((0, 0), (4, 0), (2, 0)),
+        'release_products': budgets((0, 0), (4, 0), (2, 0)),
+        'add_category': budgets((0, 0), (4, 0), (2, 0)),
+        'update_category': budgets((0, 0), (3, 0), (3, 0)),
+        'delete_category': budgets((0, 0), (4, 0), (3, 0)),
+        'blog_list': budgets((1, 0), (5, 0), (3, 0)),
+        'blog_detail': budgets((2, 0), (6, 0), (4, 0)),
+        'add_blog': budgets((0, 0), (4, 0), (2, 0)),
+        'update_blog': budgets((0, 0), (5, 0), (3, 0)),
+        'delete_blog': budgets((0, 0), (5, 0), (3, 0)),
+        # Ответы API: запрос для ETag (или версии тегов кэша) и выборка данных
+        'api_products': budgets((2, 0), (2, 0)),
+        'api_product': budgets((2, 0), (2, 0)),
+        'api_product_versions': budgets((2, 2), (2, 2)),
+        'api_categories': budgets((1, 2), (1, 2)),
+        'api_blogs': budgets((2, 0), (2, 0)),
+        'api_blog': budgets((2, 0), (2, 0)),
+        'metrics': budgets((0, 0), (0, 0)),
+    }
+
+    def get_url_kwargs(self, name):
+        if name in ('product_detail', 'update_product', 'delete_product', 'publish_product', 'api_product',
+                    'api_product_versions'):
+            return {'pk': self.data['product'].pk}
+        if name in ('update_category', 'delete_category'):
+            return {'pk': self.data['category'].pk}
+        if name in ('blog_detail', 'update_blog', 'delete_blog', 'api_blog'):
+            return {'pk': self.data['blog'].pk}
+        return {}
+
+
+class ProfilingHooksTest(TestCase):
+    """Профилирование не подменяет методы классов Django: кэш перехватывается у объектов, а шаблон — у ответа."""
+
+    def test_classes_are_not_patched(self):
+        with Profile() as profile:
+            cache.get('key')
+            response = TemplateResponse(RequestFactory().get('/'), 'catalog/index.html', {'object_list': []})
+            profile_template_response(response).render()
+
+        self.assertEqual([call.method for call in profile.cache_calls], ['get'])
+        self.assertEqual([template.name for template in profile.templates], ['catalog/index.html'])
+        self.assertFalse(getattr(type(caches['default']).get, 'profiled', False))
+        self.assertFalse(getattr(DjangoTemplate.render, 'profiled', False))
+        self.assertFalse(getattr(SyncToAsync.__call__, 'profiled', False))
+
+    def test_async_view_sites(self):
+        blog = Blog.objects.create(title='Публикация', content='Текст', email='owner@example.com')
+        local_view_counter.clear()
+        self.addCleanup(local_view_counter.clear)
+
+        async def get():
+            await self.async_client.get(reverse('catalog:blog_detail', args=[blog.pk]))
+
+        with Profile() as profile:
+            async_to_sync(get)()
+
+        # Запросы асинхронного ORM относятся к строкам асинхронного контроллера, а не к потоку sync_to_async
+        sites = {query.site.split(':')[0] for query in profile.queries}
+        self.assertIn('catalog/views.py', sites)
+        self.assertNotIn('<unknown>', sites)
+
+
+@override_settings(QUERY_INSPECTOR_ENABLED=True, QUERY_INSPECTOR_HEADER=True, QUERY_INSPECTOR_THRESHOLD=2)
+class QueryInspectorMiddlewareTest(TestCase):
+    """Промежуточный слой находит запросы в цикле (N+1) и одинаковые запросы и относит их к месту вызова."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(email='owner@example.com')
+        for index in range(3):
+            category = Category.objects.create(category=f'Категория {index}', description='Описание')
+            Product.objects.create(name=f'Товар {index}', description='Описание', price=100, category=category,
+                                   user_product=user)
+
+    def inspect(self, view):
+        middleware = QueryInspectorMiddleware(view)
+        with self.assertLogs('catalog.queries', 'WARNING') as logs:
+            response = middleware(RequestFactory().get('/products/'))
+        return response, [record.fields for record in logs.records]
+
+    def test_reports_lazy_loads_in_loop(self):
+        def view(request):
+            return HttpResponse(', '.join(product.category.category for product in Product.objects.all()))
+
+        response, records = self.inspect(view)
+
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]['kind'], records[0]['count'], records[0]['queries']), ('n+1', 3, 4))
+        self.assertIn('catalog_category', records[0]['sql'])
+        self.assertEqual(list(records[0]['sites'].values()), [3])
+        self.assertTrue(response.headers[QUERY_INSPECTOR_HEADER].startswith('queries=4; repeated=3; '))
+
+    def test_reports_duplicates(self):
+        def view(request):
+            for _ in range(2):
+                Product.objects.filter(name='Товар 0').first()
+            Product.objects.count()
+            return HttpResponse()
+
+        response, records = self.inspect(view)
+
+        self.assertEqual([(record['kind'], record['count']) for record in records], [('duplicate', 2)])
+
+    def test_disabled_by_default(self):
+        with override_settings(QUERY_INSPECTOR_ENABLED=False), self.assertRaises(MiddlewareNotUsed):
+            QueryInspectorMiddleware(lambda request: HttpResponse())
+
+
+@override_settings(SERVER_TIMING_ENABLED=True)
+class ServerTimingMiddlewareTest(TestCase):
+    """Заголовок Server-Timing добавляется только для персонала и для запросов с подписанным токеном."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='owner@example.com')
+        cls.staff = User.objects.create(email='staff@example.com', is_staff=True)
+        category = Category.objects.create(category='Техника', description='Описание')
+        Product.objects.create(name='Телефон', description='Описание', price=100, category=category,
+                               user_product=cls.user)
+
+    def timing(self, response):
+        header = response.headers.get('Server-Timing')
+        return header and {metric.split(';')[0]: metric for metric in header.split(', ')}
+
+    def test_staff_gets_breakdown(self):
+        self.client.force_login(self.staff)
+        metrics = self.timing(self.client.get(reverse('catalog:product_list')))
+
+        self.assertEqual(list(metrics), ['db', 'cache-get', 'cache-set', 'template', 'view', 'total'])
+        self.assertRegex(metrics['db'], r'^db;dur=\d+\.\d{2};desc="\d+ queries"$')
+        self.assertRegex(metrics['cache-get'], r'desc="calls=\d+ hits=\d+ misses=\d+"$')
+        self.assertRegex(metrics['template'], r'desc="1 renders"$')
+
+    async def test_staff_gets_breakdown_from_async_view(self):
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        metrics = self.timing(await self.async_client.get(reverse('catalog:product_list')))
+        self.assertRegex(metrics['template'], r'desc="1 renders"$')
+
+    def test_hidden_from_other_users(self):
+        self.assertIsNone(self.timing(self.client.get(reverse('catalog:product_list'))))
+        self.client.force_login(self.user)
+        self.assertIsNone(self.timing(self.client.get(reverse('catalog:product_list'))))
+
+    def test_signed_token(self):
+        url = reverse('catalog:api_products')
+        response = self.client.get(url, headers={SERVER_TIMING_TOKEN_HEADER: make_server_timing_token()})
+        self.assertIn('db', self.timing(response))
+
+        response = self.client.get(url, headers={SERVER_TIMING_TOKEN_HEADER: 'server-timing:forged'})
+        self.assertIsNone(self.timing(response))
+
+
+class ApiConditionalGetTest(TestCase):
+    """ETag ответов API вычисляется до выборки данных, а при совпадении с If-None-Match данные не выбираются."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(category='Техника', description='Описание')
+        cls.product = Product.objects.create(name='Телефон', price=100, category=cls.category, is_published=True)
+        cls.hidden = Product.objects.create(name='Планшет', price=200, category=cls.category)
+        Version.objects.create(product=cls.product, number=Decimal('1.00'))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_not_modified_skips_data_query(self):
+        url = reverse('catalog:api_products')
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_depends_on_changes_and_params(self):
+        url = reverse('catalog:api_products')
+        etag = self.client.get(url)['ETag']
+
+        self.assertNotEqual(self.client.get(url, {'fields': 'id'})['ETag'], etag)
+        self.hidden.is_published = True
+        self.hidden.save()
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_versions_of_unknown_or_unpublished_product(self):
+        response = self.client.get(reverse('catalog:api_product_versions', args=[self.product.pk]))
+        self.assertEqual([item['number'] for item in response.json()['results']], ['1.00'])
+
+        for pk in (self.hidden.pk, 0):
+            response = self.client.get(reverse('catalog:api_product_versions', args=[pk]))
+            self.assertEqual(response.status_code, 404)
+
+    def test_version_change_updates_etag(self):
+        url = reverse('catalog:api_product_versions', args=[self.product.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Version.objects.create(product=self.product, number=Decimal('1.10'))
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_unpublished_product_not_found(self):
+        response = self.client.get(reverse('catalog:api_product', args=[self.hidden.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='secret')
+class MetricsTest(TestCase):
+    """Метрики запросов записываются по имени адреса и выводятся в текстовом формате Prometheus."""
+
+    def setUp(self):
+        metrics.registry.clear()
+
+    def get_metrics(self, **headers):
+        headers.setdefault('Authorization', 'Bearer secret')
+        response = self.client.get(reverse('catalog:metrics'), headers=headers)
+        return response, response.content.decode()
+
+    def test_metrics_by_url_name(self):
+        for _ in range(2):
+            self.client.get(reverse('catalog:api_categories'))
+        self.client.get('/missing/')
+
+        response, text = self.get_metrics()
+
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_responses_total{view="catalog:api_categories",method="GET",status="200"} 2', text)
+        self.assertIn('http_responses_total{view="<unresolved>",method="GET",status="404"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{view="catalog:api_categories",method="GET"} 2', text)
+        self.assertIn('http_request_db_queries_bucket{view="catalog:api_categories",le="1"} 2', text)
+        self.assertIn('http_response_size_bytes_bucket{view="catalog:api_categories",le="+Inf"} 2', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = metrics.Registry()
+        histogram = registry.register(metrics.Histogram('test_seconds', 'Тест', ('view',), buckets=(1, 2)))
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value, view='index')
+
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP test_seconds Тест',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="index",le="1"} 2',
+            'test_seconds_bucket{view="index",le="2"} 3',
+            'test_seconds_bucket{view="index",le="+Inf"} 4',
+            'test_seconds_sum{view="index"} 6.0',
+            'test_seconds_count{view="index"} 4',
+        ])
+
+    def test_token(self):
+        self.assertEqual(self.get_metrics(Authorization='')[0].status_code, 403)
+        self.assertEqual(self.get_metrics(Authorization='Bearer other')[0].status_code, 403)
+        self.assertEqual(self.get_metrics()[0].status_code, 200)
+
+    def test_closed_without_token(self):
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.get_metrics(Authorization='Bearer ')[0].status_code, 403)
+        with override_settings(METRICS_ENABLED=False):
+            self.assertEqual(self.get_metrics()[0].status_code, 404)
+
+    def test_archives_dead_workers(self):
+        hostname = socket.gethostname()
+        registry = metrics.Registry()
+        counter = registry.register(metrics.Counter('test_total', 'Тест', ('view',)))
+        histogram = registry.register(metrics.Histogram('test_seconds', 'Тест', ('view',), buckets=(1,)))
+        counter.inc(view='index')
+        histogram.observe(0.5, view='index')
+        snapshot = registry.snapshot()
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = metrics.DirectoryStore(directory, max_age=60)
+            for worker in (f'{hostname}-1000000', 'other-host-1', 'stale-host-1'):
+                store.save(worker, snapshot)
+            stale = os.path.join(directory, 'stale-host-1.json')
+            os.utime(stale, (time.time() - 120, time.time() - 120))
+            registry._store = store
+            registry._store_ready = True
+
+            with mock.patch('catalog.metrics._pid_exists', side_effect=lambda pid: pid == os.getpid()):
+                text = registry.render()
+                self.assertEqual(len(store.load_all()), 3)
+                # Снимки, уже перенесенные в архив, не добавляются в него повторно
+                self.assertEqual(registry.render(), text)
+
+            self.assertEqual(sorted(name for name in os.listdir(directory) if name.endswith('.json')), sorted([
+                'archive.json', f'{hostname}-{os.getpid()}.json', 'other-host-1.json',
+            ]))
+
+        # Итоги включают значения двух завершившихся процессов
+        self.assertIn('test_total{view="index"} 4', text)
+        self.assertIn('test_seconds_bucket{view="index",le="1"} 4', text)
+        self.assertIn('test_seconds_sum{view="index"} 2.0', text)
+
+    async def test_async_flush_runs_outside_event_loop(self):
+        threads = []
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory), \
+                mock.patch.object(metrics.DirectoryStore, 'save', lambda *args: threads.append(threading.get_ident())):
+            metrics.registry._last_flush = 0
+            await self.async_client.get(reverse('catalog:index'))
+
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_aggregates_workers_through_directory(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.client.get(reverse('catalog:api_categories'))
+            metrics.DirectoryStore(directory).save('other-worker', metrics.registry.snapshot())
+
+            response, text = self.get_metrics()
+
+        self.assertIn('http_responses_total{view="catalog:api_categories",method="GET",status="200"} 2', text)
+
+
+class KeysetPaginatorTest(TestCase):
+    """Пагинация по курсору проходит выборку без пропусков и повторов, в том числе при одинаковых датах."""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        # Три публикации с одной датой, две с другой и две с третьей: границы страниц попадают на одинаковые даты
+        for index, minutes in enumerate((0, 0, 0, 1, 1, 2, 2)):
+            blog = Blog.objects.create(title=f'Публикация {index}', email='author@example.com')
+            Blog.objects.filter(pk=blog.pk).update(published=now - datetime.timedelta(minutes=minutes))
+        cls.expected = list(Blog.objects.order_by('-published', '-pk').values_list('pk', flat=True))
+
+    def paginator(self):
+        return KeysetPaginator(Blog.objects.all(), 3)
+
+    def pks(self, page):
+        return [blog.pk for blog in page]
+
+    def test_first_page(self):
+        page = self.paginator().page()
+
+        self.assertEqual(self.pks(page), self.expected[:3])
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+    def test_next_pages_cover_ties_once(self):
+        paginator = self.paginator()
+        page = paginator.page()
+        seen = self.pks(page)
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            self.assertTrue(page.has_previous())
+            seen += self.pks(page)
+
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(self.pks(page), self.expected[6:])
+
+    def test_previous_page(self):
+        paginator = self.paginator()
+        second = paginator.page(paginator.page().next_cursor)
+        first = paginator.page(second.previous_cursor)
+
+        self.assertEqual(self.pks(first), self.expected[:3])
+        self.assertTrue(first.has_next())
+        self.assertFalse(first.has_previous())
+
+        last = paginator.page(second.next_cursor)
+        self.assertEqual(self.pks(paginator.page(last.previous_cursor)), self.expected[3:6])
+
+    def test_previous_page_without_following_rows(self):
+        paginator = self.paginator()
+        last = paginator.page(paginator.page(paginator.page().next_cursor).next_cursor)
+        Blog.objects.filter(pk__in=self.pks(last)).delete()
+
+        page = paginator.page(last.previous_cursor)
+
+        self.assertEqual(self.pks(page), self.expected[3:6])
+        self.assertFalse(page.has_next())
+        self.assertTrue(page.has_previous())
+
+    def test_tampered_cursor(self):
+        valid = encode_cursor(timezone.now(), 1, 'next')
+        self.assertEqual(decode_cursor(valid)[1:], (1, 'next'))
+
+        wrong_direction = base64.urlsafe_b64encode(b'["2024-01-01T00:00:00+00:00",1,"up"]').decode()
+        not_a_date = base64.urlsafe_b64encode(b'["yesterday",1,"next"]').decode()
+        not_a_list = base64.urlsafe_b64encode(b'{"pk":1}').decode()
+        for cursor in ('%%%', valid[:-3], wrong_direction, not_a_date, not_a_list):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+        self.assertEqual(self.client.get(reverse('catalog:blog_list'), {'cursor': 'garbage'}).status_code, 404)
+
+
+class ProductSearchTest(TestCase):
+    """Полнотекстовый поиск с ранжированием, нечеткий поиск по названию и триггер поискового вектора."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category='Техника', description='Описание')
+        cls.phone = Product.objects.create(name='Смартфон Нокиа', description='Кнопочный телефон', price=100,
+                                           category=category, is_published=True)
+        cls.case = Product.objects.create(name='Чехол', description='Чехол для смартфонов', price=10,
+                                          category=category, is_published=True)
+        cls.hidden = Product.objects.create(name='Смартфон Прототип', description='Не опубликован', price=100,
+                                            category=category, is_published=False)
+
+    def search_vector(self, product):
+        return Product.objects.values_list('search_vector', flat=True).get(pk=product.pk)
+
+    def test_full_text_search_ranks_name_above_description(self):
+        # Словоформа «смартфоны» находит «Смартфон» благодаря русскому стеммингу; совпадение в названии (вес A)
+        # выше совпадения в описании (вес B), неопубликованный товар не находится
+        with self.assertNumQueries(1):
+            found = search_products('смартфоны')
+        self.assertEqual(found, [self.phone, self.case])
+
+    def test_trigram_fallback_for_typos(self):
+        with self.assertNumQueries(2):
+            found = search_products('смартфн')
+        self.assertEqual(found, [self.phone])
+
+    def test_empty_keyword(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(search_products('  '), [])
+
+    async def test_async_search(self):
+        self.assertEqual(await asearch_products('кнопочный'), [self.phone])
+
+    def test_search_view_paginates_results(self):
+        response = self.client.get(reverse('catalog:product_search'), {'q': 'смартфон'})
+        self.assertEqual(list(response.context['page_obj']), [self.phone, self.case])
+        self.assertEqual(response.context['paginator'].count, 2)
+
+    def test_trigger_keeps_search_vector_current(self):
+        self.assertIn("'смартфон':1A", self.search_vector(self.phone))
+        self.assertIn("'кнопочн':3B", self.search_vector(self.phone))
+
+        # Триггер срабатывает и при массовом изменении, минуя save()
+        Product.objects.filter(pk=self.phone.pk).update(description='Планшет')
+        self.assertIn("'планшет':3B", self.search_vector(self.phone))
+        self.assertEqual(search_products('кнопочный'), [])
+
+        created, = Product.objects.bulk_create([Product(name='Ноутбук', price=1, category=self.phone.category)])
+        self.assertIn("'ноутбук':1A", self.search_vector(created))
+
+
+class TwoTierCacheTest(TestCase):
+    """Локальный LRU-кэш с временем жизни записей и двухуровневый кэш с версионированием ключей общего кэша."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_local_cache_evicts_least_recently_used(self):
+        local = LocalCache(max_size=2)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+
+        self.assertEqual((local.get('a'), local.get('b'), local.get('c')), (1, None, 3))
+
+    def test_local_cache_expires_entries(self):
+        local = LocalCache(timeout=5)
+        with mock.patch('catalog.services.time.monotonic', return_value=100):
+            local.set('a', 1)
+        with mock.patch('catalog.services.time.monotonic', return_value=104):
+            self.assertEqual(local.get('a'), 1)
+        with mock.patch('catalog.services.time.monotonic', return_value=106):
+            self.assertIsNone(local.get('a'))
+
+    def test_reads_local_then_shared_tier(self):
+        two_tier = TwoTierCache()
+        loader = mock.Mock(return_value=[{'pk': 1}])
+
+        self.assertEqual(two_tier.get_or_set('key', loader), [{'pk': 1}])
+        self.assertEqual(two_tier.get_or_set('key', loader), [{'pk': 1}])
+        # Другой процесс с пустым локальным кэшем читает данные из общего кэша
+        other = TwoTierCache()
+        self.assertEqual(other.get_or_set('key', loader), [{'pk': 1}])
+
+        loader.assert_called_once()
+        self.assertEqual(two_tier.stats(), {'local_hits': 1, 'local_misses': 1, 'shared_hits': 0, 'shared_misses': 1})
+        self.assertEqual(other.stats(), {'local_hits': 0, 'local_misses': 1, 'shared_hits': 1, 'shared_misses': 0})
+
+    def test_version_bump_ignores_old_entries(self):
+        TwoTierCache(version=1).get_or_set('key', lambda: 'old')
+
+        self.assertEqual(TwoTierCache(version=2).get_or_set('key', lambda: 'new'), 'new')
+        self.assertEqual(TwoTierCache(version=1).get_or_set('key', lambda: 'unused'), 'old')
+
+    def test_delete_many_clears_both_tiers(self):
+        two_tier = TwoTierCache()
+        two_tier.set('key', 'old')
+        two_tier.delete_many(['key'])
+
+        self.assertEqual(two_tier.get_or_set('key', lambda: 'new'), 'new')
+
+    @override_settings(CACHE_ENABLED=True)
+    def test_categories_are_invalidated_on_change(self):
+        shared = TwoTierCache()
+        with mock.patch('catalog.services.catalog_cache', shared):
+            category = Category.objects.create(category='Техника', description='Описание')
+            self.assertEqual([row['category'] for row in get_cached_categories()], ['Техника'])
+            with self.assertNumQueries(0):
+                get_cached_categories()
+
+            category.category = 'Книги'
+            with self.captureOnCommitCallbacks() as callbacks:
+                category.save()
+            # До фиксации транзакции кэш не сбрасывается: параллельный запрос не запишет в него старые данные
+            self.assertEqual([row['category'] for row in get_cached_categories()], ['Техника'])
+            for callback in callbacks:
+                callback()
+            self.assertEqual([row['category'] for row in get_cached_categories()], ['Книги'])
+
+
+@override_settings(CACHE_ENABLED=False)
+class HomepageSnapshotTest(TestCase):
+    """Снимок главной страницы хранится в кэше и без Redis и обновляется при сохранении и удалении товаров."""
+
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local.clear()
+        self.category = Category.objects.create(category='Техника', description='Описание')
+
+    def create_product(self, name):
+        return Product.objects.create(
+            name=name, description='Описание', category=self.category, price=Decimal('10'), is_published=True,
+        )
+
+    def names(self):
+        return [product['name'] for product in get_homepage_snapshot()['products']]
+
+    def test_snapshot_is_cached_without_shared_cache(self):
+        get_homepage_snapshot()
+        with self.assertNumQueries(0):
+            get_homepage_snapshot()
+
+    def test_save_refreshes_snapshot(self):
+        self.assertEqual(self.names(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product('Телевизор')
+        self.assertEqual(self.names(), ['Телевизор'])
+
+        product.name = 'Монитор'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.names(), ['Монитор'])
+
+    def test_delete_refreshes_snapshot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product('Телевизор')
+        self.assertEqual(self.names(), ['Телевизор'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(self.names(), [])
+
+
+class TaggedPageCacheTest(TestCase):
+    """Страница товара кэшируется с тегами товара, категории и каталога и сбрасывается при их изменении."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(category='Техника', description='Описание')
+        cls.product = Product.objects.create(name='Телефон', description='Описание', price=100,
+                                             category=cls.category, is_published=True)
+        cls.other = Product.objects.create(name='Планшет', description='Описание', price=100,
+                                           category=cls.category, is_published=True)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('catalog:product_detail', args=[self.product.pk])
+        self.client.get(self.url)
+
+    def rename(self, name):
+        # Изменение в обход сигналов: закэшированная страница не сбрасывается
+        Product.objects.filter(pk=self.product.pk).update(name=name)
+
+    def test_serves_cached_page(self):
+        self.rename('Смартфон')
+        self.assertContains(self.client.get(self.url), 'Телефон')
+
+    def test_product_save_invalidates_page(self):
+        self.rename('Смартфон')
+        self.product.refresh_from_db()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.save()
+        # До фиксации транзакции теги не сбрасываются: страница со старыми данными не попадет в кэш с новыми тегами
+        self.assertContains(self.client.get(self.url), 'Телефон')
+        for callback in callbacks:
+            callback()
+        self.assertContains(self.client.get(self.url), 'Смартфон')
+
+    def test_short_timeout_without_shared_cache(self):
+        with override_settings(CACHE_ENABLED=False):
+            self.assertEqual(ProductDetailView().get_cache_timeout(), LOCAL_CACHE_TIMEOUT)
+        with override_settings(CACHE_ENABLED=True):
+            self.assertEqual(ProductDetailView().get_cache_timeout(), ProductDetailView.cache_timeout)
+
+    def test_other_product_save_keeps_page(self):
+        self.rename('Смартфон')
+        self.other.save()
+        self.assertContains(self.client.get(self.url), 'Телефон')
+
+    def test_category_and_version_changes_invalidate_page(self):
+        self.rename('Смартфон')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.assertContains(self.client.get(self.url), 'Смартфон')
+
+        self.rename('Коммуникатор')
+        with self.captureOnCommitCallbacks(execute=True):
+            Version.objects.create(product=self.product, number=Decimal('1.00'))
+        self.assertContains(self.client.get(self.url), 'Коммуникатор')
+
+
+class JournalTest(TestCase):
+    """Журнал JSON Lines: ротация по размеру файла, ограничение числа старых файлов и чтение с пропуском
+    недописанной строки."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/journal.jsonl'
+
+    def test_appends_and_reads_records(self):
+        journal = Journal(self.path)
+        journal.append({'name': 'Иван', 'time': datetime.datetime(2024, 1, 1, 12, 0)})
+        journal.append({'name': 'Мария'})
+
+        self.assertEqual(list(journal.read()), [{'name': 'Иван', 'time': '2024-01-01T12:00:00'}, {'name': 'Мария'}])
+
+    def test_rotates_and_keeps_backup_count_files(self):
+        journal = Journal(self.path, max_bytes=1, backup_count=2)
+        for number in range(4):
+            journal.append({'number': number})
+
+        # Каждая запись, кроме первой, ротирует файл; самая старая запись вытеснена
+        self.assertEqual(journal.paths(), [f'{self.path}.2', f'{self.path}.1', self.path])
+        self.assertEqual([record['number'] for record in journal.read()], [1, 2, 3])
+
+    def test_skips_partial_line(self):
+        journal = Journal(self.path)
+        journal.append({'number': 1})
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write('{"number": ')
+
+        self.assertEqual(list(journal.read()), [{'number': 1}])
+
+    def test_feedback_is_appended_to_journal(self):
+        journal = Journal(self.path)
+        data = {'csrfmiddlewaretoken': 'token', 'first_name': 'Иван', 'last_name': 'Иванов',
+                'email': 'ivan@example.com', 'phone': '123', 'country': 'Россия', 'message': 'Спасибо'}
+        with mock.patch('catalog.views.feedback_journal', journal):
+            self.client.post(reverse('catalog:feedback'), data)
+
+        record, = journal.read()
+        self.assertEqual((record['first_name'], record['message']), ('Иван', 'Спасибо'))
+
+
+class FeedbackExportTest(TestCase):
+    """Потоковая выгрузка отзывов в CSV и JSON Lines с фильтрами по датам и стране."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(email='staff@example.com', is_staff=True, is_superuser=True)
+        for number, (country, day) in enumerate([('Россия', 1), ('Армения', 2), ('Россия', 3)]):
+            feedback = Feedback.objects.create(first_name=f'Имя {number}', last_name='Фамилия',
+                                               email='user@example.com', country=country, message='Текст, "цитата"')
+            Feedback.objects.filter(pk=feedback.pk).update(
+                publish=timezone.make_aware(datetime.datetime(2024, 1, day, 12, 0)))
+
+    def export(self, **params):
+        self.client.force_login(self.staff)
+        return self.client.get(reverse('catalog:feedback_export'), params)
+
+    def test_csv_is_streamed(self):
+        response = self.export()
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="feedback.csv"')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], list(FeedbackExportView.fields))
+        self.assertEqual([row[1] for row in rows[1:]], ['Имя 0', 'Имя 1', 'Имя 2'])
+        self.assertEqual(rows[1][6], 'Текст, "цитата"')
+
+    def test_jsonl_with_filters(self):
+        response = self.export(format='jsonl', date_from='2024-01-02', country='Россия')
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([record['first_name'] for record in records], ['Имя 2'])
+
+    def test_invalid_range(self):
+        self.assertEqual(self.export(date_from='2024-01-03', date_to='2024-01-01').status_code, 400)
+
+    def test_requires_permission(self):
+        self.client.force_login(User.objects.create(email='user@example.com'))
+        self.assertEqual(self.client.get(reverse('catalog:feedback_export')).status_code, 403)
+
+
+class VersionNumberingTest(TransactionTestCase):
+    """Номера версий выдаются под блокировкой строки товара, у товара может быть только одна активная версия."""
+
+    def setUp(self):
+        category = Category.objects.create(category='Техника', description='Описание')
+        self.product = Product.objects.create(name='Телефон', description='Описание', price=100, category=category)
+
+    def test_concurrent_versions_get_distinct_numbers(self):
+        locked = threading.Event()
+        errors = []
+
+        def first():
+            try:
+                with transaction.atomic():
+                    version = Version(product=self.product)
+                    version.allocate_number()
+                    locked.set()
+                    # Пока транзакция открыта, второй поток ждет блокировку строки товара
+                    time.sleep(0.2)
+                    version.save()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                locked.set()
+                connection.close()
+
+        def second():
+            locked.wait()
+            try:
+                Version.objects.create(product=self.product)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(self.product.versions.values_list('number', flat=True)),
+                         [Decimal('1.00'), Decimal('1.10')])
+
+    def test_numbers_are_per_product(self):
+        other = Product.objects.create(name='Планшет', description='Описание', price=100,
+                                       category=self.product.category)
+        Version.objects.create(product=self.product)
+        Version.objects.create(product=self.product)
+
+        self.assertEqual(Version.objects.create(product=other).number, Decimal('1.00'))
+
+    def test_one_active_version_per_product(self):
+        Version.objects.create(product=self.product, is_active=True)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Version.objects.create(product=self.product, is_active=True)
+
+        # Неактивных версий может быть сколько угодно
+        Version.objects.create(product=self.product)
+        Version.objects.create(product=self.product)
+        self.assertEqual(self.product.versions.filter(is_active=True).count(), 1)
+
+
+class AsyncViewsTest(TestCase):
+    """Асинхронные контроллеры списков и страниц товаров и публикаций работают через AsyncClient без синхронных
+    запросов к базе данных из асинхронного кода."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='owner@example.com')
+        cls.category = Category.objects.create(category='Техника', description='Описание')
+        cls.product = Product.objects.create(name='Телефон', description='Описание', price=100,
+                                             category=cls.category, is_published=True, user_product=cls.user)
+        cls.draft = Product.objects.create(name='Черновик', description='Описание', price=100,
+                                           category=cls.category, user_product=cls.user)
+        cls.blog = Blog.objects.create(title='Публикация', content='Текст', email='owner@example.com',
+                                       user_blog=cls.user)
+        cls.hidden_blog = Blog.objects.create(title='Скрытая', content='Текст', email='owner@example.com',
+                                              is_active=False)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_views_are_async(self):
+        for view in (ProductListView, ProductDetailView, ProductSearchView, BlogListView, BlogDetailView):
+            self.assertTrue(view.view_is_async, view.__name__)
+
+    async def test_product_list(self):
+        response = await self.async_client.get(reverse('catalog:product_list'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['object_list']), [self.product])
+        summary, = response.context['categories']
+        self.assertEqual((summary['published_count'], summary['products']),
+                         (1, [{'pk': self.product.pk, 'name': 'Телефон'}]))
+
+    async def test_product_list_for_authenticated_user(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(reverse('catalog:product_list'))
+
+        self.assertContains(response, 'Телефон')
+        self.assertEqual(response.context['user'], self.user)
+
+    async def test_product_detail(self):
+        response = await self.async_client.get(reverse('catalog:product_detail', args=[self.product.pk]))
+        self.assertContains(response, 'Телефон')
+
+        response = await self.async_client.get(reverse('catalog:product_detail', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_blog_list_shows_active(self):
+        response = await self.async_client.get(reverse('catalog:blog_list'))
+        self.assertEqual(list(response.context['object_list']), [self.blog])
+
+    async def test_blog_detail_counts_view(self):
+        url = reverse('catalog:blog_detail', args=[self.blog.pk])
+        await self.async_client.get(url)
+        response = await self.async_client.get(url)
+
+        self.assertEqual(response.context['object'].view_count, 2)
+
+
+class ViewCountersTest(TestCase):
+    """Просмотры публикаций копятся вне базы данных и переносятся в нее одним UPDATE под блокировкой счетчика."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.blog = Blog.objects.create(title='Публикация', content='Текст', email='owner@example.com')
+        cls.other = Blog.objects.create(title='Другая', content='Текст', email='owner@example.com')
+
+    def setUp(self):
+        local_view_counter.clear()
+        self.addCleanup(local_view_counter.clear)
+
+    def view_counts(self):
+        return dict(Blog.objects.values_list('pk', 'view_count'))
+
+    def on_update(self, action):
+        """Метод выполняет action перед запросом UPDATE переноса счетчиков."""
+
+        def wrapper(execute, sql, params, many, context):
+            if sql.startswith('UPDATE'):
+                action()
+            return execute(sql, params, many, context)
+
+        return connection.execute_wrapper(wrapper)
+
+    def test_view_does_not_write(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(record_view(self.blog.pk), 1)
+            self.assertEqual(record_view(self.blog.pk), 2)
+
+    def test_flush_updates_only_viewed_blogs(self):
+        record_view(self.blog.pk)
+        record_view(self.blog.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(flush_view_counts(), 1)
+
+        self.assertEqual(writes(queries), ['UPDATE catalog_blog'])
+
+        self.assertEqual(self.view_counts(), {self.blog.pk: 2, self.other.pk: 0})
+        self.assertEqual(local_view_counter.pending(), {})
+
+    def test_views_during_flush_are_kept(self):
+        record_view(self.blog.pk)
+        with self.on_update(lambda: record_view(self.blog.pk)):
+            flush_view_counts()
+
+        self.assertEqual(self.view_counts()[self.blog.pk], 1)
+        self.assertEqual(local_view_counter.pending(), {self.blog.pk: 1})
+
+    def test_failed_flush_keeps_counts(self):
+        def fail():
+            raise DatabaseError
+
+        record_view(self.blog.pk)
+        with self.assertRaises(DatabaseError), self.on_update(fail):
+            flush_view_counts()
+
+        self.assertEqual(local_view_counter.pending(), {self.blog.pk: 1})
+        # Блокировка снята: следующий перенос записывает просмотры
+        self.assertEqual(flush_view_counts(), 1)
+        self.assertEqual(self.view_counts()[self.blog.pk], 1)
+
+    def test_concurrent_flush_is_skipped(self):
+        record_view(self.blog.pk)
+        with local_view_counter.lock(), self.assertNumQueries(0):
+            self.assertEqual(flush_view_counts(), 0)
+
+        self.assertEqual(local_view_counter.pending(), {self.blog.pk: 1})
+
+    @override_settings(BLOG_VIEWS_FLUSH_INTERVAL=0)
+    def test_process_flushes_after_interval(self):
+        record_view(self.blog.pk)
+
+        self.assertEqual(self.view_counts()[self.blog.pk], 1)
+        self.assertEqual(local_view_counter.pending(), {})
+
+
+class OutboxTest(TransactionTestCase):
+    """Письма забираются из очереди в короткой транзакции и отправляются вне ее; текст отправленного письма
+    удаляется из очереди."""
+
+    def setUp(self):
+        self.email = enqueue_mail('Тема', 'Текст письма', 'site@example.com', ['user@example.com'])
+
+    def test_sends_outside_transaction_and_clears_message(self):
+        in_transaction = []
+        send = mail.EmailMessage.send
+
+        def check_send(message, *args, **kwargs):
+            in_transaction.append(connection.in_atomic_block)
+            return send(message, *args, **kwargs)
+
+        with mock.patch('catalog.outbox.EmailMessage.send', check_send):
+            self.assertEqual(send_pending_mail(), (1, 0))
+
+        self.assertEqual(in_transaction, [False])
+        self.assertEqual(mail.outbox[0].body, 'Текст письма')
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.message, self.email.attempts),
+                         (OutgoingEmail.Status.SENT, '', 1))
+
+    def test_failed_send_is_retried_later(self):
+        with mock.patch('catalog.outbox.EmailMessage.send', side_effect=OSError('Сервер недоступен')):
+            self.assertEqual(send_pending_mail(max_attempts=2), (0, 1))
+            self.email.refresh_from_db()
+            self.assertEqual(self.email.status, OutgoingEmail.Status.PENDING)
+            self.assertGreater(self.email.next_attempt, timezone.now())
+            # До истечения задержки письмо не отправляется повторно
+            self.assertEqual(send_pending_mail(), (0, 0))
+
+            OutgoingEmail.objects.update(next_attempt=timezone.now())
+            self.assertEqual(send_pending_mail(max_attempts=2), (0, 1))
+
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), (OutgoingEmail.Status.FAILED, 2))
+        self.assertEqual(self.email.message, 'Текст письма')
+
+    def test_abandoned_claim_is_taken_after_timeout(self):
+        claimed_until = timezone.now() + datetime.timedelta(seconds=SEND_TIMEOUT)
+        OutgoingEmail.objects.update(status=OutgoingEmail.Status.SENDING, next_attempt=claimed_until)
+        self.assertEqual(send_pending_mail(), (0, 0))
+
+        OutgoingEmail.objects.update(next_attempt=timezone.now())
+        self.assertEqual(send_pending_mail(), (1, 0))
+
+
+class ImportProductsTest(TransactionTestCase):
+    """Потоковая загрузка товаров: товары без external_id получают ключ по категории и названию, а повторяющиеся
+    ключи отклоняются. TRUNCATE нельзя выполнить в транзакции теста, в которой есть отложенные проверки внешних
+    ключей, поэтому тест выполняется без общей транзакции."""
+
+    def setUp(self):
+        self.category = Category.objects.create(category='Техника', description='Описание')
+
+    def load(self, records, **kwargs):
+        return import_products(io.StringIO(json.dumps(records)), 'json', **kwargs)
+
+    def test_same_name_in_different_categories(self):
+        other = Category.objects.create(category='Книги', description='Описание')
+        records = [
+            {'name': 'Телефон', 'price': 100, 'category_id': self.category.pk},
+            {'name': 'Телефон', 'price': 200, 'category_id': other.pk},
+        ]
+        for use_copy in (True, False):
+            with self.subTest(use_copy=use_copy):
+                self.assertEqual(self.load(records, use_copy=use_copy), 2)
+                self.assertEqual(sorted(Product.objects.values_list('name', 'price')),
+                                 [('Телефон', 100), ('Телефон', 200)])
+
+    def test_key_depends_only_on_category_and_name(self):
+        self.load([{'name': 'Телефон', 'price': 100, 'category_id': self.category.pk}])
+        first = Product.objects.get().external_id
+        self.load([{'category_id': self.category.pk, 'price': 150, 'description': 'Новое', 'name': 'Телефон'}])
+
+        self.assertEqual(Product.objects.get().external_id, first)
+
+    def test_duplicate_keys_are_rejected(self):
+        Product.objects.create(name='Старый', price=1, category=self.category)
+        duplicates = [
+            [{'name': 'Телефон', 'price': 100, 'category_id': self.category.pk}] * 2,
+            [{'external_id': 'A-1', 'name': 'Телефон', 'price': 100, 'category_id': self.category.pk},
+             {'external_id': 'A-1', 'name': 'Планшет', 'price': 200, 'category_id': self.category.pk}],
+        ]
+        for records in duplicates:
+            with self.subTest(records=records), self.assertRaisesMessage(ImportFormatError, 'Повторяющийся'):
+                self.load(records, batch_size=1)
+            # Загрузка выполняется в одной транзакции и отменяется целиком
+            self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Старый'])
+
+
+class SyncProductsTest(TestCase):
+    """Синхронизация товаров с файлом: изменяются только затронутые товары, удаление не отправляет сигналы для каждой
+    строки, повторяющиеся ключи отклоняются."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(category='Техника', description='Описание')
+
+    def record(self, external_id, name, price=100):
+        return {'external_id': external_id, 'name': name, 'price': price, 'category_id': self.category.pk,
+                'is_published': True}
+
+    def sync(self, records, **kwargs):
+        return sync_products(io.StringIO('\n'.join(map(json.dumps, records))), 'jsonl', **kwargs)
+
+    def test_creates_updates_and_deletes(self):
+        self.sync([self.record('A', 'Телефон'), self.record('B', 'Планшет'), self.record('C', 'Ноутбук')])
+        removed = Product.objects.get(external_id='C')
+        Version.objects.create(product=removed)
+        manual = Product.objects.create(name='Добавлен на сайте', price=1, category=self.category)
+
+        stats = self.sync([self.record('A', 'Телефон'), self.record('B', 'Планшет', 150)], batch_size=1)
+
+        self.assertEqual(stats, {'created': 0, 'updated': 1, 'unchanged': 1, 'deleted': 1})
+        self.assertEqual(sorted(Product.objects.values_list('name', 'price')),
+                         [('Добавлен на сайте', 1), ('Планшет', 150), ('Телефон', 100)])
+        self.assertFalse(Version.objects.filter(product_id=removed.pk).exists())
+        self.assertTrue(Product.objects.filter(pk=manual.pk).exists())
+
+    def test_changed_record_without_external_id_keeps_product(self):
+        record = {'name': 'Телефон', 'price': 100, 'category_id': self.category.pk}
+        self.sync([record])
+        product = Product.objects.get()
+        version = Version.objects.create(product=product)
+
+        stats = self.sync([{**record, 'price': 150, 'description': 'Новое описание'}])
+
+        self.assertEqual(stats, {'created': 0, 'updated': 1, 'unchanged': 0, 'deleted': 0})
+        self.assertEqual(Product.objects.get().pk, product.pk)
+        self.assertEqual(Product.objects.get().price, 150)
+        self.assertTrue(Version.objects.filter(pk=version.pk).exists())
+
+    def test_cache_is_invalidated_once(self):
+        self.sync([self.record(str(number), f'Товар {number}') for number in range(5)])
+
+        with mock.patch('catalog.signals.invalidate_category_cache') as per_row, \
+                mock.patch('catalog.importers.invalidate_category_cache') as once, \
+                CaptureQueriesContext(connection) as queries:
+            stats = self.sync([], batch_size=2)
+
+        self.assertEqual(stats['deleted'], 5)
+        self.assertEqual(per_row.call_count, 0)
+        self.assertEqual(once.call_count, 1)
+        # Один запрос DELETE на пачку из двух товаров (версий у товаров нет)
+        self.assertEqual(writes(queries), ['DELETE catalog_product'] * 3)
+
+    def test_duplicate_keys_are_rejected(self):
+        records = [self.record('A', 'Телефон'), self.record('B', 'Планшет'), self.record('A', 'Ноутбук')]
+        with self.assertRaisesMessage(ImportFormatError, 'Повторяющийся external_id в файле: A'):
+            self.sync(records)
+        # Повтор в другой пачке находит первичный ключ временной таблицы
+        with self.assertRaisesMessage(ImportFormatError, 'Повторяющийся external_id в файле'):
+            self.sync(records, batch_size=1)
+        self.assertFalse(Product.objects.exists())
+
+    def test_missing_products_are_found_by_database(self):
+        self.sync([self.record(str(number), f'Товар {number}') for number in range(3)])
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.sync([self.record('1', 'Товар 1')])
+
+        self.assertEqual(stats['deleted'], 2)
+        self.assertEqual(list(Product.objects.values_list('external_id', flat=True)), ['1'])
+        self.assertTrue(any('catalog_sync_keys' in query['sql'] and 'NOT' in query['sql'] for query in queries))
+
+
+class RenditionsTest(TransactionTestCase):
+    """Уменьшенные копии изображений: имена копий, очередь обработки с повторными попытками и шаблонный тег."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        for local in (renditions._ready_cache, renditions._missing_cache):
+            local.clear()
+
+        self.category = Category.objects.create(category='Техника', description='Описание')
+
+    def upload(self, name, width=800, height=600):
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height), 'red').save(buffer, 'JPEG')
+        default_storage.save(name, ContentFile(buffer.getvalue()))
+        return Product.objects.create(name='Телефон', price=100, category=self.category, image=name)
+
+    def test_rendition_name(self):
+        self.assertEqual(rendition_name('products/photo.jpg', 320), 'products/photo_320w.jpg')
+        self.assertEqual(rendition_name('products/photo.jpg', 320, '.webp'), 'products/photo_320w.webp')
+        self.assertEqual(rendition_name('avatars/photo.v2.png', 1280), 'avatars/photo.v2_1280w.png')
+
+    def test_processes_queue_outside_transaction(self):
+        self.upload('products/photo.jpg')
+        in_transaction = []
+        make = renditions.make_renditions
+
+        def check_make(name):
+            in_transaction.append(connection.in_atomic_block)
+            return make(name)
+
+        with mock.patch('catalog.renditions.make_renditions', check_make):
+            self.assertEqual(process_pending_renditions(), (1, 0))
+
+        self.assertEqual(in_transaction, [False])
+        self.assertEqual(RenditionJob.objects.get().status, RenditionJob.Status.DONE)
+        # Копии не бывают больше оригинала
+        widths = {width: Image.open(default_storage.open(rendition_name('products/photo.jpg', width, '.webp'))).width
+                  for width in renditions.RENDITION_WIDTHS}
+        self.assertEqual(widths, {320: 320, 640: 640, 1280: 800})
+
+    def test_failed_job_is_retried_with_backoff(self):
+        Product.objects.create(name='Телефон', price=100, category=self.category, image='products/missing.jpg')
+
+        self.assertEqual(process_pending_renditions(max_attempts=2), (0, 1))
+        job = RenditionJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (RenditionJob.Status.PENDING, 1))
+        self.assertGreater(job.next_attempt, timezone.now())
+        # До истечения задержки задача не обрабатывается повторно
+        self.assertEqual(process_pending_renditions(max_attempts=2), (0, 0))
+
+        RenditionJob.objects.update(next_attempt=timezone.now())
+        self.assertEqual(process_pending_renditions(max_attempts=2), (0, 1))
+        self.assertEqual(RenditionJob.objects.get().status, RenditionJob.Status.FAILED)
+
+    def test_saves_without_new_file_are_not_queued(self):
+        product = self.upload('products/photo.jpg')
+        user = User.objects.create(email='user@example.com', avatar='avatars/photo.jpg')
+        self.assertEqual(RenditionJob.objects.count(), 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+            Product.objects.get(pk=product.pk).save()
+            update_last_login(None, user)
+
+        self.assertEqual(writes(queries), ['UPDATE catalog_product', 'UPDATE catalog_product', 'UPDATE users_user'])
+
+        product.image = 'products/other.jpg'
+        product.save()
+        self.assertEqual(set(RenditionJob.objects.values_list('source', flat=True)),
+                         {'products/photo.jpg', 'avatars/photo.jpg', 'products/other.jpg'})
+
+    def test_abandoned_job_is_taken_after_timeout(self):
+        self.upload('products/photo.jpg')
+        claimed_until = timezone.now() + datetime.timedelta(seconds=PROCESS_TIMEOUT)
+        RenditionJob.objects.update(status=RenditionJob.Status.PROCESSING, next_attempt=claimed_until)
+        self.assertEqual(process_pending_renditions(), (0, 0))
+
+        RenditionJob.objects.update(next_attempt=timezone.now())
+        self.assertEqual(process_pending_renditions(), (1, 0))
+
+    def test_responsive_image(self):
+        product = self.upload('products/photo.jpg')
+        self.assertEqual(responsive_image(product.image), '<img src="/media/products/photo.jpg" class="card-img">')
+
+        process_pending_renditions()
+        renditions._missing_cache.clear()
+        html = responsive_image(product.image, sizes='50vw')
+        self.assertIn('<source type="image/webp" srcset="/media/products/photo_320w.webp 320w, '
+                      '/media/products/photo_640w.webp 640w, /media/products/photo_1280w.webp 1280w" sizes="50vw">',
+                      html)
+        self.assertIn('srcset="/media/products/photo_320w.jpg 320w', html)
+
+
+class BlogConditionalGetTest(TestCase):
+    """ETag страницы публикации учитывает количество просмотров, а ответ 304 не считается просмотром."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.blog = Blog.objects.create(title='Публикация', content='Текст', email='owner@example.com')
+
+    def setUp(self):
+        local_view_counter.clear()
+        self.addCleanup(local_view_counter.clear)
+        self.url = reverse('catalog:blog_detail', args=[self.blog.pk])
+
+    def test_not_modified_until_viewed_by_others(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(response.context['object'].view_count, 1)
+        self.assertNotIn('Last-Modified', response)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(local_view_counter.get(self.blog.pk), 1)
+
+        # Просмотр другого пользователя меняет содержимое страницы
+        self.client_class().get(self.url)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['object'].view_count, 3)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_matches_flushed_counts(self):
+        etag = self.client.get(self.url)['ETag']
+        flush_view_counts()
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
@@ -1,10 +1,13 @@
 from django.urls import path
-from django.views.decorators.cache import cache_page
 
+from .api import ProductApiListView, ProductApiDetailView, CategoryApiListView, VersionApiListView, BlogApiListView, \
+    BlogApiDetailView
 from .apps import CatalogConfig
 from .views import IndexTemplateView, feedback, ProductListView, FeedBackListView, ProductDetailView, ProductCreateView, \
     ProductUpdateView, ProductDeleteView, CategoryCreateView, CategoryUpdateView, CategoryDeleteView, BlogCreateView, \
-    BlogListView, BlogDetailView, BlogUpdateView, BlogDeleteView, PublishProductView, ModerateProductList
+    BlogListView, BlogDetailView, BlogUpdateView, BlogDeleteView, PublishProductView, ModerateProductList, \
+    ProductSearchView, FeedbackExportView, BulkModerateProductsView, ClaimProductsView, ReleaseProductsView, \
+    MetricsView
 
 app_name = CatalogConfig.name
 
@@ -12,8 +15,10 @@ urlpatterns = [
     path('', IndexTemplateView.as_view(), name='index'),
     path('feedback/', feedback, name='feedback'),
     path('products/', ProductListView.as_view(), name='product_list'),
+    path('search/', ProductSearchView.as_view(), name='product_search'),
     path('about/', FeedBackListView.as_view(), name='about_list'),
-    path('products/<int:pk>/', cache_page(60)(ProductDetailView.as_view()), name='product_detail'),
+    path('about/export/', FeedbackExportView.as_view(), name='feedback_export'),
+    path('products/<int:pk>/', ProductDetailView.as_view(), name='product_detail'),
     path('add_product/', ProductCreateView.as_view(), name='add_product'),
     path('update_product/<int:pk>/', ProductUpdateView.as_view(), name='update_product'),
     path('delete_product/<int:pk>/', ProductDeleteView.as_view(), name='delete_product'),
@@ -26,5 +31,15 @@ urlpatterns = [
     path('update_blog/<int:pk>/', BlogUpdateView.as_view(), name='update_blog'),
     path('delete_blog/<int:pk>/', BlogDeleteView.as_view(), name='delete_blog'),
     path('publish_product/<int:pk>/', PublishProductView.as_view(), name='publish_product'),
-    path('moderate_products/', ModerateProductList.as_view(), name='moderate_products')
+    path('moderate_products/', ModerateProductList.as_view(), name='moderate_products'),
+    path('moderate_products/bulk/', BulkModerateProductsView.as_view(), name='bulk_moderate_products'),
+    path('moderate_products/claim/', ClaimProductsView.as_view(), name='claim_products'),
+    path('moderate_products/release/', ReleaseProductsView.as_view(), name='release_products'),
+    path('api/products/', ProductApiListView.as_view(), name='api_products'),
+    path('api/products/<int:pk>/', ProductApiDetailView.as_view(), name='api_product'),
+    path('api/products/<int:pk>/versions/', VersionApiListView.as_view(), name='api_product_versions'),
+    path('api/categories/', CategoryApiListView.as_view(), name='api_categories'),
+    path('api/blogs/', BlogApiListView.as_view(), name='api_blogs'),
+    path('api/blogs/<int:pk>/', BlogApiDetailView.as_view(), name='api_blog'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,28 +1,78 @@
+import csv
 import datetime
+import itertools
 import json
-import os
 
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
-from django.core.mail import send_mail
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction
+from django.db.models import Max
 from django.forms import inlineformset_factory
-from django.http import HttpResponseRedirect, Http404
+from django.http import HttpResponseRedirect, Http404, HttpResponseBadRequest, StreamingHttpResponse, HttpResponse, \
+    HttpResponseForbidden
 from django.shortcuts import render
 from django.urls import reverse_lazy, reverse
-from django.views.generic import TemplateView, ListView, DetailView, UpdateView, DeleteView
+from django.utils.crypto import constant_time_compare
+from django.utils.http import urlencode
+from django.views.generic import TemplateView, ListView, UpdateView, DeleteView, View
 from django.views.generic.edit import CreateView
 from pytils.translit import slugify
 
-from catalog.forms import ProductForm, CategoryForm, BlogForm, VersionForm, VersionBaseInlineFormSet, PublishProductForm
+from catalog import metrics
+from catalog.cache_tags import TaggedCachePageMixin, product_tag, category_tag, aget_tag_versions, PRODUCTS_TAG, \
+    CATALOG_TAG
+from catalog.asyncviews import AsyncListView, AsyncDetailView
+from catalog.conditional import ConditionalGetMixin
+from catalog.counters import apending_views, arecord_view
+from catalog.forms import ProductForm, CategoryForm, BlogForm, VersionForm, VersionBaseInlineFormSet, PublishProductForm, \
+    FeedbackExportForm, BulkModerationForm
+from catalog.journal import feedback_journal
 from catalog.models import Category, Product, Feedback, Blog, Version
-from catalog.services import get_cached_categories
+from catalog.moderation import set_published, claim_products, claimed_products, release_products
+from catalog.paginators import KeysetPaginationMixin
+from catalog.search import asearch_products
+from catalog.services import get_cached_categories, aget_cached_category_summaries, with_active_versions, \
+    aget_homepage_snapshot
 
 
-class IndexTemplateView(TemplateView):
+class ProductsConditionalMixin(ConditionalGetMixin):
+    """Условные GET-запросы для страниц со списками товаров. Last-Modified — дата последнего изменения товара
+    (берется по индексу поля changed), ETag дополнительно учитывает версии тегов кэша, которые сбрасываются при
+    удалении товаров, изменении версий и категорий."""
+
+    async def aget_last_modified(self):
+        if not hasattr(self, '_last_modified'):
+            self._last_modified = (await Product.objects.aaggregate(changed=Max('changed')))['changed']
+        return self._last_modified
+
+    async def aget_etag_parts(self):
+        versions = await aget_tag_versions([PRODUCTS_TAG, CATALOG_TAG])
+        return [await self.aget_last_modified(), versions[PRODUCTS_TAG], versions[CATALOG_TAG]]
+
+
+class IndexTemplateView(ConditionalGetMixin, TemplateView):
     """Контроллер генерирует страницу index.html, на которой представлены 5 последних публикаций, остортированных по
-    дате."""
+    дате. Публикации берутся из снимка главной страницы, который обновляется при изменении товаров, поэтому
+    страница не выполняет запросов к базе данных. ETag страницы — хэш содержимого снимка. Контроллер асинхронный:
+    снимок читается через асинхронный API кэша."""
     template_name = 'catalog/index.html'
 
+    async def aget_snapshot(self):
+        if not hasattr(self, '_snapshot'):
+            self._snapshot = await aget_homepage_snapshot()
+        return self._snapshot
+
+    async def aget_last_modified(self):
+        return (await self.aget_snapshot())['generated']
+
+    async def aget_etag_parts(self):
+        return [(await self.aget_snapshot())['etag']]
+
+    async def get(self, request, *args, **kwargs):
+        await self.aget_snapshot()
+        return super().get(request, *args, **kwargs)
+
     def get_context_data(self, **kwargs):
         """Метод добавляет в context ключ object_list, значение которого — это 5 последних публикаций, остортированных
         по дате, и ключ title со значением названия текущей вкладки."""
@@ -31,7 +81,7 @@ class IndexTemplateView(TemplateView):
         context = super().get_context_data(**kwargs)
 
         # Обновление контекста
-        context['object_list'] = Product.objects.filter(is_published=True).order_by('-published')[0:5]
+        context['object_list'] = self._snapshot['products']
         context['title'] = 'Catalogue'
 
         return context
@@ -40,7 +90,8 @@ class IndexTemplateView(TemplateView):
 def feedback(request):
     """Контроллер обрабатывает запрос от пользователя по префиксу 'feedback/' и возвращает веб-страницу
     'feedback.html'. Эта страница является формой обратной связи, если пользователь даст обратную связь, то
-    информация будет выведена в консоль, записана в файл 'data_from_users.json' и добавлена на страницу about_as/. """
+    информация будет выведена в консоль, дописана в журнал 'data_from_users.jsonl' и добавлена на страницу
+    about_as/. """
 
     # Запись даты и времени обращения пользователя
     date_now = datetime.datetime.now()
@@ -60,95 +111,233 @@ def feedback(request):
             message=values[5]
         )
 
-        # Запись обратной связи от пользователя в файл
+        # Запись обратной связи от пользователя в журнал
         fb_from_users = dict(zip(keys, values))
         print(fb_from_users)
         fb_from_users['time'] = date_now_str
-        with open('catalog/data_from_users.json', 'a') as file:
-            if os.stat('catalog/data_from_users.json').st_size == 0:
-                json.dump([fb_from_users], file)
-            else:
-                with open('catalog/data_from_users.json', 'r') as json_file:
-                    data_from_file = json.load(json_file)
-                    data_from_file.append(fb_from_users)
-                with open('catalog/data_from_users.json', 'w') as json_file:
-                    json.dump(data_from_file, json_file)
+        feedback_journal.append(fb_from_users)
     context = {
         'title': 'Catalogue: обратная связь'
     }
     return render(request, 'catalog/feedback.html', context)
 
 
-class ProductListView(ListView):
+class ProductListView(ProductsConditionalMixin, KeysetPaginationMixin, AsyncListView):
     """Контроллер генерирует страницу product_list.html, на которой представлены все объявления и все категории.
-    Добавлена пагинация, на каждой странице присутствуют до 5 объявлений. Реализован функционал по поиску товара
-    по имени."""
+    Добавлена пагинация по курсору, на каждой странице присутствуют до 5 объявлений. Реализован функционал по поиску
+    товара по имени. Контроллер асинхронный."""
 
     # Объявление переменных
     paginate_by = 5
     model = Product
-    my_form = 'catalog/products_by_keyword.html'
 
     def get_queryset(self):
+        """Метод возвращает опубликованные объекты модели Product с предзагруженными активными версиями."""
+
         queryset = super().get_queryset().filter(is_published=True)
-        return queryset
+        return with_active_versions(queryset)
 
-    def get_context_data(self, *args, **kwargs):
-        """Метод добавляет в context ключ categories, значение которого — это все объекты модели Category, и ключ
-        title со значением названия текущей вкладки."""
+    async def aget_context_data(self, **kwargs):
+        """Метод добавляет в context ключ categories, значение которого — это сводка по категориям для боковой
+        панели (количество опубликованных товаров и последние товары), и ключ title со значением названия текущей
+        вкладки."""
 
         # Вызов текущего контекста, унаследованного от базового класса
-        context = super().get_context_data(*args, **kwargs)
+        context = await super().aget_context_data(**kwargs)
 
         # Обновление контекста
-        context['categories'] = get_cached_categories()
+        context['categories'] = await aget_cached_category_summaries()
         context['title'] = 'Catalogue: все продукты'
-        context['versions'] = Version.objects.filter(is_active=True)
 
         return context
 
-    def post(self, request):
-        """Метод генерирует шаблон products_by_keyword.html, как результат поиска товара по ключу, полученному от
-         пользователя в POST-запросе."""
+    async def post(self, request):
+        """Метод перенаправляет POST-запрос с ключом поиска на страницу поиска товаров, которая обрабатывает
+        GET-запросы и может кэшироваться."""
 
-        word = request.POST.get('keyword')
+        word = request.POST.get('keyword', '').strip()
         if word:
-            return render(request, self.my_form, {'keyword': word})
+            return HttpResponseRedirect(f"{reverse('catalog:product_search')}?{urlencode({'q': word})}")
 
         return HttpResponseRedirect(reverse_lazy('catalog:product_list'))
 
 
+class ProductSearchView(TaggedCachePageMixin, AsyncListView):
+    """Контроллер генерирует страницу products_by_keyword.html с результатами поиска товара по ключу из GET-параметра
+    q. Результаты отсортированы по релевантности, на каждой странице присутствуют до 5 объявлений. Страницы
+    результатов кэшируются и сбрасываются при любом изменении товаров. Контроллер асинхронный."""
+
+    paginate_by = 5
+    template_name = 'catalog/products_by_keyword.html'
+    cache_timeout = 60 * 5
+
+    def get_cache_tags(self):
+        return [PRODUCTS_TAG, CATALOG_TAG]
+
+    async def get(self, request, *args, **kwargs):
+        self.keyword = request.GET.get('q', '').strip()
+        self.found = await asearch_products(self.keyword)
+        return await super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        """Метод возвращает опубликованные товары, найденные по ключу поиска."""
+        return self.found
+
+    def get_context_data(self, *args, **kwargs):
+        """Метод добавляет в context ключ поиска, параметры запроса для ссылок пагинации и название текущей
+        вкладки."""
+
+        context = super().get_context_data(*args, **kwargs)
+        context['keyword'] = self.keyword
+        context['paginate_query'] = f"{urlencode({'q': self.keyword})}&"
+        context['title'] = f'Catalogue: поиск «{self.keyword}»'
+
+        return context
+
+
 class ModerateProductList(PermissionRequiredMixin, ListView):
-    """Контроллер генерирует страницу moderate_products.html, на которой представлены все объявления, требующие
-    модерацию со стороны пользователя с необходимыми правами."""
+    """Контроллер генерирует страницу moderate_products.html с товарами, которые модератор взял на проверку из
+    очереди неопубликованных товаров (см. ClaimProductsView). Открытие страницы не закрепляет товары и не продлевает
+    срок закрепления. Непроверенные товары с истекшим сроком возвращаются в очередь."""
 
     model = Product
     template_name = 'catalog/moderate_products.html'
-    paginate_by = 5
     permission_required = 'catalog.set_published'
     extra_context = {
         'title': 'Модерация продуктов'
     }
 
     def get_queryset(self):
-        """Метод возвращает объекты модели Product, у которых статус is_published = False."""
-        return super().get_queryset().filter(is_published=False)
+        """Метод возвращает товары, закрепленные за модератором, с предзагруженными активными версиями."""
+        return claimed_products(self.request.user)
+
+    def get_context_data(self, *args, **kwargs):
+        """Метод добавляет в context список категорий для фильтра массовой модерации и срок закрепления товаров."""
+
+        context = super().get_context_data(*args, **kwargs)
+        context['categories'] = get_cached_categories()
+        context['claim_expires'] = max((obj.claim_expires for obj in context['object_list']), default=None)
+        return context
+
+
+class ClaimProductsView(PermissionRequiredMixin, View):
+    """Контроллер закрепляет за модератором товары из очереди модерации на время CLAIM_LEASE и продлевает срок
+    закрепления уже взятых товаров. Каждый модератор получает свои товары."""
+
+    permission_required = 'catalog.set_published'
+
+    def post(self, request):
+        claim_products(request.user)
+        return HttpResponseRedirect(reverse('catalog:moderate_products'))
+
+
+class ReleaseProductsView(PermissionRequiredMixin, View):
+    """Контроллер возвращает в очередь модерации все товары, закрепленные за модератором."""
+
+    permission_required = 'catalog.set_published'
+
+    def post(self, request):
+        release_products(request.user)
+        return HttpResponseRedirect(reverse('catalog:index'))
+
+
+class BulkModerateProductsView(PermissionRequiredMixin, View):
+    """Контроллер публикует или снимает с публикации сразу много товаров: выбранные на странице moderate_products.html
+    или все товары, подходящие под фильтр (категория и дата добавления). Изменения применяются пачками, одним запросом
+    UPDATE на пачку."""
+
+    permission_required = 'catalog.set_published'
+
+    def post(self, request):
+        form = BulkModerationForm(request.POST)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+
+        set_published(form.get_queryset(), form.cleaned_data['action'] == BulkModerationForm.ACTION_PUBLISH)
+        return HttpResponseRedirect(reverse('catalog:moderate_products'))
 
 
-class FeedBackListView(ListView):
-    """Контроллер генерирует страницу feedback_list.html, на которой представлены все отзывы, хранящиеся в
-    модели FeedBack."""
+class FeedBackListView(KeysetPaginationMixin, ListView):
+    """Контроллер генерирует страницу feedback_list.html, на которой представлены отзывы, хранящиеся в
+    модели FeedBack. Добавлена пагинация по курсору, на каждой странице присутствуют до 9 отзывов."""
 
     model = Feedback
+    paginate_by = 9
+    keyset_field = 'publish'
     extra_context = {
         'title': 'Catalogue: о нас'
     }
 
 
-class ProductDetailView(DetailView):
-    """Контроллер генерирует страницу product_detail.html, на которой представлена информация о конкретном товаре."""
+class Echo:
+    """Псевдобуфер для csv.writer: метод write возвращает строку вместо записи, чтобы строки CSV можно было отдавать
+    потоком."""
 
-    model = Product
+    def write(self, value):
+        return value
+
+
+class FeedbackExportView(PermissionRequiredMixin, View):
+    """Контроллер выгружает отзывы из модели Feedback в формате CSV или JSON Lines с фильтрацией по диапазону дат и
+    стране. Ответ формируется потоком: строки читаются из базы данных серверным курсором пачками, поэтому
+    расход памяти не зависит от количества отзывов."""
+
+    permission_required = 'catalog.view_feedback'
+    fields = ('id', 'first_name', 'last_name', 'email', 'phone', 'country', 'message', 'publish')
+    chunk_size = 2000
+
+    def get(self, request):
+        form = FeedbackExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+
+        # Фильтрация отзывов по параметрам запроса
+        queryset = Feedback.objects.order_by('publish', 'pk')
+        if form.cleaned_data['date_from']:
+            queryset = queryset.filter(publish__date__gte=form.cleaned_data['date_from'])
+        if form.cleaned_data['date_to']:
+            queryset = queryset.filter(publish__date__lte=form.cleaned_data['date_to'])
+        if form.cleaned_data['country']:
+            queryset = queryset.filter(country=form.cleaned_data['country'])
+        rows = queryset.values_list(*self.fields).iterator(chunk_size=self.chunk_size)
+
+        if form.cleaned_data['format'] == FeedbackExportForm.FORMAT_JSONL:
+            content = (json.dumps(dict(zip(self.fields, row)), ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
+                       for row in rows)
+            response = StreamingHttpResponse(content, content_type='application/x-ndjson; charset=utf-8')
+            filename = 'feedback.jsonl'
+        else:
+            writer = csv.writer(Echo())
+            content = itertools.chain([writer.writerow(self.fields)], (writer.writerow(row) for row in rows))
+            response = StreamingHttpResponse(content, content_type='text/csv; charset=utf-8')
+            filename = 'feedback.csv'
+
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class ProductDetailView(ConditionalGetMixin, TaggedCachePageMixin, AsyncDetailView):
+    """Контроллер генерирует страницу product_detail.html, на которой представлена информация о конкретном товаре.
+    Страница кэшируется с тегами товара и его категории и сбрасывается при их изменении или изменении версий товара.
+    Условные GET-запросы проверяются по дате изменения товара и версиям тех же тегов. Контроллер асинхронный."""
+
+    queryset = Product.objects.select_related('category', 'user_product')
+
+    def get_cache_tags(self):
+        return [product_tag(self.object.pk), category_tag(self.object.category_id), CATALOG_TAG]
+
+    async def aget_last_modified(self):
+        if not hasattr(self, '_product_state'):
+            self._product_state = await Product.objects.filter(pk=self.kwargs['pk']).values_list(
+                'changed', 'category_id').afirst()
+        return self._product_state[0] if self._product_state else None
+
+    async def aget_etag_parts(self):
+        if await self.aget_last_modified() is None:
+            return None
+        changed, category_id = self._product_state
+        versions = await aget_tag_versions([product_tag(self.kwargs['pk']), category_tag(category_id), CATALOG_TAG])
+        return [changed, *sorted(versions.items())]
 
     def get_context_data(self, **kwargs):
         """Метод добавляет в context ключ title, значение которого — это название рассматриваемого товара."""
@@ -157,8 +346,7 @@ class ProductDetailView(DetailView):
         context = super().get_context_data(**kwargs)
 
         # Обновление контекста
-        product_name = Product.objects.get(pk=self.kwargs.get('pk'))
-        context['title'] = f'Catalogue: {product_name.name}'
+        context['title'] = f'Catalogue: {self.object.name}'
 
         return context
 
@@ -186,20 +374,18 @@ class ProductCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         """Метод возвращает только валидную форму. Объекты в модели Product могут создать только авторизованные
-        пользатели, причем эти пользователи автоматически присваиваются к создаваемому объекту."""
-
-        if form.is_valid():
-            self.object = form.save()
-            self.object.user_product = self.request.user
-            self.object.save()
+        пользатели, причем эти пользователи автоматически присваиваются к создаваемому объекту. Товар создается одним
+        запросом INSERT."""
 
-        return super().form_valid(form)
+        form.instance.user_product = self.request.user
+        with transaction.atomic():
+            return super().form_valid(form)
 
 
 class ProductUpdateView(LoginRequiredMixin, UpdateView):
     """Контроллер на основе шаблона product_form.html позволяет редактировать объявление по модели Product."""
 
-    model = Product
+    queryset = Product.objects.select_related('user_product')
     form_class = ProductForm
     extra_context = {
         'title': 'Изменение товара'
@@ -212,12 +398,23 @@ class ProductUpdateView(LoginRequiredMixin, UpdateView):
 
         self.object = super().get_object(queryset)
         current_user = self.request.user
-        if current_user == self.get_context_data()['product_user'] or self.request.user.has_perm(
-                'catalog.change_product'):
+        if self.object.user_product_id == current_user.pk or current_user.has_perm('catalog.change_product'):
             return self.object
         else:
             raise Http404
 
+    def get_formset(self):
+        """Метод возвращает вложенную форму версий товара. Форма создается один раз за запрос, поэтому версии
+        товара выбираются из базы данных один раз, а ошибки сохранения остаются в форме при повторном выводе."""
+
+        if not hasattr(self, '_formset'):
+            VersionFormset = inlineformset_factory(Product, Version, form=VersionForm, extra=1,
+                                                   formset=VersionBaseInlineFormSet)
+            data = self.request.POST if self.request.method == 'POST' else None
+            self._formset = VersionFormset(data, instance=self.object)
+
+        return self._formset
+
     def get_context_data(self, **kwargs):
         """Метод добавляет в контекст шаблонные переменные category со всеми объектами из модели Category, title с
         названием текущей вкладки и product_user с привязанным к текущему продукту пользователем."""
@@ -229,48 +426,36 @@ class ProductUpdateView(LoginRequiredMixin, UpdateView):
         context['categories'] = get_cached_categories()
         context['title'] = 'Добавление товара'
         context['product_user'] = self.object.user_product
+        context['formset'] = self.get_formset()
 
-        # Объявление вложенной формы
-        VersionFormset = inlineformset_factory(Product, Version, form=VersionForm, extra=1,
-                                               formset=VersionBaseInlineFormSet)
-
-        # Добавление вложенный формы в контекст
-        if self.request.method == 'POST':
-            formset = VersionFormset(self.request.POST, instance=self.object)
-        else:
-            formset = VersionFormset(instance=self.object)
-
-        context['formset'] = formset
         return context
 
     def form_valid(self, form):
         """Метод возвращает только валидную форму. Объекты в модели Product могут изменять только авторизованные
-        пользатели, к тому же пользователи не могут изменять публикации, создателями которых они не являются."""
+        пользатели, к тому же пользователи не могут изменять публикации, создателями которых они не являются. Товар
+        сохраняется одним запросом UPDATE, а версии — пачкой, в одной транзакции и только если вложенная форма тоже
+        валидна."""
+
+        formset = self.get_formset()
+        if not formset.is_valid():
+            return self.form_invalid(form)
 
-        # Получение вложенных форм
-        context_data = self.get_context_data()
-        formset = context_data['formset']
+        # Если текущий пользователь не персонал, то в поле user_product модели Product запишется текущий
+        # пользователь, иначе — нет.
+        if not self.request.user.is_staff:
+            form.instance.user_product = self.request.user
 
         with transaction.atomic():
-            if form.is_valid():
-                self.object = form.save()
-
-                # Если текущий пользователь не персонал, то в поле user_product модели Product запишется текущий
-                # пользователь, иначе — нет.
-                if not self.request.user.is_staff:
-                    self.object.user_product = self.request.user
-                    self.object.save()
-                self.object.save()
-                if formset.is_valid():
-                    if not self.request.user.is_staff:
-                        self.object.user_product = self.request.user
-                        self.object.save()
-                    formset.instance = self.object
-                    formset.save()
-                else:
-                    return super().form_invalid(form)
-
-        return super().form_valid(form)
+            self.object = form.save()
+            formset.instance = self.object
+            formset.save()
+            # Версии не сохранены из-за второй активной версии: изменения товара тоже отменяются
+            if formset.non_form_errors():
+                transaction.set_rollback(True)
+
+        if formset.non_form_errors():
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
         """Метод возвращает страницу product_detail.html при успешном обновлении объявления."""
@@ -305,7 +490,7 @@ class ProductDeleteView(LoginRequiredMixin, DeleteView):
 
         self.object = super().get_object(queryset)
         current_user = self.request.user
-        if current_user == self.object.user_product or self.request.user.is_superuser:
+        if self.object.user_product_id == current_user.pk or current_user.is_superuser:
             return self.object
         else:
             raise Http404
@@ -325,21 +510,19 @@ class CategoryCreateView(PermissionRequiredMixin, CreateView):
 
     def form_valid(self, form):
         """Метод возвращает только валидную форму. Объекты в модели Category могут создать только авторизованные
-        пользатели, причем эти пользователи автоматически присваиваются к создаваемому объекту."""
-
-        if form.is_valid():
-            self.object = form.save()
-            self.object.user_category = self.request.user
-            self.object.save()
+        пользатели, причем эти пользователи автоматически присваиваются к создаваемому объекту. Категория создается
+        одним запросом INSERT."""
 
-        return super().form_valid(form)
+        form.instance.user_category = self.request.user
+        with transaction.atomic():
+            return super().form_valid(form)
 
 
 class CategoryUpdateView(LoginRequiredMixin, UpdateView):
     """Контроллер на основе шаблона category_form.html позволяет редактировать категорию по модели Category. При
     успешном редактировании произойдет переадресация на страницу product_list.html."""
 
-    model = Category
+    queryset = Category.objects.select_related('user_category')
     form_class = CategoryForm
     success_url = reverse_lazy('catalog:product_list')
     extra_context = {
@@ -366,20 +549,13 @@ class CategoryUpdateView(LoginRequiredMixin, UpdateView):
 
     def form_valid(self, form):
         """Метод возвращает только валидную форму. Объекты в модели Category могут изменять только авторизованные
-        пользатели, к тому же пользователи не могут изменять публикации, создателями которых они не являются."""
-
-        # Получение привязанного пользователя к текущей публикации
-        context_data = self.get_context_data()
-        category_user = context_data['category_user']
-
-        if form.is_valid():
-            self.object = form.save()
-            if not self.request.user.is_staff:
-                self.object.user_category = self.request.user
-                self.object.save()
-            self.object.save()
+        пользатели, к тому же пользователи не могут изменять публикации, создателями которых они не являются. Категория
+        сохраняется одним запросом UPDATE."""
 
-        return super().form_valid(form)
+        if not self.request.user.is_staff:
+            form.instance.user_category = self.request.user
+        with transaction.atomic():
+            return super().form_valid(form)
 
 
 class CategoryDeleteView(PermissionRequiredMixin, DeleteView):
@@ -406,22 +582,19 @@ class BlogCreateView(LoginRequiredMixin, CreateView):
     }
 
     def form_valid(self, form):
-        """Метод при успешной генерации формы создает динамически slug для публикации на основе его названия."""
-
-        if form.is_valid():
-            new_mat = form.save()
-            new_mat.slug = slugify(new_mat.title)
-            new_mat.save()
-            self.object = form.save()
-            self.object.user_blog = self.request.user
-            self.object.save()
+        """Метод при успешной генерации формы создает динамически slug для публикации на основе его названия.
+        Публикация создается одним запросом INSERT."""
 
-        return super().form_valid(form)
+        form.instance.slug = slugify(form.cleaned_data['title'])
+        form.instance.user_blog = self.request.user
+        with transaction.atomic():
+            return super().form_valid(form)
 
 
-class BlogListView(ListView):
+class BlogListView(KeysetPaginationMixin, AsyncListView):
     """Контроллер генерирует страницу blog_list.html, на которой представлены все публикации, хранящиеся в
-    модели Blog. В странице есть пагинация, которая отображает до 3 публикаций на одной странице."""
+    модели Blog. В странице есть пагинация по курсору, которая отображает до 3 публикаций на одной странице.
+    Контроллер асинхронный."""
 
     paginate_by = 3
     model = Blog
@@ -430,54 +603,61 @@ class BlogListView(ListView):
     }
 
     def get_queryset(self):
-        """Метод возвращает только те публикации, для которых поле is_active есть True."""
+        """Метод возвращает только те публикации, для которых поле is_active есть True, вместе с их авторами."""
 
         queryset = super().get_queryset()
-        queryset = queryset.filter(is_active=True)
+        queryset = queryset.filter(is_active=True).select_related('user_blog')
 
         return queryset
 
 
-class BlogDetailView(DetailView):
-    """Контроллер генерирует страницу blog_detail.html, на которой представлена информация о конкретной публикации."""
+class BlogDetailView(ConditionalGetMixin, AsyncDetailView):
+    """Контроллер генерирует страницу blog_detail.html, на которой представлена информация о конкретной публикации.
+    Условные GET-запросы проверяются по дате изменения публикации и количеству просмотров, которое выводится на
+    странице. Повторная проверка страницы, на которую отдан ответ 304, не считается просмотром. Контроллер
+    асинхронный."""
 
-    model = Blog
+    queryset = Blog.objects.select_related('user_blog')
 
-    def get_object(self, queryset=None):
-        """Метод инкрементирует поле view_count на 1 для конкретной публикации при обращениий к ней. Если view_count
-        равняется 100, то пользователь получит письмо на указанный электронный адрес с поздравлением."""
+    async def aget_last_modified(self):
+        # Количество просмотров меняется без изменения даты публикации, поэтому проверка выполняется только по ETag
+        return None
 
-        # Обращение к текущему объекту модели Blog
-        self.object = super().get_object(queryset)
-        self.object.view_count += 1
-        self.object.save()
+    async def aget_etag_parts(self):
+        state = await Blog.objects.filter(pk=self.kwargs['pk']).values_list('changed', 'view_count').afirst()
+        if state is None:
+            return None
+        changed, view_count = state
+        return [changed, view_count + await apending_views(self.kwargs['pk'])]
 
-        # Создание заголовка и тела сообщения для отправки на электронный адрес
-        message = f'Поздравляем!\nВаша публикация "{self.object.title}" на сайте Catalogue набрала ' \
-                  f'{self.object.view_count} просмотров!\n\n С уважением, Администрация сайта!'
-        subject = 'Поздравление от сайта Catalogue'
+    def get_response_etag_parts(self):
+        # Страница выводит количество просмотров с учетом текущего, поэтому ETag ответа вычисляется после его учета
+        return [self.object.changed, self.object.view_count]
 
-        # Объявление получателя сообщения
-        recipient = self.object.email
+    async def aget_object(self, queryset=None):
+        """Метод учитывает просмотр конкретной публикации при обращении к ней. Просмотры накапливаются вне базы данных
+        и переносятся в нее пачками (см. catalog.counters); поздравление автору публикации, набравшей 100
+        просмотров, отправляет команда flush_blog_views. На странице выводится количество просмотров с учетом еще не
+        перенесенных."""
+
+        # Обращение к текущему объекту модели Blog
+        blog = await super().aget_object(queryset)
+        blog.view_count += await arecord_view(blog.pk)
 
-        # Отправка сообщения пользователю, если количество просмотров равно 100
-        if self.object.view_count == 100:
-            send_mail(subject, message, os.getenv('yandex_login'), (recipient,))
-        return self.object
+        return blog
 
     def get_context_data(self, **kwargs):
         """Метод добавляет в контекст ключ title со значением — название текущей публикации."""
 
         context = super().get_context_data(**kwargs)
-        blog_title = Blog.objects.get(pk=self.kwargs.get('pk'))
-        context['title'] = blog_title.title
+        context['title'] = self.object.title
         return context
 
 
 class BlogUpdateView(LoginRequiredMixin, UpdateView):
     """Контроллер на основе шаблона идщп_form.html позволяет редактировать публикацию по модели Blog."""
 
-    model = Blog
+    queryset = Blog.objects.select_related('user_blog')
     form_class = BlogForm
     success_url = reverse_lazy('catalog:blog_list')
     extra_context = {
@@ -490,7 +670,7 @@ class BlogUpdateView(LoginRequiredMixin, UpdateView):
 
         self.object = super().get_object(queryset)
         current_user = self.request.user
-        if current_user == self.object.user_blog or self.request.user.has_perm('catalog.change_blog'):
+        if self.object.user_blog_id == current_user.pk or current_user.has_perm('catalog.change_blog'):
             return self.object
         else:
             raise Http404
@@ -510,20 +690,13 @@ class BlogUpdateView(LoginRequiredMixin, UpdateView):
 
     def form_valid(self, form):
         """Метод возвращает только валидную форму. Объекты в модели Blog могут изменять только авторизованные
-        пользатели, к тому же пользователи не могут изменять публикации, создателями которых они не являются."""
-
-        # Получение текущего авторизованного пользователя
-        context_data = self.get_context_data()
-        user_blog = context_data['user_blog']
+        пользатели, к тому же пользователи не могут изменять публикации, создателями которых они не являются.
+        Публикация сохраняется одним запросом UPDATE."""
 
-        if form.is_valid():
-            self.object = form.save()
-            if not self.request.user.is_staff:
-                self.object.user_blog = self.request.user
-                self.object.save()
-            self.object.save()
-
-        return super().form_valid(form)
+        if not self.request.user.is_staff:
+            form.instance.user_blog = self.request.user
+        with transaction.atomic():
+            return super().form_valid(form)
 
 
 class BlogDeleteView(LoginRequiredMixin, DeleteView):
@@ -535,3 +708,17 @@ class BlogDeleteView(LoginRequiredMixin, DeleteView):
     extra_context = {
         'title': 'Удаление публикации'
     }
+
+
+class MetricsView(View):
+    """Контроллер возвращает метрики запросов по адресам в текстовом формате Prometheus (см. catalog.metrics). Метрики
+    доступны только с заголовком Authorization: Bearer <токен> из METRICS_TOKEN; без METRICS_TOKEN страница закрыта.
+    При выключенном METRICS_ENABLED возвращается 404."""
+
+    def get(self, request):
+        if not settings.METRICS_ENABLED:
+            raise Http404
+        token = settings.METRICS_TOKEN
+        if not token or not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
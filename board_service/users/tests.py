@@ -1,3 +1,60 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from catalog.models import OutgoingEmail
+from catalog.tests import query_budget
+from catalog.tests.query_budget import budgets
+from users.models import User
+from users.urls import urlpatterns
+
+
+class UsersQueryBudgetTest(query_budget.QueryBudgetTestCase):
+    """Бюджеты запросов страниц пользователей."""
+
+    urlpatterns = urlpatterns
+    namespace = 'users'
+    page_budgets = {
+        'login': budgets((0, 0), (4, 0), (2, 0)),
+        'logout': budgets((0, 0), (4, 0), (4, 0)),
+        'register': budgets((0, 0), (4, 0), (2, 0)),
+        'profile': budgets((0, 0), (4, 0), (2, 0)),
+        'verify_registration': budgets((2, 0), (6, 0), (4, 0)),
+        'reset_password': budgets((0, 0), (4, 0), (2, 0)),
+        'password_change': budgets((0, 0), (4, 0), (2, 0)),
+        'password_change_done': budgets((0, 0), (4, 0), (2, 0)),
+    }
+
+    def get_url_kwargs(self, name):
+        if name == 'verify_registration':
+            pending_user = self.data['pending_user']
+            return {'user_pk': pending_user.pk, 'user_identity': pending_user.user_identity}
+        return {}
+
+
+class PasswordResetTest(TestCase):
+    """Письмо с новым паролем ставится в очередь исходящих писем в одной транзакции со сменой пароля."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@example.com')
+        cls.user.set_password('old-password')
+        cls.user.save()
+
+    def request_reset(self, email):
+        return self.client.post(reverse('users:reset_password'), {'email': email})
+
+    def test_new_password_is_queued(self):
+        response = self.request_reset('user@example.com')
+
+        self.assertTemplateUsed(response, 'users/reset_password_done.html')
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.recipients, ['user@example.com'])
+        new_password = email.message.split('Ваш новый пароль: ')[1].split()[0]
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password(new_password))
+
+    def test_unknown_email(self):
+        response = self.request_reset('nobody@example.com')
+
+        self.assertTemplateUsed(response, 'users/reset_password.html')
+        self.assertFalse(OutgoingEmail.objects.exists())
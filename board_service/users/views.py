@@ -2,12 +2,14 @@ import random
 import string
 
 from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView as BaseLoginView, PasswordChangeView as BasePasswordChangeView
-from django.core.mail import send_mail
+from django.db import transaction
 from django.shortcuts import render
 from django.urls import reverse_lazy
 from django.views.generic import CreateView, UpdateView
 
+from catalog.outbox import enqueue_mail
 from users.forms import LoginForm, UserRegisterForm, UserProfileForm, UserChangePasswordForm
 from users.models import User
 
@@ -37,16 +39,17 @@ class UserRegisterView(CreateView):
             # Генерирование ключа
             user_key = ''.join(random.choice(string.digits + string.ascii_lowercase) for _ in range(20))
             self.object.user_identity = user_key
-            self.object = form.save()
 
-            # Отправка email
-            send_mail(
-                subject='Подтвержение регистрации на портале <Catalogue>.',
-                message=f'Здравстуйте, {self.object.email}!\n Для завершения регистрации, пожалуйста, перейдите по'
-                        f' ссылкe:\n\nhttp://127.0.0.1:8000/users/{self.object.pk}/{user_key}',
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[self.object.email, ]
-            )
+            # Сохранение пользователя и постановка email в очередь исходящих писем в одной транзакции
+            with transaction.atomic():
+                self.object = form.save()
+                enqueue_mail(
+                    subject='Подтвержение регистрации на портале <Catalogue>.',
+                    message=f'Здравстуйте, {self.object.email}!\n Для завершения регистрации, пожалуйста, перейдите по'
+                            f' ссылкe:\n\nhttp://127.0.0.1:8000/users/{self.object.pk}/{user_key}',
+                    from_email=settings.EMAIL_HOST_USER,
+                    recipient_list=[self.object.email, ]
+                )
 
             return render(self.request, 'users/verify_registration.html')
 
@@ -83,8 +86,8 @@ def verify_registration(request, user_pk, user_identity):
     return render(request, 'users/verify_registration.html', context)
 
 
-class UserProfileView(UpdateView):
-    """Класс контроллер для изменения данных текущего пользователя."""
+class UserProfileView(LoginRequiredMixin, UpdateView):
+    """Класс контроллер для изменения данных текущего пользователя. Доступен только авторизованным пользователям."""
     success_url = reverse_lazy('catalog:index')
     form_class = UserProfileForm
     model = User
@@ -117,19 +120,20 @@ def user_reset_password(request):
             new_password = ''.join(random.choice(string.digits + string.ascii_lowercase) for _ in range(12))
             user = User.objects.get(email=f'{user_email}')
             user.set_password(new_password)
-            user.save()
-
-            # Отправка email пользователю с новым паролем
-            send_mail(
-                subject='Cброс пароля на портале <Catalogue>.',
-                message=f'Здравстуйте!\n\nС вашей учетной записи поступил запрос на отправку нового пароля\n\n\n\n.'
-                        f'Ваш новый пароль: {new_password}\nЕсли это не Ваш запрос, не беспокойтесь.'
-                        f'Это сообщение видно только вам.'
-                        f'Если это ошибка, просто войдите на сайт с Вашим новым паролем и затем измените его согласно '
-                        f'вашим предпочтениям.\n\n\nС уважением, администрация портала <Catalogue>.',
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[user_email, ]
-            )
+
+            # Сохранение пароля и постановка email с новым паролем в очередь исходящих писем в одной транзакции
+            with transaction.atomic():
+                user.save()
+                enqueue_mail(
+                    subject='Cброс пароля на портале <Catalogue>.',
+                    message=f'Здравстуйте!\n\nС вашей учетной записи поступил запрос на отправку нового пароля'
+                            f'\n\n\n\n.Ваш новый пароль: {new_password}\nЕсли это не Ваш запрос, не беспокойтесь.'
+                            f'Это сообщение видно только вам.'
+                            f'Если это ошибка, просто войдите на сайт с Вашим новым паролем и затем измените его '
+                            f'согласно вашим предпочтениям.\n\n\nС уважением, администрация портала <Catalogue>.',
+                    from_email=settings.EMAIL_HOST_USER,
+                    recipient_list=[user_email, ]
+                )
             return render(request, 'users/reset_password_done.html', context)
 
         return render(request, template_name, context)